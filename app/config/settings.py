@@ -1,32 +1,114 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
     # 应用基本配置
     APP_NAME: str = "本地知识库AI问答系统"
     API_V1_STR: str = "/api/v1"
+    STARTUP_TIME_BUDGET: float = 2.0  # 启动耗时预算（秒，从导入app.main到开始接收请求），超出时记录警告
+    SERVER_TIMING_ENABLED: bool = True  # 是否在响应头中返回Server-Timing（各阶段耗时）
     
     # 文件上传配置
     UPLOAD_DIR: str = "uploads"
+    DATA_DIR: str = "data"  # 本地持久化数据（缓存、索引等）目录
+    DOCUMENT_REGISTRY_PATH: str = "data/documents.sqlite3"  # 文档登记表（内容哈希去重）
     MAX_FILE_SIZE: int = 30 * 1024 * 1024  # 30MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 流式写盘的分块大小（1MB）
     ALLOWED_EXTENSIONS: List[str] = ["txt", "docx", "doc", "docm", "pdf", "ppt", "pptx"]
+
+    # 入库任务队列配置
+    INGEST_WORKERS: int = 2  # 并发处理入库任务的worker数
+    INGEST_QUEUE_SIZE: int = 100  # 排队任务上限，超出时上传接口返回503
+    INGEST_MAX_RETRIES: int = 3  # 瞬时错误（Ollama/Milvus不可用等）的最大重试次数
+    INGEST_RETRY_BACKOFF: float = 2.0  # 首次重试等待秒数，之后指数递增
+    INGEST_JOB_RETENTION: int = 1000  # 内存中保留的任务记录数
+    INGEST_PIPELINE_DEPTH: int = 2  # 流水线各阶段之间最多缓冲的批次数（背压，限制内存占用）
+
+    # 文档解析进程池配置
+    EXTRACT_WORKERS: int = max((os.cpu_count() or 2) - 1, 1)  # 解析进程数
+    EXTRACT_TIMEOUT: float = 300.0  # 单个文件解析超时（秒），超时会终止解析进程
+    PDF_PARALLEL_MIN_PAGES: int = 50  # 页数达到该值的PDF按页分段并行解析
+    PDF_PAGES_PER_TASK: int = 20  # 并行解析时每段的页数
+    TOKENIZE_WORKERS: int = max((os.cpu_count() or 2) // 2, 1)  # 入库分词进程数（独立于解析进程池）
+    TOKENIZE_TIMEOUT: float = 120.0  # 单批文档块分词超时（秒），超时只终止分词进程
+
+    # .doc/.ppt转换配置
+    OFFICE_CONVERTER_BACKEND: str = "auto"  # auto（Windows用win32，其他系统用soffice）/ soffice / win32
+    OFFICE_CONVERT_TIMEOUT: float = 120.0  # 单个文件转换超时（秒），超时会终止并回收转换进程
+    SOFFICE_PATH: str = "soffice"  # LibreOffice可执行文件
+    SOFFICE_WORKERS: int = 2  # 常驻的headless soffice进程数
+    SOFFICE_START_TIMEOUT: float = 30.0  # 等待soffice进程就绪的超时（秒）
+    SOFFICE_MAX_CONVERSIONS: int = 200  # 每个soffice进程转换该数量的文件后重启，避免内存持续增长
     
+    # 向量存储配置
+    VECTOR_STORE_BACKEND: str = "milvus"  # milvus / numpy（进程内内存映射文件，无需Milvus，适合几十万块以内）
+    NUMPY_STORE_DIR: str = "data/vectors"  # numpy后端的向量文件和元数据目录
+    NUMPY_STORE_DTYPE: str = "float32"  # numpy后端的向量存储精度：float32 / float16（节省一半空间）
+    NUMPY_STORE_COMPACT_RATIO: float = 0.3  # 已删除行占比超过该值时在加载/退出时压缩向量文件
+
     # Milvus配置
     MILVUS_HOST: str = "localhost"
     MILVUS_PORT: int = 19530
     COLLECTION_NAME: str = "document_chunks"
     VECTOR_DIM: int = 1024  # bge-m3 向量维度
+    MILVUS_BUFFER_MAX_ROWS: int = 1000  # 写缓冲区累积到该行数时立即批量写入
+    MILVUS_BUFFER_MAX_DELAY: float = 2.0  # 缓冲数据最长等待写入时间（秒）
+    MILVUS_VECTOR_DTYPE: str = "float32"  # 新建集合的向量字段精度：float32 / float16（FLOAT16_VECTOR，需Milvus 2.4+，存储减半）
+    # 索引类型按集合行数自动选择：FLAT（精确检索）→ IVF_FLAT → HNSW，行数越过阈值时自动重建
+    MILVUS_IVF_MIN_ROWS: int = 20000  # 达到该行数改用IVF_FLAT（nlist取4*sqrt(行数)）
+    MILVUS_HNSW_MIN_ROWS: int = 1000000  # 达到该行数改用HNSW
+    MILVUS_HNSW_M: int = 16
+    MILVUS_HNSW_EF_CONSTRUCTION: int = 200
+    MILVUS_INDEX_AUTO_REBUILD: bool = True  # 是否在行数越过阈值时自动重建索引（在新集合上建索引，加载完成后切换别名，期间临时占用双份内存）
+    MILVUS_SEARCH_NPROBE: Optional[int] = None  # IVF默认nprobe，None时按nlist自动选择（nlist/32，至少8）
+    MILVUS_SEARCH_EF: Optional[int] = None  # HNSW默认ef，None时取max(64, 2*top_k)
     
     # Ollama配置
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     EMBEDDING_MODEL: str = "bge-m3"
     RERANK_MODEL: str = "bge-reranker-v2-m3"
     LLM_MODEL: str = "deepseek-coder:7b"
+
+    # Ollama连接池配置
+    OLLAMA_POOL_SIZE: int = 32  # 连接池最大连接数
+    OLLAMA_KEEPALIVE_TIMEOUT: float = 60.0  # 空闲连接保活时间（秒）
+    OLLAMA_CONNECT_TIMEOUT: float = 10.0  # 建立连接超时（秒）
+    OLLAMA_EMBED_TIMEOUT: float = 60.0  # 嵌入请求超时（秒）
+    OLLAMA_RERANK_TIMEOUT: float = 60.0  # 重排序请求超时（秒）
+    OLLAMA_GENERATE_TIMEOUT: float = 300.0  # 生成请求超时（秒）
+
+    # Ollama请求调度配置（interactive为问答，bulk为入库和批量问答，名额空闲时优先分配给interactive）
+    OLLAMA_MAX_CONCURRENCY: int = 8  # 同时发往Ollama的请求总数上限
+    OLLAMA_INTERACTIVE_CONCURRENCY: int = 8  # 问答通道的并发上限
+    OLLAMA_BULK_CONCURRENCY: int = 4  # 批量通道的并发上限（小于总数，保证问答始终有名额）
+    OLLAMA_INTERACTIVE_MAX_QUEUE: int = 64  # 问答通道排队上限，超出时接口返回429（0表示不限制）
+    OLLAMA_BULK_MAX_QUEUE: int = 0  # 批量通道排队上限（0表示不限制，入库只排队等待）
+    OLLAMA_BUSY_RETRY_AFTER: int = 1  # 返回429时Retry-After响应头的秒数
+    OLLAMA_SINGLE_FLIGHT: bool = True  # 相同的并发请求（同一问题、同一批文本）是否合并为一次上游调用
+
+    # 批量嵌入配置
+    EMBEDDING_BATCH_MAX_SIZE: int = 32  # 单批最多文本条数
+    EMBEDDING_BATCH_MAX_CHARS: int = 16000  # 单批文本总字符数上限
+    EMBEDDING_MAX_CONCURRENCY: int = 4  # 同时进行中的批次数
+
+    # 嵌入缓存配置
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MEMORY_SIZE: int = 20000  # 内存LRU层最多缓存的向量条数
+    EMBEDDING_CACHE_PATH: str = "data/embedding_cache.sqlite3"  # 磁盘层SQLite文件
+    EMBEDDING_CACHE_DISK_MAX_ROWS: int = 2000000  # 磁盘层最多保留的向量条数，超出时淘汰最早写入的（只持久化文档块，问题的嵌入只进内存层）
+
+    # 重排序配置
+    RERANK_MODE: str = "generate"  # generate：通过/api/generate让模型输出分数（标准Ollama可用）；cross_encoder：调用重排序接口直接打分
+    RERANK_ENDPOINT: str = "/api/rerank"  # 交叉编码器重排序接口路径（标准Ollama没有该接口，需要支持它的服务；返回404时自动改用generate）
+    RERANK_BATCH_SIZE: int = 16  # 单次交叉编码器请求的文档数
+    RERANK_MAX_CONCURRENCY: int = 4  # 同时进行中的重排序请求数
+    RERANK_CACHE_SIZE: int = 10000  # (查询, 文档块)得分缓存条数
     
     # 文本分块配置
     CHUNK_SIZE: int = 500
     CHUNK_OVERLAP: int = 50
+    CHUNK_SIZE_UNIT: str = "char"  # CHUNK_SIZE/CHUNK_OVERLAP的计量单位：char（字符数）或 token（近似token数）
     
     # 检索配置
     TOP_K: int = 5
@@ -34,11 +116,22 @@ class Settings(BaseSettings):
     BM25_WEIGHT: float = 0.3
     FINAL_CHUNKS_COUNT: int = 3
 
+    # 批量问答配置（/ask/batch）
+    ASK_BATCH_MAX_QUESTIONS: int = 1000  # 单次请求最多问题数
+    ASK_BATCH_MAX_CONCURRENCY: int = 4  # 同时进行重排序和生成的问题数
+
+    # BM25倒排索引配置
+    BM25_INDEX_PATH: str = "data/bm25_index.sqlite3"
+    BM25_K1: float = 1.5
+    BM25_B: float = 0.75
+    JIEBA_USER_DICT: Optional[str] = None  # jieba自定义词典（领域术语，每行“词 [词频] [词性]”），修改后需重新入库文档
+
     class Config:
         case_sensitive = True
 
 # 创建全局设置实例
 settings = Settings()
 
-# 确保上传目录存在
+# 确保上传目录和数据目录存在
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+os.makedirs(settings.DATA_DIR, exist_ok=True)
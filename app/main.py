@@ -1,13 +1,46 @@
-from fastapi import FastAPI
+import time
+
+# 记录导入起点，用于统计启动耗时（需放在其他导入之前）
+_import_started = time.perf_counter()
+
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import upload_router, qa_router
 from app.config.settings import settings
+from app.services.container import ServiceContainer
+from app.utils.metrics import MetricsMiddleware, registry
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建服务容器，退出时释放；耗时的预热在后台进行"""
+    services = ServiceContainer()
+    app.state.services = services
+    await services.start()
+    services.timings["startup"] = time.perf_counter() - _import_started
+    if services.timings["startup"] > settings.STARTUP_TIME_BUDGET:
+        logger.warning(
+            "启动耗时%.2f秒，超出预算%.2f秒：%s",
+            services.timings["startup"],
+            settings.STARTUP_TIME_BUDGET,
+            services.timings
+        )
+    try:
+        yield
+    finally:
+        await services.stop()
 
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.APP_NAME,
     description="基于FastAPI、Milvus和Ollama的本地知识库AI问答系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -17,8 +50,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# 请求耗时统计和Server-Timing响应头
+app.add_middleware(MetricsMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
+
 # 注册路由
 app.include_router(
     upload_router.router,
@@ -44,10 +81,20 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """
-    健康检查接口
+    健康检查接口（ready表示预热已完成，timings为启动各阶段耗时）
     """
+    services = request.app.state.services
     return {
-        "status": "healthy"
+        "status": "healthy",
+        "ready": services.ready,
+        "timings": {name: round(seconds, 3) for name, seconds in services.timings.items()}
     }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus指标（文本格式）：问答/入库各阶段耗时分布、入库吞吐、缓存命中、进行中的请求数
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
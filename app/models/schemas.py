@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
+from app.config.settings import settings
 
 class DocumentBase(BaseModel):
     title: str
@@ -28,14 +29,54 @@ class DocumentChunk(BaseModel):
 
 class QuestionRequest(BaseModel):
     question: str = Field(..., description="用户的问题")
+    nprobe: Optional[int] = Field(None, ge=1, le=65536, description="IVF索引检索的聚类数，越大召回率越高、延迟越大")
+    ef: Optional[int] = Field(None, ge=1, le=32768, description="HNSW索引检索的候选队列长度，越大召回率越高、延迟越大")
     
 class AnswerResponse(BaseModel):
     answer: str = Field(..., description="AI生成的答案")
     source_chunks: List[str] = Field(..., description="用于生成答案的相关文档片段")
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=settings.ASK_BATCH_MAX_QUESTIONS,
+        description="问题列表"
+    )
+    nprobe: Optional[int] = Field(None, ge=1, le=65536, description="IVF索引检索的聚类数，作用于所有问题")
+    ef: Optional[int] = Field(None, ge=1, le=32768, description="HNSW索引检索的候选队列长度，作用于所有问题")
+
+class BatchAnswerItem(BaseModel):
+    question: str
+    answer: str = Field(..., description="AI生成的答案")
+    source_chunks: List[str] = Field(..., description="用于生成答案的相关文档片段")
+    error: Optional[str] = Field(None, description="该问题处理失败时的错误信息")
+
+class BatchAnswerResponse(BaseModel):
+    answers: List[BatchAnswerItem] = Field(..., description="与问题列表顺序一致的答案")
     
 class UploadResponse(BaseModel):
     message: str
     document_id: str
+    job_id: Optional[str] = Field(None, description="入库任务ID，可通过/jobs/{job_id}查询进度")
+    status: Optional[str] = Field(None, description="入库任务状态")
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    document_id: str
+    filename: str
+    file_size: int = Field(..., description="文件大小（字节）")
+    content_hash: Optional[str] = Field(None, description="文件内容的SHA-256")
+    status: str = Field(..., description="任务状态：queued/running/completed/failed")
+    stage: str = Field(..., description="当前阶段：queued/extracting/embedding/indexing/completed/failed")
+    progress: float = Field(..., description="处理进度（0-1）")
+    chunk_count: int = Field(..., description="文档切分出的块数")
+    reused_chunk_count: int = Field(0, description="增量更新时内容未变、直接复用的块数")
+    removed_chunk_count: int = Field(0, description="增量更新时删除的旧块数")
+    retries: int = Field(..., description="因瞬时错误重试的次数")
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
     
 class ErrorResponse(BaseModel):
     error: str
@@ -1,26 +1,129 @@
-from fastapi import APIRouter, HTTPException
-from app.services.ai_service import AIService
-from app.models.schemas import QuestionRequest, AnswerResponse
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.services.container import ServiceContainer, get_services
+from app.services.ollama_scheduler import OllamaBusyError
+from app.models.schemas import (
+    AnswerResponse,
+    BatchAnswerItem,
+    BatchAnswerResponse,
+    BatchQuestionRequest,
+    QuestionRequest
+)
 
 router = APIRouter()
-ai_service = AIService()
+
+def _busy(error: OllamaBusyError) -> HTTPException:
+    """模型服务排队已满时返回429，提示客户端稍后重试"""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
 
 @router.post("/ask", response_model=AnswerResponse)
-async def ask_question(request: QuestionRequest) -> AnswerResponse:
+async def ask_question(
+    request: QuestionRequest,
+    services: ServiceContainer = Depends(get_services)
+) -> AnswerResponse:
     """
     问答接口
     """
     try:
         # 调用AI服务生成答案
-        result = await ai_service.generate_answer(request.question)
+        result = await services.ai_service.generate_answer(
+            request.question,
+            nprobe=request.nprobe,
+            ef=request.ef
+        )
         
         return AnswerResponse(
             answer=result["answer"],
             source_chunks=result["source_chunks"]
         )
         
+    except OllamaBusyError as e:
+        raise _busy(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+@router.post("/ask/batch", response_model=BatchAnswerResponse)
+async def ask_questions_batch(
+    request: BatchQuestionRequest,
+    services: ServiceContainer = Depends(get_services)
+) -> BatchAnswerResponse:
+    """
+    批量问答接口（离线评测、FAQ预生成等），所有问题共用一次批量嵌入和一次多向量检索
+    """
+    try:
+        results = await services.ai_service.generate_answers_batch(
+            request.questions,
+            nprobe=request.nprobe,
+            ef=request.ef
+        )
+        
+        return BatchAnswerResponse(
+            answers=[
+                BatchAnswerItem(question=question, **result)
+                for question, result in zip(request.questions, results)
+            ]
+        )
+        
+    except OllamaBusyError as e:
+        raise _busy(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+def _format_sse(event: str, data: dict) -> str:
+    """格式化为Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    raw_request: Request,
+    services: ServiceContainer = Depends(get_services)
+) -> StreamingResponse:
+    """
+    流式问答接口（SSE），先推送来源片段，再逐个推送生成的token
+    """
+    # 检索在发出响应头之前完成：检索失败时返回错误状态码（排队已满时为429），而不是中断已开始的流
+    try:
+        relevant_chunks = await services.ai_service.retrieve(
+            request.question,
+            nprobe=request.nprobe,
+            ef=request.ef
+        )
+    except OllamaBusyError as e:
+        raise _busy(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
+    
+    async def event_stream():
+        events = services.ai_service.generate_answer_stream(request.question, relevant_chunks)
+        try:
+            async for event in events:
+                # 客户端已断开时停止转发，关闭生成器会同时取消上游生成
+                if await raw_request.is_disconnected():
+                    break
+                yield _format_sse(event["event"], event["data"])
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
@@ -1,57 +1,229 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from app.services.document_processing import DocumentProcessor
-from app.services.embedding_service import EmbeddingService
-from app.services.milvus_service import MilvusService
-from app.utils.file_validation import validate_file
-from app.models.schemas import UploadResponse
-import uuid
+from typing import Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from app.services.container import ServiceContainer, get_services
+from app.services.document_processing import FileTooLargeError, InvalidUploadError
+from app.services.document_registry import DuplicateContentError
+from app.services.ingestion_service import IngestionJob
+from app.utils.file_validation import validate_content_length
+from app.models.schemas import UploadResponse, JobStatusResponse
+import asyncio
 
 router = APIRouter()
-document_processor = DocumentProcessor()
-embedding_service = EmbeddingService()
-milvus_service = MilvusService()
 
-@router.post("/upload", response_model=UploadResponse)
-async def upload_document(file: UploadFile = File(...)) -> UploadResponse:
+# 上传接口直接读取请求体，这里声明表单结构供API文档使用
+_UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+async def _receive_file(services: ServiceContainer, request: Request) -> Tuple[str, str, int, str]:
+    """验证并从请求体流式接收上传的文件，返回(文件名, 存储路径, 文件大小, SHA-256)。
+    不使用UploadFile：框架会在调用处理函数之前把整个表单缓存下来，超过大小限制也无法提前中止"""
+    validate_content_length(request.headers.get("content-length"))
+    try:
+        return await services.document_processor.receive_upload(
+            request.stream(),
+            request.headers.get("content-type")
+        )
+    except (FileTooLargeError, InvalidUploadError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+async def _job_response(
+    services: ServiceContainer,
+    job: IngestionJob,
+    wait_for_durability: bool
+) -> UploadResponse:
+    """根据任务生成响应，需要持久化保证时等待任务完成"""
+    if not wait_for_durability:
+        return UploadResponse(
+            message="文档已上传，正在后台处理",
+            document_id=job.doc_id,
+            job_id=job.job_id,
+            status=job.status
+        )
+    
+    await job.finished.wait()
+    if job.status == "failed":
+        raise HTTPException(
+            status_code=500,
+            detail=job.error
+        )
+    if not job.wait_for_durability:
+        # 复用的任务未要求落盘，这里补充一次
+        await services.vector_store.flush_buffer(seal=True)
+    return UploadResponse(
+        message="文档上传并处理成功",
+        document_id=job.doc_id,
+        job_id=job.job_id,
+        status=job.status
+    )
+
+@router.post("/upload", response_model=UploadResponse, openapi_extra=_UPLOAD_FORM)
+async def upload_document(
+    request: Request,
+    wait_for_durability: bool = Query(False, description="是否等待入库完成并持久化到向量存储后再返回"),
+    services: ServiceContainer = Depends(get_services)
+) -> UploadResponse:
     """
-    上传文档接口
+    上传文档接口：保存文件后加入入库队列，立即返回任务ID
     """
     try:
-        # 1. 验证文件
-        safe_filename = validate_file(file)
-        
-        # 2. 保存文件
-        file_content = await file.read()
-        file_path = await document_processor.save_uploaded_file(file_content, safe_filename)
-        
-        # 3. 处理文档
-        doc_id, content, chunks = await document_processor.process_document(file_path, file.filename)
-        
-        # 4. 生成嵌入向量
-        embeddings = await embedding_service.get_embeddings_batch(chunks)
-        
-        # 5. 准备存储数据
-        chunk_data = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            chunk_id = str(uuid.uuid4())
-            chunk_data.append({
-                "id": str(uuid.uuid4()),  # 主键ID
-                "doc_id": doc_id,
-                "chunk_id": chunk_id,
-                "content": chunk,
-                "embedding": embedding
-            })
-        
-        # 6. 存储到Milvus
-        await milvus_service.insert_chunks(chunk_data)
+        # 1-2. 验证并流式保存到内容寻址路径（边接收边计算哈希，超过大小限制立即中止）
+        filename, file_path, file_size, content_hash = await _receive_file(services, request)
         
-        return UploadResponse(
-            message="文档上传并处理成功",
-            document_id=doc_id
+        # 3. 内容相同的文档已入库时直接返回已有文档ID
+        duplicate = services.ingestion_service.find_duplicate(content_hash)
+        if duplicate is not None and duplicate[1] is None:
+            return UploadResponse(
+                message="相同内容的文档已存在，无需重复处理",
+                document_id=duplicate[0]["doc_id"],
+                status="completed"
+            )
+        
+        if duplicate is not None:
+            # 相同文档正在处理中，复用已有任务
+            job = duplicate[1]
+        else:
+            # 4. 加入入库队列
+            try:
+                job = services.ingestion_service.submit(
+                    file_path,
+                    filename,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    wait_for_durability=wait_for_durability
+                )
+            except asyncio.QueueFull:
+                raise HTTPException(
+                    status_code=503,
+                    detail="入库队列已满，请稍后重试"
+                )
+        
+        # 5. 需要持久化保证时等待任务完成
+        return await _job_response(services, job, wait_for_durability)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
         )
+
+@router.put("/documents/{doc_id}", response_model=UploadResponse, openapi_extra=_UPLOAD_FORM)
+async def replace_document(
+    doc_id: str,
+    request: Request,
+    wait_for_durability: bool = Query(False, description="是否等待更新完成并持久化到向量存储后再返回"),
+    services: ServiceContainer = Depends(get_services)
+) -> UploadResponse:
+    """
+    用新版本替换已有文档：按内容哈希比对文档块，只嵌入新增的块、只删除消失的块
+    """
+    try:
+        # 1. 检查文档是否存在、是否有正在进行的更新
+        document = services.ingestion_service.document_registry.get(doc_id)
+        if document is None:
+            raise HTTPException(
+                status_code=404,
+                detail="文档不存在"
+            )
+        if document["status"] != "completed" and services.ingestion_service.get_active_job(document) is not None:
+            raise HTTPException(
+                status_code=409,
+                detail="文档正在处理中，请稍后再更新"
+            )
+        
+        # 2. 验证并流式保存新版本文件
+        filename, file_path, file_size, content_hash = await _receive_file(services, request)
         
+        # 3. 内容未变化时无需处理；内容与其他文档相同时拒绝
+        if content_hash == document["content_hash"]:
+            return UploadResponse(
+                message="文档内容未变化，无需更新",
+                document_id=doc_id,
+                status="completed"
+            )
+        other = services.ingestion_service.document_registry.get_by_hash(content_hash)
+        if other is not None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"相同内容的文档已存在：{other['doc_id']}"
+            )
+        
+        # 4. 加入入库队列
+        try:
+            job = services.ingestion_service.submit_replace(
+                doc_id,
+                file_path,
+                filename,
+                file_size,
+                content_hash,
+                wait_for_durability=wait_for_durability
+            )
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="入库队列已满，请稍后重试"
+            )
+        except DuplicateContentError as e:
+            raise HTTPException(
+                status_code=409,
+                detail=str(e)
+            )
+        
+        return await _job_response(services, job, wait_for_durability)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(
+    job_id: str,
+    services: ServiceContainer = Depends(get_services)
+) -> JobStatusResponse:
+    """
+    查询入库任务状态
+    """
+    job = services.ingestion_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="任务不存在"
+        )
+    
+    return JobStatusResponse(
+        job_id=job.job_id,
+        document_id=job.doc_id,
+        filename=job.filename,
+        file_size=job.file_size,
+        content_hash=job.content_hash,
+        status=job.status,
+        stage=job.stage,
+        progress=job.progress,
+        chunk_count=job.chunk_count,
+        reused_chunk_count=job.reused_chunk_count,
+        removed_chunk_count=job.removed_chunk_count,
+        retries=job.retries,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
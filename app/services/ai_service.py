@@ -1,13 +1,18 @@
-import aiohttp
-from typing import List, Dict, Any
+import asyncio
+import json
+import time
+from typing import List, Dict, Any, AsyncIterator, Optional
 from app.config.settings import settings
+from app.services.ollama_client import ollama_client
+from app.services.ollama_scheduler import BULK, OllamaBusyError, use_lane
 from app.services.retrieval_service import RetrievalService
+from app.utils.metrics import qa_stage_seconds, observe_stage, timed_stage
 
 class AIService:
-    def __init__(self):
+    def __init__(self, retrieval_service: Optional[RetrievalService] = None):
         self.base_url = settings.OLLAMA_BASE_URL
         self.model = settings.LLM_MODEL
-        self.retrieval_service = RetrievalService()
+        self.retrieval_service = retrieval_service if retrieval_service is not None else RetrievalService()
 
     def _build_prompt(self, query: str, context_chunks: List[Dict[str, Any]]) -> str:
         """构建提示词"""
@@ -27,11 +32,54 @@ class AIService:
         
         return prompt
 
-    async def generate_answer(self, query: str) -> Dict[str, Any]:
+    async def generate_answer(
+        self,
+        query: str,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> Dict[str, Any]:
         """生成答案"""
         # 1. 检索相关文档块
-        relevant_chunks = await self.retrieval_service.hybrid_search(query)
-        
+        relevant_chunks = await self.retrieval_service.hybrid_search(query, nprobe=nprobe, ef=ef)
+        return await self._answer_from_chunks(query, relevant_chunks)
+
+    async def generate_answers_batch(
+        self,
+        queries: List[str],
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """批量生成答案：嵌入和向量检索对所有问题一次完成，
+        各问题的BM25融合、重排序和生成并发执行（同时进行的问题数不超过ASK_BATCH_MAX_CONCURRENCY），
+        单个问题失败只影响该问题的结果（error字段）。批量问答的模型调用走bulk通道，不挤占交互式问答的名额"""
+        with use_lane(BULK):
+            vector_results = await self.retrieval_service.vector_search_batch(
+                queries,
+                nprobe=nprobe,
+                ef=ef
+            )
+            semaphore = asyncio.Semaphore(settings.ASK_BATCH_MAX_CONCURRENCY)
+            
+            async def answer(query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+                async with semaphore:
+                    try:
+                        relevant_chunks = await self.retrieval_service.fuse_and_rerank(query, results)
+                        return await self._answer_from_chunks(query, relevant_chunks, raise_errors=True)
+                    except Exception as e:
+                        return {"answer": "", "source_chunks": [], "error": str(e)}
+            
+            return await asyncio.gather(
+                *[answer(query, results) for query, results in zip(queries, vector_results)]
+            )
+
+    async def _answer_from_chunks(
+        self,
+        query: str,
+        relevant_chunks: List[Dict[str, Any]],
+        raise_errors: bool = False
+    ) -> Dict[str, Any]:
+        """根据检索到的文档块调用模型生成答案；生成失败时默认把错误信息作为答案返回，
+        raise_errors为True时直接抛出（批量问答据此填写error字段）"""
         if not relevant_chunks:
             return {
                 "answer": "抱歉，我没有找到相关的信息来回答您的问题。",
@@ -39,32 +87,113 @@ class AIService:
             }
         
         # 2. 构建提示词
-        prompt = self._build_prompt(query, relevant_chunks)
+        with timed_stage("prompt_build"):
+            prompt = self._build_prompt(query, relevant_chunks)
         
         # 3. 调用AI模型生成回答
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/api/generate",
+            with timed_stage("llm_total"):
+                # 相同问题检索到相同上下文时提示词一致，并发请求共享一次生成
+                response = await ollama_client.request(
+                    "/api/generate",
                     json={
                         "model": self.model,
                         "prompt": prompt,
                         "stream": False
-                    }
-                ) as response:
-                    if response.status != 200:
-                        raise Exception(f"生成答案失败：{await response.text()}")
-                    
-                    result = await response.json()
-                    answer = result["response"].strip()
-                    
-                    return {
-                        "answer": answer,
-                        "source_chunks": [chunk["content"] for chunk in relevant_chunks]
-                    }
+                    },
+                    timeout=settings.OLLAMA_GENERATE_TIMEOUT
+                )
+                if response.status != 200:
+                    raise Exception(f"生成答案失败：{response.text()}")
+                
+                result = response.json()
+            answer = result["response"].strip()
+            
+            return {
+                "answer": answer,
+                "source_chunks": [chunk["content"] for chunk in relevant_chunks]
+            }
                     
+        except OllamaBusyError:
+            raise
         except Exception as e:
+            if raise_errors:
+                raise
             return {
                 "answer": f"生成答案时发生错误：{str(e)}",
                 "source_chunks": []
             }
+
+    async def retrieve(
+        self,
+        query: str,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """检索相关文档块（流式问答在开始推送之前调用，检索失败时仍可返回错误状态码）"""
+        return await self.retrieval_service.hybrid_search(query, nprobe=nprobe, ef=ef)
+
+    async def generate_answer_stream(
+        self,
+        query: str,
+        relevant_chunks: List[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式生成答案：先返回来源片段，再逐个返回模型生成的token（relevant_chunks由retrieve预先检索）"""
+        # 1. 来源片段在生成开始前先发送
+        yield {
+            "event": "sources",
+            "data": {"source_chunks": [chunk["content"] for chunk in relevant_chunks]}
+        }
+        
+        if not relevant_chunks:
+            yield {"event": "token", "data": {"content": "抱歉，我没有找到相关的信息来回答您的问题。"}}
+            yield {"event": "done", "data": {}}
+            return
+        
+        # 2. 构建提示词
+        with timed_stage("prompt_build"):
+            prompt = self._build_prompt(query, relevant_chunks)
+        
+        # 3. 以流式方式调用AI模型，逐行转发生成的token
+        completed = False
+        started = time.perf_counter()
+        first_token = True
+        try:
+            async with ollama_client.post(
+                "/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": True
+                },
+                timeout=settings.OLLAMA_GENERATE_TIMEOUT
+            ) as response:
+                try:
+                    if response.status != 200:
+                        raise Exception(f"生成答案失败：{await response.text()}")
+                    
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        result = json.loads(line)
+                        if result.get("error"):
+                            raise Exception(f"生成答案失败：{result['error']}")
+                        token = result.get("response", "")
+                        if token:
+                            if first_token:
+                                observe_stage(qa_stage_seconds, "llm_first_token", time.perf_counter() - started)
+                                first_token = False
+                            yield {"event": "token", "data": {"content": token}}
+                        if result.get("done"):
+                            break
+                    completed = True
+                    observe_stage(qa_stage_seconds, "llm_total", time.perf_counter() - started)
+                finally:
+                    # 客户端断开或生成被取消时直接关闭上游连接，Ollama会随之停止生成
+                    if not completed:
+                        response.close()
+        except Exception as e:
+            yield {"event": "error", "data": {"detail": f"生成答案时发生错误：{str(e)}"}}
+            return
+        
+        yield {"event": "done", "data": {}}
@@ -0,0 +1,242 @@
+import heapq
+import math
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+from app.config.settings import settings
+from app.utils.tokenizer import tokenize
+
+
+class BM25Index:
+    """全语料BM25倒排索引：入库时增量更新，SQLite持久化，查询时使用MaxScore剪枝"""
+
+    def __init__(
+        self,
+        path: str = settings.BM25_INDEX_PATH,
+        k1: float = settings.BM25_K1,
+        b: float = settings.BM25_B
+    ):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 倒排表：词元 -> {chunk_id: 词频}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # 文档块元数据：chunk_id -> {"doc_id", "content", "length"}
+        self._chunks: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+        # 每个词元的得分上界，索引变化时失效
+        self._upper_bounds: Dict[str, float] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        """按需打开SQLite数据库并加载索引到内存"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    doc_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    length INTEGER NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks (doc_id)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk_id ON postings (chunk_id)")
+            conn.commit()
+
+            for chunk_id, doc_id, content, length in conn.execute(
+                "SELECT chunk_id, doc_id, content, length FROM chunks"
+            ):
+                self._chunks[chunk_id] = {"doc_id": doc_id, "content": content, "length": length}
+                self._total_length += length
+            for term, chunk_id, tf in conn.execute("SELECT term, chunk_id, tf FROM postings"):
+                self._postings.setdefault(term, {})[chunk_id] = tf
+            self._conn = conn
+        return self._conn
+
+    def load(self):
+        """加载磁盘上的索引（应用启动时调用，避免首个查询承担加载开销）"""
+        with self._lock:
+            self._connection()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._connection()
+            return len(self._chunks)
+
+    def add_chunks(self, chunks: List[Dict[str, Any]]):
+        """增量加入文档块，每项需包含chunk_id、doc_id、content，可附带入库时预先计算的词频term_freqs"""
+        # 未预先分词的块在加锁之前分词，避免阻塞并发查询
+        tokenized = [
+            (chunk, chunk["term_freqs"] if "term_freqs" in chunk else Counter(tokenize(chunk["content"])))
+            for chunk in chunks
+        ]
+
+        with self._lock:
+            conn = self._connection()
+            replaced = [chunk["chunk_id"] for chunk, _ in tokenized if chunk["chunk_id"] in self._chunks]
+            if replaced:
+                self._remove_locked(replaced)
+
+            chunk_rows = []
+            posting_rows = []
+            for chunk, term_freqs in tokenized:
+                chunk_id = chunk["chunk_id"]
+                length = sum(term_freqs.values())
+                self._chunks[chunk_id] = {
+                    "doc_id": chunk["doc_id"],
+                    "content": chunk["content"],
+                    "length": length
+                }
+                self._total_length += length
+                chunk_rows.append((chunk_id, chunk["doc_id"], chunk["content"], length))
+                for term, tf in term_freqs.items():
+                    self._postings.setdefault(term, {})[chunk_id] = tf
+                    posting_rows.append((term, chunk_id, tf))
+
+            conn.executemany(
+                "INSERT INTO chunks (chunk_id, doc_id, content, length) VALUES (?, ?, ?, ?)",
+                chunk_rows
+            )
+            conn.executemany(
+                "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                posting_rows
+            )
+            conn.commit()
+            self._upper_bounds.clear()
+
+    def _remove_locked(self, chunk_ids: Iterable[str]):
+        """删除文档块（调用方需持有锁，不提交事务）"""
+        conn = self._connection()
+        for chunk_id in chunk_ids:
+            chunk = self._chunks.pop(chunk_id, None)
+            if chunk is None:
+                continue
+            self._total_length -= chunk["length"]
+            terms = conn.execute("SELECT term FROM postings WHERE chunk_id = ?", (chunk_id,)).fetchall()
+            for (term,) in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+            conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+        self._upper_bounds.clear()
+
+    def remove_chunks(self, chunk_ids: List[str]):
+        """按chunk_id删除文档块"""
+        with self._lock:
+            self._remove_locked(chunk_ids)
+            self._connection().commit()
+
+    def _idf(self, term: str) -> float:
+        """逆文档频率（取非负形式，便于计算得分上界）"""
+        n = len(self._chunks)
+        df = len(self._postings[term])
+        return math.log((n - df + 0.5) / (df + 0.5) + 1.0)
+
+    def _term_score(self, tf: int, length: int, idf: float, avgdl: float) -> float:
+        """单个词元对单个文档块的BM25得分"""
+        norm = self.k1 * (1 - self.b + self.b * length / avgdl)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def _upper_bound(self, term: str, idf: float, avgdl: float) -> float:
+        """词元在所有文档块上的最大得分（MaxScore剪枝使用）"""
+        bound = self._upper_bounds.get(term)
+        if bound is None:
+            bound = max(
+                self._term_score(tf, self._chunks[chunk_id]["length"], idf, avgdl)
+                for chunk_id, tf in self._postings[term].items()
+            )
+            self._upper_bounds[term] = bound
+        return bound
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """检索与查询最相关的top_k个文档块"""
+        query_terms = Counter(tokenize(query))
+
+        with self._lock:
+            self._connection()
+            if not self._chunks:
+                return []
+            avgdl = self._total_length / len(self._chunks) or 1.0
+
+            # 按得分上界从大到小处理词元（查询中重复出现的词元按次数加权）
+            terms = []
+            for term, qtf in query_terms.items():
+                if term in self._postings:
+                    idf = self._idf(term)
+                    terms.append((self._upper_bound(term, idf, avgdl) * qtf, term, idf, qtf))
+            terms.sort(reverse=True)
+
+            scores: Dict[str, float] = {}
+            admitting = True
+            for position, (_, term, idf, qtf) in enumerate(terms):
+                # 剩余词元得分上界之和每次重新求和（逐次相减的浮点误差可能使最后一个词元之后不为0，误删第k名）
+                remaining = sum(bound for bound, _, _, _ in terms[position + 1:])
+                postings = self._postings[term]
+                if admitting:
+                    for chunk_id, tf in postings.items():
+                        score = qtf * self._term_score(tf, self._chunks[chunk_id]["length"], idf, avgdl)
+                        scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+                else:
+                    # 已不再接纳新候选，只为现有候选累加得分
+                    for chunk_id in scores:
+                        tf = postings.get(chunk_id)
+                        if tf:
+                            score = qtf * self._term_score(tf, self._chunks[chunk_id]["length"], idf, avgdl)
+                            scores[chunk_id] += score
+
+                # MaxScore：当第k名的部分得分已不低于剩余词元得分上界之和时，
+                # 未出现过的文档块不可能进入前k，之后只需更新现有候选
+                if admitting and len(scores) >= top_k:
+                    threshold = heapq.nlargest(top_k, scores.values())[-1]
+                    if threshold >= remaining:
+                        admitting = False
+                        scores = {
+                            chunk_id: score for chunk_id, score in scores.items()
+                            if score + remaining >= threshold
+                        }
+
+            top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [
+                {
+                    "chunk_id": chunk_id,
+                    "doc_id": self._chunks[chunk_id]["doc_id"],
+                    "content": self._chunks[chunk_id]["content"],
+                    "score": score
+                }
+                for chunk_id, score in top
+            ]
+
+    def close(self):
+        """关闭磁盘连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._postings = {}
+            self._chunks = {}
+            self._total_length = 0
+            self._upper_bounds.clear()
+
+
+# 全局共享的BM25索引
+bm25_index = BM25Index()
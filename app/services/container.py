@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+from fastapi import Request
+from app.services.ai_service import AIService
+from app.services.bm25_index import bm25_index
+from app.services.document_processing import DocumentProcessor
+from app.services.document_registry import document_registry
+from app.services.embedding_cache import embedding_cache
+from app.services.embedding_service import EmbeddingService
+from app.services.extraction_pool import extraction_pool
+from app.services.ingestion_service import IngestionService
+from app.services.ollama_client import ollama_client
+from app.services.retrieval_service import RetrievalService
+from app.services.vector_store import create_vector_store
+from app.utils import tokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceContainer:
+    """应用服务容器：集中构造各服务（构造时不做任何I/O），由lifespan负责启动、预热和释放，两个路由共享同一组实例"""
+
+    def __init__(self):
+        self.vector_store = create_vector_store()
+        self.embedding_service = EmbeddingService()
+        self.document_processor = DocumentProcessor()
+        self.retrieval_service = RetrievalService(self.vector_store, self.embedding_service)
+        self.ai_service = AIService(self.retrieval_service)
+        self.ingestion_service = IngestionService(
+            self.document_processor,
+            self.embedding_service,
+            self.vector_store
+        )
+        # 预热完成前也可以接收请求，/health据此报告就绪状态
+        self.ready = False
+        self.timings: Dict[str, float] = {}
+        self._warmup_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动必需的后台组件，耗时的预热放到后台执行，不阻塞应用启动"""
+        started = time.perf_counter()
+        await ollama_client.start()
+        await self.ingestion_service.start()
+        self.timings["start"] = time.perf_counter() - started
+        self._warmup_task = asyncio.create_task(self._warm_up())
+
+    async def _warm_step(self, name: str, func: Callable[[], None]):
+        """在线程中执行一个预热步骤并记录耗时，失败时只记录日志（首次使用时会再次尝试）"""
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            logger.warning("预热%s失败，将在首次使用时重试：%s", name, e)
+        self.timings[f"warmup_{name}"] = time.perf_counter() - started
+
+    async def _warm_up(self):
+        """并行预热：jieba词典、BM25索引、向量存储（Milvus连接及集合加载，或加载本地向量文件）"""
+        started = time.perf_counter()
+        await asyncio.gather(
+            self._warm_step("tokenizer", tokenizer.warm_up),
+            self._warm_step("bm25", bm25_index.load),
+            self._warm_step("vector_store", self.vector_store.connect)
+        )
+        self.timings["warmup"] = time.perf_counter() - started
+        # 向量存储就绪后清理上次运行崩溃时遗留的隐藏文档块
+        await self.ingestion_service.purge_stale_chunks()
+        self.ready = True
+        logger.info("服务预热完成，耗时%.2f秒", self.timings["warmup"])
+
+    async def stop(self):
+        """按依赖顺序释放资源（应用退出时调用）"""
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+        await self.ingestion_service.stop()
+        try:
+            await self.vector_store.shutdown()
+        except Exception:
+            logger.exception("退出时写入剩余文档块失败")
+        self.vector_store.close()
+        await ollama_client.close()
+        embedding_cache.close()
+        bm25_index.close()
+        extraction_pool.shutdown()
+        await extraction_pool.converter.close()
+        document_registry.close()
+
+
+def get_services(request: Request) -> ServiceContainer:
+    """FastAPI依赖：获取lifespan中创建的服务容器"""
+    return request.app.state.services
@@ -1,45 +1,174 @@
+import asyncio
+import hashlib
 import os
-from typing import List, Tuple
-import docx
-from app.utils.text_splitter import TextSplitter
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+from app.utils.text_splitter import TextChunk, TextSplitter
 from app.config.settings import settings
 import uuid
-from app.utils.extract_text import extract_text_from_file
+from app.services.extraction_pool import extraction_pool
+from app.utils.retry import is_transient_error
+from app.utils.file_validation import get_storage_path, validate_file_extension
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart 0.0.13之前的包名
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class FileTooLargeError(Exception):
+    """上传文件超过大小限制"""
+
+
+class InvalidUploadError(Exception):
+    """上传请求不是合法的multipart表单或缺少文件字段"""
+
+
+class _MultipartFileReceiver:
+    """增量解析multipart/form-data请求体，把指定字段的文件内容边接收边写入临时文件，
+    同时计算SHA-256并检查大小；超过限制时立即抛出FileTooLargeError，不再继续接收"""
+
+    def __init__(self, boundary: bytes, field_name: str, max_size: int, temp_path: str):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.temp_path = temp_path
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._file = None
+        self._receiving = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        # 只接收第一个文件字段，其余字段忽略
+        if name != self.field_name or filename is None or self.filename is not None:
+            return
+        self.filename = os.path.basename(filename.decode("utf-8", "replace"))
+        validate_file_extension(self.filename)
+        self._file = open(self.temp_path, "wb")
+        self._receiving = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if not self._receiving:
+            return
+        self.size += end - start
+        # 一旦超过限制立即中止，不再继续接收
+        if self.size > self.max_size:
+            raise FileTooLargeError(f"文件大小超过限制：{self.max_size / 1024 / 1024}MB")
+        block = data[start:end]
+        self.sha256.update(block)
+        self._file.write(block)
+
+    def _on_part_end(self):
+        if self._receiving:
+            self._receiving = False
+            self._file.close()
+
+    def write(self, chunk: bytes):
+        """解析一段请求体（阻塞调用，在线程中执行）"""
+        self._parser.write(chunk)
+
+    def close(self):
+        """关闭临时文件（解析中途出错时）"""
+        if self._file is not None and not self._file.closed:
+            self._file.close()
 
 
 class DocumentProcessor:
     def __init__(self):
         self.text_splitter = TextSplitter()
+        self.extraction_pool = extraction_pool
 
-    async def process_document(self, file_path: str, original_filename: str) -> Tuple[str, str, List[str]]:
-        """处理文档主函数"""
-        # 生成文档ID
-        doc_id = str(uuid.uuid4())
-
+    async def iter_chunks(
+        self,
+        file_path: str,
+        original_filename: str,
+        on_progress: Optional[Callable[[float], None]] = None
+    ) -> AsyncIterator[TextChunk]:
+        """流式处理文档：边解析边切分，逐个产出文本块，无需先得到完整文本"""
+        stream = self.text_splitter.stream()
+        produced = 0
         try:
-            # 使用通用文本提取函数
-            content = extract_text_from_file(file_path)
-            if not content:
+            async for block in self.extraction_pool.iter_extract(file_path, on_progress):
+                for chunk in stream.feed(block):
+                    produced += 1
+                    yield chunk
+            for chunk in stream.close():
+                produced += 1
+                yield chunk
+            if not produced:
                 raise ValueError(f"无法提取文件内容：{original_filename}")
-            
-            # 分割文本
-            chunks = self.text_splitter.split_text(content)
-            
-            return doc_id, content, chunks
 
         except Exception as e:
-            # 如果处理失败，删除上传的文件
-            if os.path.exists(file_path):
+            # 如果处理失败，删除上传的文件（瞬时错误会被重试，保留文件）
+            if not is_transient_error(e) and os.path.exists(file_path):
                 os.remove(file_path)
             raise Exception(f"文档处理失败：{str(e)}")
 
-    async def save_uploaded_file(self, file_content: bytes, filename: str) -> str:
-        """保存上传的文件"""
-        file_path = os.path.join(settings.UPLOAD_DIR, filename)
+    def _store(self, temp_path: str, content_hash: str, filename: str) -> str:
+        """按内容哈希把临时文件放到最终位置，相同内容的文件已存在时直接复用"""
+        file_path = get_storage_path(content_hash, filename)
+        if not os.path.exists(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(temp_path, file_path)
+        return file_path
 
+    async def receive_upload(
+        self,
+        body: AsyncIterator[bytes],
+        content_type: Optional[str],
+        field_name: str = "file",
+        max_size: int = settings.MAX_FILE_SIZE
+    ) -> Tuple[str, str, int, str]:
+        """直接从请求体流式接收multipart表单中的文件：边接收边写盘、计算SHA-256，超过大小限制立即中止
+        （不经过框架先把整个表单缓存到临时文件），返回(原始文件名, 存储路径, 文件大小, SHA-256)"""
+        media_type, options = parse_options_header(content_type or "")
+        boundary = options.get(b"boundary")
+        if media_type != b"multipart/form-data" or not boundary:
+            raise InvalidUploadError("请求必须是包含文件字段的multipart/form-data表单")
+        
+        temp_path = os.path.join(settings.UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+        receiver = _MultipartFileReceiver(boundary, field_name, max_size, temp_path)
         try:
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            return file_path
-        except Exception as e:
-            raise Exception(f"文件保存失败：{str(e)}")
+            # 解析和写盘放到线程中执行，避免阻塞事件循环
+            async for chunk in body:
+                if chunk:
+                    await asyncio.to_thread(receiver.write, chunk)
+            receiver.close()
+            if receiver.filename is None:
+                raise InvalidUploadError(f"缺少文件字段：{field_name}")
+            content_hash = receiver.sha256.hexdigest()
+            file_path = await asyncio.to_thread(self._store, temp_path, content_hash, receiver.filename)
+            return receiver.filename, file_path, receiver.size, content_hash
+        finally:
+            receiver.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+from app.config.settings import settings
+
+
+def chunk_hash(content: str) -> str:
+    """文档块内容的SHA-256"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class DuplicateContentError(Exception):
+    """内容哈希已被其他文档登记或预留"""
+
+    def __init__(self, doc_id: str):
+        super().__init__(f"相同内容的文档已存在：{doc_id}")
+        self.doc_id = doc_id
+
+
+class DocumentRegistry:
+    """持久化的文档登记表：文件内容哈希 → 文档ID、文档块ID及入库元数据，用于去重"""
+
+    def __init__(self, path: str = settings.DOCUMENT_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 已写入索引、但所属任务尚未完成（或即将删除）的文档块，检索时过滤，使文档版本整体切换；
+        # 同时持久化到hidden_chunks表，服务崩溃后由启动时的清理删除残留的块
+        self._hidden_chunk_ids: Set[str] = set()
+
+    def _connection(self) -> sqlite3.Connection:
+        """按需打开SQLite数据库"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL UNIQUE,
+                    filename TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    job_id TEXT,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    doc_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    position INTEGER NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks (doc_id)")
+            # 增量替换进行中时预留新版本的内容哈希，替换完成时写入documents
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS reserved_hashes (
+                    content_hash TEXT PRIMARY KEY,
+                    doc_id TEXT NOT NULL
+                )"""
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS hidden_chunks (chunk_id TEXT PRIMARY KEY)")
+            conn.commit()
+            self._hidden_chunk_ids = {row[0] for row in conn.execute("SELECT chunk_id FROM hidden_chunks")}
+            self._conn = conn
+        return self._conn
+
+    def _owner(self, conn: sqlite3.Connection, content_hash: str) -> Optional[sqlite3.Row]:
+        """登记了该内容哈希、或为增量替换预留了该哈希的文档"""
+        row = conn.execute("SELECT * FROM documents WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            row = conn.execute(
+                """SELECT documents.* FROM reserved_hashes JOIN documents USING (doc_id)
+                    WHERE reserved_hashes.content_hash = ?""",
+                (content_hash,)
+            ).fetchone()
+        return row
+
+    def get_by_hash(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """按文件内容哈希查询文档（包括正在增量替换为该内容的文档，其content_hash仍为旧版本）"""
+        with self._lock:
+            row = self._owner(self._connection(), content_hash)
+            return dict(row) if row else None
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """按文档ID查询文档"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT * FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+            return dict(row) if row else None
+
+    def get_chunks(self, doc_id: str) -> List[Dict[str, Any]]:
+        """查询文档的所有文档块（按位置排序）"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT chunk_id, content_hash, position FROM chunks WHERE doc_id = ? ORDER BY position",
+                (doc_id,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def register(
+        self,
+        doc_id: str,
+        content_hash: str,
+        filename: str,
+        file_path: str,
+        file_size: int,
+        job_id: Optional[str] = None
+    ):
+        """登记一个正在入库的文档"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connection()
+            owner = self._owner(conn, content_hash)
+            if owner is not None:
+                raise DuplicateContentError(owner["doc_id"])
+            conn.execute(
+                """INSERT INTO documents
+                    (doc_id, content_hash, filename, file_path, file_size, status, job_id, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 'processing', ?, ?, ?)""",
+                (doc_id, content_hash, filename, file_path, file_size, job_id, now, now)
+            )
+            conn.commit()
+
+    def _write_chunks(self, conn: sqlite3.Connection, doc_id: str, chunks: List[Dict[str, Any]]):
+        """重写文档的文档块列表并标记为已完成（不提交）"""
+        conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+        conn.executemany(
+            "INSERT INTO chunks (chunk_id, doc_id, content_hash, position) VALUES (?, ?, ?, ?)",
+            [
+                (chunk["chunk_id"], doc_id, chunk["content_hash"], position)
+                for position, chunk in enumerate(chunks)
+            ]
+        )
+        conn.execute(
+            "UPDATE documents SET status = 'completed', chunk_count = ?, updated_at = ? WHERE doc_id = ?",
+            (len(chunks), datetime.now().isoformat(), doc_id)
+        )
+
+    def _switch_hidden(self, conn: sqlite3.Connection, hide: List[str], show: List[str]):
+        """在hidden_chunks表中隐藏/取消隐藏文档块（不提交，提交后再调用_apply_hidden更新内存中的集合）"""
+        conn.executemany("INSERT OR IGNORE INTO hidden_chunks (chunk_id) VALUES (?)", [(chunk_id,) for chunk_id in hide])
+        conn.executemany("DELETE FROM hidden_chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in show])
+
+    def _apply_hidden(self, hide: List[str], show: List[str]):
+        self._hidden_chunk_ids.update(hide)
+        self._hidden_chunk_ids.difference_update(show)
+
+    def mark_completed(
+        self,
+        doc_id: str,
+        chunks: List[Dict[str, Any]],
+        show: Iterable[str] = ()
+    ):
+        """入库完成后记录文档块ID及其内容哈希（每项需包含chunk_id、content_hash），
+        并在同一事务中取消隐藏show中的新块"""
+        show = list(show)
+        with self._lock:
+            conn = self._connection()
+            self._write_chunks(conn, doc_id, chunks)
+            self._switch_hidden(conn, [], show)
+            conn.commit()
+            self._apply_hidden([], show)
+
+    def set_status(self, doc_id: str, status: str, job_id: Optional[str] = None):
+        """更新文档状态（增量替换开始/失败时调用）"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "UPDATE documents SET status = ?, job_id = COALESCE(?, job_id), updated_at = ? WHERE doc_id = ?",
+                (status, job_id, datetime.now().isoformat(), doc_id)
+            )
+            conn.commit()
+
+    def reserve_hash(self, doc_id: str, content_hash: str):
+        """为增量替换预留新版本的内容哈希，使替换完成前相同内容的上传不会抢先登记；已被占用时抛出DuplicateContentError"""
+        with self._lock:
+            conn = self._connection()
+            owner = self._owner(conn, content_hash)
+            if owner is not None and owner["doc_id"] != doc_id:
+                raise DuplicateContentError(owner["doc_id"])
+            conn.execute(
+                "INSERT OR REPLACE INTO reserved_hashes (content_hash, doc_id) VALUES (?, ?)",
+                (content_hash, doc_id)
+            )
+            conn.commit()
+
+    def release_hash(self, content_hash: str):
+        """释放预留的内容哈希（增量替换失败时调用）"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM reserved_hashes WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+
+    def release_all_hashes(self):
+        """释放所有预留（服务启动时调用，重启前未完成的替换任务已不存在）"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM reserved_hashes")
+            conn.commit()
+
+    def hide_chunks(self, chunk_ids: Iterable[str]):
+        """检索时暂不返回这些文档块"""
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            conn = self._connection()
+            self._switch_hidden(conn, chunk_ids, [])
+            conn.commit()
+            self._apply_hidden(chunk_ids, [])
+
+    def show_chunks(self, chunk_ids: Iterable[str]):
+        """取消隐藏"""
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            conn = self._connection()
+            self._switch_hidden(conn, [], chunk_ids)
+            conn.commit()
+            self._apply_hidden([], chunk_ids)
+
+    def is_hidden(self, chunk_id: str) -> bool:
+        return chunk_id in self._hidden_chunk_ids
+
+    def hidden_count(self) -> int:
+        """当前隐藏的文档块数量（检索时据此多取候选，避免过滤后结果不足）"""
+        return len(self._hidden_chunk_ids)
+
+    def hidden_chunk_ids(self) -> List[str]:
+        """当前隐藏的文档块（包括上次运行遗留的）"""
+        with self._lock:
+            self._connection()
+            return list(self._hidden_chunk_ids)
+
+    def mark_replaced(
+        self,
+        doc_id: str,
+        content_hash: str,
+        filename: str,
+        file_path: str,
+        file_size: int,
+        chunks: List[Dict[str, Any]],
+        hide: Iterable[str] = (),
+        show: Iterable[str] = ()
+    ):
+        """增量替换完成后更新文档的内容哈希、文件信息和文档块列表，并释放预留的哈希；
+        同一事务中隐藏hide中的旧块、取消隐藏show中的新块，崩溃时不会出现新旧版本并存"""
+        hide, show = list(hide), list(show)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM reserved_hashes WHERE content_hash = ?", (content_hash,))
+            conn.execute(
+                """UPDATE documents SET content_hash = ?, filename = ?, file_path = ?, file_size = ?,
+                    updated_at = ? WHERE doc_id = ?""",
+                (content_hash, filename, file_path, file_size, datetime.now().isoformat(), doc_id)
+            )
+            self._write_chunks(conn, doc_id, chunks)
+            self._switch_hidden(conn, hide, show)
+            conn.commit()
+            self._apply_hidden(hide, show)
+
+    def remove(self, doc_id: str):
+        """删除文档登记（入库失败时调用，使同一文件可以重新上传）"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局共享的文档登记表
+document_registry = DocumentRegistry()
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config.settings import settings
+from app.utils.metrics import CallbackGauge, registry
+
+
+class EmbeddingCache:
+    """以(模型名, 规范化文本哈希)为键的两级嵌入向量缓存：内存LRU + SQLite磁盘持久化。
+    磁盘层的读写在线程中执行，不阻塞事件循环；磁盘层超过disk_max_rows时淘汰最早写入的条目"""
+
+    def __init__(
+        self,
+        path: str = settings.EMBEDDING_CACHE_PATH,
+        memory_size: int = settings.EMBEDDING_CACHE_MEMORY_SIZE,
+        disk_max_rows: int = settings.EMBEDDING_CACHE_DISK_MAX_ROWS
+    ):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_max_rows = disk_max_rows
+        self._memory: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 磁盘层在工作线程中访问，同一连接的读写串行执行
+        self._disk_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本：统一全半角、折叠空白，使仅格式不同的文本命中同一缓存"""
+        text = unicodedata.normalize("NFKC", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    @classmethod
+    def text_hash(cls, text: str) -> str:
+        """计算规范化文本的SHA-256"""
+        return hashlib.sha256(cls.normalize_text(text).encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        """按需打开SQLite数据库"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray):
+        """写入内存LRU层，超出容量时淘汰最久未使用的条目"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """批量查询磁盘层（阻塞调用，在线程中执行）"""
+        found = {}
+        with self._disk_lock:
+            conn = self._connection()
+            # SQLite单条语句的参数数量有限，分段查询
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _disk_put(self, rows: List[Tuple[str, str, bytes]]):
+        """批量写入磁盘层并淘汰超出容量的最早条目（阻塞调用，在线程中执行）"""
+        with self._disk_lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            # rowid随写入递增（REPLACE会分配新的rowid），按rowid淘汰即为先进先出，最多保留disk_max_rows条
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                (self.disk_max_rows,)
+            )
+            conn.commit()
+
+    async def get_many(self, model: str, hashes: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询缓存，未命中的位置返回None"""
+        results: List[Optional[np.ndarray]] = [None] * len(hashes)
+        disk_lookup: Dict[str, List[int]] = {}
+
+        # 1. 查内存层
+        for i, text_hash in enumerate(hashes):
+            key = (model, text_hash)
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                results[i] = vector
+                self.memory_hits += 1
+            else:
+                disk_lookup.setdefault(text_hash, []).append(i)
+
+        # 2. 内存未命中的再批量查磁盘层
+        if disk_lookup:
+            found = await asyncio.to_thread(self._disk_get, model, list(disk_lookup.keys()))
+            for text_hash, vector in found.items():
+                self._remember((model, text_hash), vector)
+                for i in disk_lookup[text_hash]:
+                    results[i] = vector
+                    self.disk_hits += 1
+
+        self.misses += sum(1 for vector in results if vector is None)
+        return results
+
+    async def put_many(self, model: str, hashes: List[str], vectors: np.ndarray, persist: bool = True):
+        """批量写入缓存（内存层，persist为True时同时写入磁盘层）"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        rows = []
+        for text_hash, vector in zip(hashes, vectors):
+            # 复制一份，避免缓存持有调用方整块矩阵的引用
+            vector = vector.copy()
+            self._remember((model, text_hash), vector)
+            rows.append((model, text_hash, vector.tobytes()))
+
+        if persist:
+            await asyncio.to_thread(self._disk_put, rows)
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中计数"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "memory_items": len(self._memory),
+            "hit_rate": hits / total if total else 0.0
+        }
+
+    def close(self):
+        """关闭磁盘层连接"""
+        with self._disk_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局共享的嵌入缓存
+embedding_cache = EmbeddingCache()
+
+registry.register(CallbackGauge(
+    "embedding_cache_lookups_total",
+    "嵌入缓存查询次数（memory_hit/disk_hit为内存层/磁盘层命中）",
+    lambda: [
+        ({"result": "memory_hit"}, embedding_cache.memory_hits),
+        ({"result": "disk_hit"}, embedding_cache.disk_hits),
+        ({"result": "miss"}, embedding_cache.misses)
+    ],
+    labelnames=["result"],
+    type_name="counter"
+))
@@ -1,45 +1,145 @@
-import aiohttp
+import asyncio
+import hashlib
 import json
-from typing import List, Tuple
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 from app.config.settings import settings
+from app.services.ollama_client import ollama_client
+from app.services.embedding_cache import EmbeddingCache, embedding_cache
+from app.utils.metrics import rerank_cache_lookups_total
+
+logger = logging.getLogger(__name__)
+
+try:
+    # 解析/api/embed响应时优先使用orjson（约为标准库json的4倍速度），未安装时回退到json
+    import orjson as _json_parser
+except ImportError:
+    _json_parser = json
+
+
+def decode_embeddings(body: bytes) -> np.ndarray:
+    """把/api/embed的响应体直接解码为float32矩阵，中间的嵌套列表随即释放"""
+    return np.asarray(_json_parser.loads(body)["embeddings"], dtype=np.float32)
+
+
+class RerankEndpointUnavailable(Exception):
+    """Ollama不提供交叉编码器重排序接口（标准Ollama没有/api/rerank）"""
+
 
 class EmbeddingService:
     def __init__(self):
         self.base_url = settings.OLLAMA_BASE_URL
         self.model = settings.EMBEDDING_MODEL
+        self.cache = embedding_cache if settings.EMBEDDING_CACHE_ENABLED else None
+        self._rerank_semaphore = asyncio.Semaphore(settings.RERANK_MAX_CONCURRENCY)
+        # 交叉编码器接口不可用（404）时改为生成式打分，之后不再尝试
+        self._rerank_mode = settings.RERANK_MODE
+        # 重排序得分缓存：(查询哈希, chunk_id) -> 得分
+        self._rerank_cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
 
-    async def get_embedding(self, text: str) -> List[float]:
-        """获取单个文本的嵌入向量"""
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/api/embeddings",
-                json={
-                    "model": self.model,
-                    "prompt": text
-                }
-            ) as response:
-                if response.status != 200:
-                    raise Exception(f"获取嵌入向量失败：{await response.text()}")
-                
-                result = await response.json()
-                return result["embedding"]
-
-    async def get_embeddings_batch(self, texts: List[str], batch_size: int = 5) -> List[List[float]]:
-        """批量获取文本的嵌入向量"""
-        embeddings = []
-        
-        # 分批处理
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = await asyncio.gather(
-                *[self.get_embedding(text) for text in batch]
-            )
-            embeddings.extend(batch_embeddings)
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """调用Ollama多输入接口/api/embed，一次请求获取一批文本的嵌入向量"""
+        response = await ollama_client.request(
+            "/api/embed",
+            json={
+                "model": self.model,
+                "input": texts
+            },
+            timeout=settings.OLLAMA_EMBED_TIMEOUT
+        )
+        if response.status != 200:
+            raise Exception(f"获取嵌入向量失败：{response.text()}")
+        
+        embeddings = decode_embeddings(response.body)
+        if embeddings.shape[0] != len(texts):
+            raise Exception(f"获取嵌入向量失败：期望{len(texts)}个向量，实际返回{embeddings.shape[0]}个")
+        return embeddings
+
+    def _split_batches(self, texts: List[str], batch_size: int) -> List[Tuple[int, int]]:
+        """按条数和总字符数自适应划分批次，返回每批的[start, end)下标"""
+        batches = []
+        start = 0
+        chars = 0
+        for i, text in enumerate(texts):
+            # 当前批次已满（条数或字符数超限）时另起一批，单条超长文本独占一批
+            if i > start and (i - start >= batch_size or chars + len(text) > settings.EMBEDDING_BATCH_MAX_CHARS):
+                batches.append((start, i))
+                start = i
+                chars = 0
+            chars += len(text)
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    async def _embed_texts(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """分批并发调用嵌入接口，返回与输入顺序一致的float32矩阵"""
+        embeddings = np.empty((len(texts), settings.VECTOR_DIM), dtype=np.float32)
+        if not texts:
+            return embeddings
+        
+        # 限制同时进行中的批次数，各批结果按下标写回，保证顺序与输入一致
+        semaphore = asyncio.Semaphore(settings.EMBEDDING_MAX_CONCURRENCY)
+        
+        async def embed_range(start: int, end: int):
+            async with semaphore:
+                batch_embeddings = await self._embed_batch(texts[start:end])
+            if batch_embeddings.shape[1] != settings.VECTOR_DIM:
+                raise Exception(
+                    f"嵌入向量维度不匹配：期望{settings.VECTOR_DIM}，实际{batch_embeddings.shape[1]}"
+                )
+            embeddings[start:end] = batch_embeddings
+        
+        await asyncio.gather(
+            *[embed_range(start, end) for start, end in self._split_batches(texts, batch_size)]
+        )
         
         return embeddings
 
-    async def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
+    async def get_embedding(self, text: str, persist: bool = True) -> np.ndarray:
+        """获取单个文本的嵌入向量（float32一维数组）"""
+        embeddings = await self.get_embeddings_batch([text], persist=persist)
+        return embeddings[0]
+
+    async def get_embeddings_batch(
+        self,
+        texts: List[str],
+        batch_size: int = settings.EMBEDDING_BATCH_MAX_SIZE,
+        persist: bool = True
+    ) -> np.ndarray:
+        """批量获取文本的嵌入向量（优先读缓存），返回形状为(len(texts), VECTOR_DIM)的float32矩阵。
+        persist为False时新向量只进内存缓存（用于用户问题，避免磁盘缓存无限增长）"""
+        if self.cache is None or not texts:
+            return await self._embed_texts(texts, batch_size)
+        
+        embeddings = np.empty((len(texts), settings.VECTOR_DIM), dtype=np.float32)
+        
+        # 1. 查询缓存，未命中的文本按哈希去重（同一批内的重复文本只嵌入一次）
+        hashes = [EmbeddingCache.text_hash(text) for text in texts]
+        pending = {}
+        for i, vector in enumerate(await self.cache.get_many(self.model, hashes)):
+            if vector is not None:
+                embeddings[i] = vector
+            else:
+                pending.setdefault(hashes[i], []).append(i)
+        
+        if not pending:
+            return embeddings
+        
+        # 2. 只对未命中的文本调用模型
+        first_indices = [indices[0] for indices in pending.values()]
+        new_embeddings = await self._embed_texts([texts[i] for i in first_indices], batch_size)
+        for indices, vector in zip(pending.values(), new_embeddings):
+            embeddings[indices] = vector
+        
+        # 3. 回写缓存
+        await self.cache.put_many(self.model, list(pending.keys()), new_embeddings, persist=persist)
+        
+        return embeddings
+
+    async def compute_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """计算两个向量之间的余弦相似度"""
         vec1 = np.array(embedding1)
         vec2 = np.array(embedding2)
@@ -50,30 +150,120 @@ class EmbeddingService:
         
         return dot_product / (norm1 * norm2)
 
-    async def rerank_chunks(self, query: str, chunks: List[str]) -> List[Tuple[str, float]]:
-        """使用重排序模型对文档块进行重新排序"""
-        async with aiohttp.ClientSession() as session:
-            results = []
-            for chunk in chunks:
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": settings.RERANK_MODEL,
-                        "prompt": f"Query: {query}\nDocument: {chunk}\nScore:",
-                        "stream": False
+    async def _cross_encoder_scores(self, query: str, documents: List[str]) -> List[float]:
+        """调用交叉编码器重排序接口，对一批文档直接给出相关性得分"""
+        async with self._rerank_semaphore:
+            response = await ollama_client.request(
+                settings.RERANK_ENDPOINT,
+                json={
+                    "model": settings.RERANK_MODEL,
+                    "query": query,
+                    "documents": documents
+                },
+                timeout=settings.OLLAMA_RERANK_TIMEOUT
+            )
+            if response.status == 404:
+                raise RerankEndpointUnavailable(f"重排序接口{settings.RERANK_ENDPOINT}不存在：{response.text()}")
+            if response.status != 200:
+                raise Exception(f"重排序失败：{response.text()}")
+            
+            result = response.json()
+        
+        scores = [0.0] * len(documents)
+        returned = set()
+        for item in result["results"]:
+            index = item["index"]
+            scores[index] = float(item.get("relevance_score", item.get("score", 0.0)))
+            returned.add(index)
+        if len(returned) != len(documents):
+            raise Exception(f"重排序失败：期望{len(documents)}个得分，实际返回{len(returned)}个")
+        return scores
+
+    async def _generate_score(self, query: str, document: str) -> Optional[float]:
+        """兼容模式：通过生成接口让模型输出分数，无法解析时返回None"""
+        async with self._rerank_semaphore:
+            response = await ollama_client.request(
+                "/api/generate",
+                json={
+                    "model": settings.RERANK_MODEL,
+                    "prompt": f"Query: {query}\nDocument: {document}\nScore:",
+                    "stream": False
+                },
+                timeout=settings.OLLAMA_RERANK_TIMEOUT
+            )
+            if response.status != 200:
+                raise Exception(f"重排序失败：{response.text()}")
+            
+            result = response.json()
+        
+        match = re.search(r"-?\d+(?:\.\d+)?", result["response"])
+        if match is None:
+            logger.warning("无法从重排序模型输出中解析分数：%r", result["response"][:100])
+            return None
+        return float(match.group())
+
+    async def rerank_chunks(
+        self,
+        query: str,
+        chunks: List[str],
+        chunk_ids: Optional[List[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """使用重排序模型对文档块进行重新排序（并发请求，按(查询, 文档块)缓存得分）"""
+        if chunk_ids is None:
+            chunk_ids = [hashlib.sha256(chunk.encode("utf-8")).hexdigest() for chunk in chunks]
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        
+        # 1. 先查缓存
+        scores: Dict[int, float] = {}
+        pending = []
+        for i, chunk_id in enumerate(chunk_ids):
+            key = (query_hash, chunk_id)
+            if key in self._rerank_cache:
+                self._rerank_cache.move_to_end(key)
+                scores[i] = self._rerank_cache[key]
+            else:
+                pending.append(i)
+        
+        rerank_cache_lookups_total.inc(len(scores), result="hit")
+        rerank_cache_lookups_total.inc(len(pending), result="miss")
+        
+        # 2. 未命中的文档块并发打分
+        if pending:
+            new_scores = None
+            if self._rerank_mode == "cross_encoder":
+                groups = [
+                    pending[start:start + settings.RERANK_BATCH_SIZE]
+                    for start in range(0, len(pending), settings.RERANK_BATCH_SIZE)
+                ]
+                try:
+                    group_scores = await asyncio.gather(
+                        *[self._cross_encoder_scores(query, [chunks[i] for i in group]) for group in groups]
+                    )
+                    new_scores = {
+                        i: score
+                        for group, values in zip(groups, group_scores)
+                        for i, score in zip(group, values)
                     }
-                ) as response:
-                    if response.status != 200:
-                        raise Exception(f"重排序失败：{await response.text()}")
-                    
-                    result = await response.json()
-                    # 解析分数（假设模型返回0-1之间的分数）
-                    try:
-                        score = float(result["response"].strip())
-                        results.append((chunk, score))
-                    except ValueError:
-                        results.append((chunk, 0.0))
+                except RerankEndpointUnavailable as e:
+                    logger.warning("%s，重排序改用生成式打分（RERANK_MODE=generate）", e)
+                    self._rerank_mode = "generate"
+            if new_scores is None:
+                values = await asyncio.gather(
+                    *[self._generate_score(query, chunks[i]) for i in pending]
+                )
+                new_scores = {i: score for i, score in zip(pending, values) if score is not None}
             
-            # 按分数降序排序
-            results.sort(key=lambda x: x[1], reverse=True)
-            return results
+            for i in pending:
+                if i in new_scores:
+                    scores[i] = new_scores[i]
+                    self._rerank_cache[(query_hash, chunk_ids[i])] = new_scores[i]
+                else:
+                    # 解析失败的得分不写入缓存，排在最后
+                    scores[i] = float("-inf")
+            while len(self._rerank_cache) > settings.RERANK_CACHE_SIZE:
+                self._rerank_cache.popitem(last=False)
+        
+        # 3. 按分数降序排序
+        results = [(chunks[i], scores[i]) for i in range(len(chunks))]
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results
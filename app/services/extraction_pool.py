@@ -0,0 +1,274 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+from app.config.settings import settings
+from app.services.office_converter import OfficeConverter, office_converter
+from app.utils.extract_text import (
+    extract_blocks_from_file,
+    extract_pages_from_pdf,
+    get_pdf_page_count,
+)
+from app.utils.tokenizer import term_frequencies
+
+logger = logging.getLogger(__name__)
+
+# 需要先转换格式的旧版Office文件：扩展名 -> 转换后的扩展名
+_CONVERT_TARGETS = {".doc": ".docx", ".docm": ".docx", ".ppt": ".pptx"}
+
+
+class ExtractionTimeout(Exception):
+    """文档解析超时"""
+
+
+def _create_executor(max_workers: int) -> ProcessPoolExecutor:
+    """创建进程池（使用spawn，避免fork带有事件循环和线程的父进程）"""
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _kill(executor: Optional[ProcessPoolExecutor]):
+    """强制终止进程池中的所有进程并关闭进程池"""
+    if executor is None:
+        return
+    for process in list(getattr(executor, "_processes", {}).values()):
+        try:
+            process.kill()
+        except Exception:
+            pass
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _Worker:
+    """单个解析进程（单进程的进程池）。超时时只终止正在解析该文件的进程，
+    进程崩溃（如解析畸形PDF时段错误或内存不足）时只丢弃这一个进程，下次使用时重建"""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def submit(self, func, *args) -> Future:
+        if self._executor is None:
+            self._executor = _create_executor(1)
+        return self._executor.submit(func, *args)
+
+    def discard(self):
+        """丢弃已崩溃的进程池"""
+        executor = self._executor
+        self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def kill(self):
+        """强制终止进程，正在执行的任务以BrokenProcessPool结束"""
+        executor = self._executor
+        self._executor = None
+        _kill(executor)
+
+
+class ExtractionPool:
+    """在独立进程中解析文档，避免PyMuPDF/python-docx等CPU密集的解析阻塞事件循环。
+    max_workers个解析进程各自独立，任务按空闲进程分配，一个文件超时或崩溃不影响其他文件正在进行的解析"""
+
+    def __init__(
+        self,
+        max_workers: int = settings.EXTRACT_WORKERS,
+        timeout: float = settings.EXTRACT_TIMEOUT,
+        converter: OfficeConverter = office_converter,
+        tokenize_workers: int = settings.TOKENIZE_WORKERS,
+        tokenize_timeout: float = settings.TOKENIZE_TIMEOUT
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.converter = converter
+        self.tokenize_workers = tokenize_workers
+        self.tokenize_timeout = tokenize_timeout
+        self._workers = [_Worker() for _ in range(max_workers)]
+        self._idle: Optional[asyncio.Queue] = None
+        self._tokenize_executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def tokenize_executor(self) -> ProcessPoolExecutor:
+        """按需创建分词进程池（与解析进程分开，分词超时不影响正在进行的解析）"""
+        if self._tokenize_executor is None:
+            self._tokenize_executor = _create_executor(self.tokenize_workers)
+        return self._tokenize_executor
+
+    def _idle_workers(self) -> asyncio.Queue:
+        """空闲解析进程队列（在事件循环中按需创建）"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for worker in self._workers:
+                self._idle.put_nowait(worker)
+        return self._idle
+
+    def _release(self, worker: _Worker, future: Future):
+        """任务结束后归还进程；进程已崩溃或被终止时丢弃，下次使用时重建"""
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            worker.discard()
+        if self._idle is not None:
+            self._idle.put_nowait(worker)
+
+    async def _call(self, busy: Set[_Worker], func, *args):
+        """等待空闲的解析进程并执行任务，执行期间进程记录在busy中（超时时据此终止）。
+        调用方取消时进程中的任务继续执行，结束后才归还进程"""
+        loop = asyncio.get_running_loop()
+        idle = self._idle_workers()
+        worker = await idle.get()
+        try:
+            future = worker.submit(func, *args)
+        except BaseException:
+            idle.put_nowait(worker)
+            raise
+        busy.add(worker)
+
+        def release(done: Future):
+            # 任务在执行器线程中结束，回到事件循环归还进程（事件循环已关闭时无需归还）
+            if not loop.is_closed():
+                try:
+                    loop.call_soon_threadsafe(self._release, worker, done)
+                except RuntimeError:
+                    pass
+
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            busy.discard(worker)
+
+    @asynccontextmanager
+    async def _converted(self, file_path: str) -> AsyncIterator[str]:
+        """旧版Office文件先在主进程中由转换后端转为.docx/.pptx，再交给解析进程池；其他文件原样使用"""
+        target_extension = _CONVERT_TARGETS.get(os.path.splitext(file_path)[1].lower())
+        if target_extension is None:
+            yield file_path
+            return
+        converted_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}{target_extension}")
+        try:
+            await self.converter.convert(file_path, converted_path)
+            yield converted_path
+        finally:
+            if os.path.exists(converted_path):
+                os.remove(converted_path)
+
+    async def iter_extract(
+        self,
+        file_path: str,
+        on_progress: Optional[Callable[[float], None]] = None
+    ) -> AsyncIterator[str]:
+        """流式解析文档：按顺序逐块（PDF为页，Word为段落/表格行）产出文本，依次拼接即为完整文本。
+        PDF按页段提交到进程池，同时最多max_workers段在解析，消费者处理较慢时不再提交新的页段（背压）。
+        超时按整个文件计算（累计等待解析结果的时间，消费者处理文本块的时间不计入），on_progress接收已解析比例（0~1）"""
+        async with self._converted(file_path) as path:
+            async for block in self._iter_extract(path, on_progress):
+                yield block
+
+    async def _iter_extract(
+        self,
+        file_path: str,
+        on_progress: Optional[Callable[[float], None]]
+    ) -> AsyncIterator[str]:
+        """流式解析已无需转换的文件"""
+        loop = asyncio.get_running_loop()
+        # 同一文件的所有解析任务共用self.timeout的时限
+        remaining = self.timeout
+        busy: Set[_Worker] = set()
+        tasks: List[asyncio.Task] = []
+
+        def submit(func, *args) -> asyncio.Task:
+            task = asyncio.ensure_future(self._call(busy, func, *args))
+            # 提前结束时未等待的任务也取走异常，避免“异常未被读取”的警告
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            tasks.append(task)
+            return task
+
+        async def wait(task: asyncio.Task):
+            nonlocal remaining
+            started = loop.time()
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout=max(remaining, 0))
+            except asyncio.TimeoutError:
+                # 进程中的任务无法取消，只能终止进程；只终止正在解析本文件的进程，其他文件的解析不受影响
+                logger.error("文档解析超时（%.0f秒），终止解析进程：%s", self.timeout, file_path)
+                for worker in list(busy):
+                    worker.kill()
+                raise ExtractionTimeout(f"文档解析超时（{self.timeout:.0f}秒）") from None
+            finally:
+                remaining -= loop.time() - started
+
+        try:
+            if os.path.splitext(file_path)[1].lower() != ".pdf":
+                blocks = await wait(submit(extract_blocks_from_file, file_path))
+                if on_progress is not None:
+                    on_progress(1.0)
+                for block in blocks:
+                    yield block
+                return
+
+            page_count = await wait(submit(get_pdf_page_count, file_path))
+            step = settings.PDF_PAGES_PER_TASK if page_count >= settings.PDF_PARALLEL_MIN_PAGES else max(page_count, 1)
+            ranges = deque((start, min(start + step, page_count)) for start in range(0, page_count, step))
+            pending: "deque[tuple]" = deque()
+            while ranges or pending:
+                while ranges and len(pending) < self.max_workers:
+                    start, end = ranges.popleft()
+                    pending.append((end, submit(extract_pages_from_pdf, file_path, start, end)))
+                end, task = pending.popleft()
+                pages = await wait(task)
+                if on_progress is not None:
+                    on_progress(end / page_count)
+                for page in pages:
+                    yield page
+        finally:
+            # 消费者提前结束或出错时取消尚未开始的页段
+            for task in tasks:
+                task.cancel()
+
+    async def tokenize(self, texts: List[str]) -> List[Dict[str, int]]:
+        """在分词进程池中为文档块分词并统计词频，分词的CPU开销不占用主进程。
+        超过tokenize_timeout时只终止分词进程，抛出asyncio.TimeoutError由入库队列重试"""
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        executor = self.tokenize_executor
+        future = loop.run_in_executor(executor, term_frequencies, texts)
+        try:
+            return await asyncio.wait_for(future, timeout=self.tokenize_timeout)
+        except asyncio.TimeoutError:
+            logger.error("分词超时（%.0f秒，%d个文档块），终止分词进程", self.tokenize_timeout, len(texts))
+            self._discard_tokenize_executor(executor, kill=True)
+            raise
+        except BrokenProcessPool:
+            # 分词进程崩溃：丢弃进程池，重试时重建
+            self._discard_tokenize_executor(executor)
+            raise
+
+    def _discard_tokenize_executor(self, executor: ProcessPoolExecutor, kill: bool = False):
+        """丢弃（并可选地终止）分词进程池，下次使用时重建"""
+        if self._tokenize_executor is executor:
+            self._tokenize_executor = None
+        if kill:
+            _kill(executor)
+        else:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """关闭进程池（应用退出时调用）"""
+        for worker in self._workers:
+            worker.discard()
+        if self._tokenize_executor is not None:
+            self._tokenize_executor.shutdown(wait=False, cancel_futures=True)
+            self._tokenize_executor = None
+        self._idle = None
+
+
+# 全局共享的文档解析进程池
+extraction_pool = ExtractionPool()
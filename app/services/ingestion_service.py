@@ -0,0 +1,487 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.config.settings import settings
+from app.services.bm25_index import bm25_index
+from app.services.document_registry import chunk_hash, document_registry
+from app.services.document_processing import DocumentProcessor
+from app.services.embedding_service import EmbeddingService
+from app.services.extraction_pool import extraction_pool
+from app.services.ollama_scheduler import BULK, use_lane
+from app.services.vector_store import ChunkBatch, VectorStore
+from app.utils.metrics import (
+    ingest_bytes_total,
+    ingest_chunks_total,
+    ingest_documents_total,
+    ingest_jobs_in_progress,
+    ingest_jobs_queued,
+    ingest_stage_seconds,
+    timed_stage
+)
+from app.utils.retry import is_transient_error
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJob:
+    """一次文档入库任务的状态"""
+
+    def __init__(
+        self,
+        file_path: str,
+        filename: str,
+        file_size: int = 0,
+        content_hash: Optional[str] = None,
+        wait_for_durability: bool = False,
+        doc_id: Optional[str] = None,
+        replace: bool = False
+    ):
+        self.job_id = str(uuid.uuid4())
+        self.doc_id = doc_id or str(uuid.uuid4())
+        self.replace = replace  # True表示用新版本增量替换已有文档
+        self.file_path = file_path
+        self.filename = filename
+        self.file_size = file_size
+        self.content_hash = content_hash
+        self.wait_for_durability = wait_for_durability
+        self.status = "queued"  # queued / running / completed / failed
+        self.stage = "queued"  # queued / extracting / embedding / indexing / completed / failed
+        self.progress = 0.0
+        self.retries = 0
+        self.error: Optional[str] = None
+        self.chunk_count = 0
+        self.reused_chunk_count = 0  # 增量替换时内容未变、直接复用的块数
+        self.removed_chunk_count = 0  # 增量替换时删除的旧块数
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+        self.finished = asyncio.Event()
+
+    def update(self, **fields: Any):
+        """更新任务状态字段并刷新更新时间"""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated_at = datetime.now()
+
+
+class IngestionService:
+    """文档入库任务队列：上传接口只负责入队，由固定数量的后台worker执行提取、切块、嵌入和入库"""
+
+    def __init__(
+        self,
+        document_processor: DocumentProcessor,
+        embedding_service: EmbeddingService,
+        vector_store: VectorStore
+    ):
+        self.document_processor = document_processor
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+        self.bm25_index = bm25_index
+        self.document_registry = document_registry
+        self.extraction_pool = extraction_pool
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        # 上次运行遗留的隐藏文档块（崩溃时未完成的入库或替换），向量存储就绪后清理
+        self._stale_chunk_ids: List[str] = []
+
+    async def start(self):
+        """启动后台worker（应用启动时调用）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        # 重启前未完成的增量替换已不存在，释放其预留的内容哈希
+        self.document_registry.release_all_hashes()
+        # 在worker开始隐藏新块之前记下遗留的隐藏块，清理时不会误删本次运行的块
+        self._stale_chunk_ids = self.document_registry.hidden_chunk_ids()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(settings.INGEST_WORKERS)
+        ]
+
+    async def stop(self):
+        """停止后台worker（应用退出时调用），未完成的任务标记为失败"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in self._jobs.values():
+            if job.status in ("queued", "running"):
+                job.update(status="failed", stage="failed", error="服务停止，任务未完成")
+                self._release_registration(job)
+                job.finished.set()
+
+    async def purge_stale_chunks(self):
+        """删除上次运行遗留的隐藏文档块（应用预热、向量存储连接后调用），失败时保持隐藏、下次启动再试"""
+        chunk_ids, self._stale_chunk_ids = self._stale_chunk_ids, []
+        if not chunk_ids:
+            return
+        logger.info("清理上次运行遗留的%d个隐藏文档块", len(chunk_ids))
+        if await self._discard_chunks(chunk_ids):
+            self.document_registry.show_chunks(chunk_ids)
+
+    def submit(
+        self,
+        file_path: str,
+        filename: str,
+        file_size: int = 0,
+        content_hash: Optional[str] = None,
+        wait_for_durability: bool = False
+    ) -> IngestionJob:
+        """提交入库任务并登记文档，队列已满时抛出asyncio.QueueFull"""
+        if self._queue is None:
+            raise RuntimeError("入库队列尚未启动")
+        if self._queue.full():
+            raise asyncio.QueueFull()
+        job = IngestionJob(file_path, filename, file_size, content_hash, wait_for_durability)
+        if content_hash is not None:
+            self.document_registry.register(
+                job.doc_id,
+                content_hash,
+                filename,
+                file_path,
+                file_size,
+                job_id=job.job_id
+            )
+        self._enqueue(job)
+        return job
+
+    def submit_replace(
+        self,
+        doc_id: str,
+        file_path: str,
+        filename: str,
+        file_size: int,
+        content_hash: str,
+        wait_for_durability: bool = False
+    ) -> IngestionJob:
+        """提交文档增量替换任务，队列已满时抛出asyncio.QueueFull，
+        新内容已被其他文档登记或预留时抛出DuplicateContentError"""
+        if self._queue is None:
+            raise RuntimeError("入库队列尚未启动")
+        if self._queue.full():
+            raise asyncio.QueueFull()
+        job = IngestionJob(
+            file_path,
+            filename,
+            file_size,
+            content_hash,
+            wait_for_durability,
+            doc_id=doc_id,
+            replace=True
+        )
+        # 在入库前预留新内容的哈希，替换完成前相同内容的上传会被识别为重复，不会与本任务冲突
+        self.document_registry.reserve_hash(doc_id, content_hash)
+        self.document_registry.set_status(doc_id, "updating", job_id=job.job_id)
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: IngestionJob):
+        """任务入队并登记"""
+        self._queue.put_nowait(job)
+        ingest_jobs_queued.set(self._queue.qsize())
+        self._jobs[job.job_id] = job
+        self._evict_finished_jobs()
+
+    def get_active_job(self, document: Dict[str, Any]) -> Optional[IngestionJob]:
+        """返回文档登记对应的、仍在进行中的任务"""
+        job = self._jobs.get(document["job_id"]) if document["job_id"] else None
+        if job is None or job.finished.is_set():
+            return None
+        return job
+
+    def find_duplicate(self, content_hash: str) -> Optional[Tuple[Dict[str, Any], Optional[IngestionJob]]]:
+        """查找内容相同的已入库或正在入库的文档，返回(文档登记, 进行中的任务)"""
+        document = self.document_registry.get_by_hash(content_hash)
+        if document is None:
+            return None
+        # 正在增量替换为该内容的文档：复用替换任务
+        if document["content_hash"] != content_hash:
+            job = self.get_active_job(document)
+            if job is None:
+                self.document_registry.release_hash(content_hash)
+                return None
+            return document, job
+        # 正在增量替换的文档，旧版本内容仍然完整可用
+        if document["status"] in ("completed", "updating"):
+            return document, None
+        
+        # 服务重启后遗留的未完成登记已没有对应任务，清理后按新文档处理
+        job = self.get_active_job(document)
+        if job is None:
+            self.document_registry.remove(document["doc_id"])
+            return None
+        return document, job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        """查询任务状态"""
+        return self._jobs.get(job_id)
+
+    def _evict_finished_jobs(self):
+        """只保留最近INGEST_JOB_RETENTION个任务记录，优先淘汰已结束的任务"""
+        excess = len(self._jobs) - settings.INGEST_JOB_RETENTION
+        if excess <= 0:
+            return
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished.is_set()]
+        for job_id in finished[:excess]:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        """后台worker：逐个处理队列中的任务（模型调用走bulk通道，让位于交互式问答）"""
+        with use_lane(BULK):
+            while True:
+                job = await self._queue.get()
+                ingest_jobs_queued.set(self._queue.qsize())
+                try:
+                    with ingest_jobs_in_progress.track_inprogress(), timed_stage("job", ingest_stage_seconds):
+                        await self._run_job(job)
+                    ingest_documents_total.inc(status="completed")
+                    ingest_bytes_total.inc(job.file_size)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.exception("文档入库失败：%s", job.filename)
+                    job.update(status="failed", stage="failed", error=str(e))
+                    self._release_registration(job)
+                    ingest_documents_total.inc(status="failed")
+                finally:
+                    job.finished.set()
+                    self._queue.task_done()
+
+    def _release_registration(self, job: IngestionJob):
+        """任务失败时回退文档登记：新文档删除登记以便重新上传，增量替换则保留旧版本"""
+        if job.replace:
+            self.document_registry.set_status(job.doc_id, "completed")
+            self.document_registry.release_hash(job.content_hash)
+        elif job.content_hash is not None:
+            self.document_registry.remove(job.doc_id)
+
+    async def _with_retry(self, job: IngestionJob, stage: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """执行一个阶段的操作，遇到瞬时错误时按指数退避重试"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await func()
+            except Exception as e:
+                if attempt > settings.INGEST_MAX_RETRIES or not is_transient_error(e):
+                    raise
+                delay = settings.INGEST_RETRY_BACKOFF * (2 ** (attempt - 1))
+                logger.warning("入库阶段%s出现瞬时错误，%.1f秒后重试：%s", stage, delay, e)
+                job.update(retries=job.retries + 1)
+                await asyncio.sleep(delay)
+
+    async def _timed(self, stage: str, awaitable: Awaitable[Any]) -> Any:
+        """等待并记录入库阶段耗时（用于gather中并行的阶段）"""
+        with timed_stage(stage, ingest_stage_seconds):
+            return await awaitable
+
+    async def _run_pipeline(self, *stages: Awaitable[Any]):
+        """并发运行流水线各阶段，任一阶段失败时取消其余阶段并抛出该异常"""
+        tasks = [asyncio.create_task(stage) for stage in stages]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_job(self, job: IngestionJob):
+        """执行单个入库任务：提取 → 切块 → 嵌入 → 写入向量存储和BM25索引。
+        各阶段以流水线方式重叠执行，阶段之间用有界队列传递批次：解析仍在进行时已切出的块即开始嵌入和入库，
+        下游处理不过来时上游自动等待，内存中只保留少量批次"""
+        job.update(status="running", stage="extracting")
+
+        # 增量替换时按内容哈希与已有文档块比对：未变化的块复用原chunk_id，剩下的旧块最后删除
+        available: Dict[str, List[str]] = {}
+        old_file_path = None
+        if job.replace:
+            old_document = self.document_registry.get(job.doc_id)
+            old_file_path = old_document["file_path"] if old_document else None
+            for old_chunk in self.document_registry.get_chunks(job.doc_id):
+                available.setdefault(old_chunk["content_hash"], []).append(old_chunk["chunk_id"])
+
+        batch_size = settings.EMBEDDING_BATCH_MAX_SIZE * settings.EMBEDDING_MAX_CONCURRENCY
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_PIPELINE_DEPTH)
+        index_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_PIPELINE_DEPTH)
+        # 每个位置的文档块：chunk_id（新块嵌入后分配）和内容哈希，供文档登记表使用
+        chunk_refs: List[Dict[str, Any]] = []
+        # 新块写入索引前先隐藏，任务提交后与删除旧块一起切换，检索不会看到新旧版本并存或不完整的文档
+        hidden_chunk_ids: List[str] = []
+        inserted_chunk_ids: List[str] = []
+        state = {"extracted": 0.0, "new": 0, "indexed": 0}
+        pending_batch: List[Tuple[int, str]] = []
+
+        def report_progress():
+            indexed_ratio = state["indexed"] / state["new"] if state["new"] else 1.0
+            job.update(progress=0.95 * state["extracted"] * indexed_ratio)
+
+        def on_extract_progress(fraction: float):
+            state["extracted"] = fraction
+            report_progress()
+
+        async def produce():
+            # 重试时重新解析，跳过已经处理过的块（解析和切分结果是确定的）
+            skip = len(chunk_refs)
+            async for chunk in self.document_processor.iter_chunks(job.file_path, job.filename, on_extract_progress):
+                if skip:
+                    skip -= 1
+                    continue
+                content_hash = chunk_hash(chunk.text)
+                candidates = available.get(content_hash)
+                chunk_refs.append({
+                    "chunk_id": candidates.pop(0) if candidates else None,
+                    "content_hash": content_hash
+                })
+                job.update(chunk_count=len(chunk_refs))
+                if chunk_refs[-1]["chunk_id"] is not None:
+                    continue
+                pending_batch.append((len(chunk_refs) - 1, chunk.text))
+                state["new"] += 1
+                if len(pending_batch) >= batch_size:
+                    await embed_queue.put(pending_batch[:])
+                    pending_batch.clear()
+
+        async def extract_stage():
+            with timed_stage("extract", ingest_stage_seconds):
+                await self._with_retry(job, "extracting", produce)
+            if pending_batch:
+                await embed_queue.put(pending_batch[:])
+            await embed_queue.put(None)
+            job.update(stage="embedding")
+
+        async def embed_stage():
+            # 嵌入与分词并行：分词在解析进程池中完成，词频随块写入BM25索引，查询时只需为问题分词
+            # 失败重试时已完成的部分由嵌入缓存直接命中
+            while True:
+                batch = await embed_queue.get()
+                if batch is None:
+                    break
+                texts = [text for _, text in batch]
+                embeddings, term_freqs = await asyncio.gather(
+                    self._timed(
+                        "embed",
+                        self._with_retry(job, "embedding", lambda: self.embedding_service.get_embeddings_batch(texts))
+                    ),
+                    self._timed(
+                        "tokenize",
+                        self._with_retry(job, "embedding", lambda: self.extraction_pool.tokenize(texts))
+                    )
+                )
+                chunk_ids = []
+                for position, _ in batch:
+                    chunk_refs[position]["chunk_id"] = str(uuid.uuid4())
+                    chunk_ids.append(chunk_refs[position]["chunk_id"])
+                # 按列组织，嵌入矩阵原样传给向量存储
+                chunks = ChunkBatch(
+                    [str(uuid.uuid4()) for _ in batch],  # 主键ID
+                    [job.doc_id] * len(batch),
+                    chunk_ids,
+                    texts,
+                    embeddings
+                )
+                await index_queue.put((chunks, term_freqs))
+            await index_queue.put(None)
+
+        async def index_stage():
+            # 按批写入向量存储和BM25倒排索引
+            while True:
+                item = await index_queue.get()
+                if item is None:
+                    break
+                chunks, term_freqs = item
+                hidden_chunk_ids.extend(chunks.chunk_ids)
+                self.document_registry.hide_chunks(chunks.chunk_ids)
+                with timed_stage("vector_insert", ingest_stage_seconds):
+                    await self.vector_store.insert_chunks(chunks)
+                inserted_chunk_ids.extend(chunks.chunk_ids)
+                bm25_rows = [
+                    {"chunk_id": chunk_id, "doc_id": doc_id, "content": content, "term_freqs": freqs}
+                    for chunk_id, doc_id, content, freqs in zip(
+                        chunks.chunk_ids, chunks.doc_ids, chunks.contents, term_freqs
+                    )
+                ]
+                with timed_stage("bm25_insert", ingest_stage_seconds):
+                    await asyncio.to_thread(self.bm25_index.add_chunks, bm25_rows)
+                state["indexed"] += len(chunks)
+                ingest_chunks_total.inc(len(chunks), kind="new")
+                report_progress()
+
+        try:
+            await self._run_pipeline(extract_stage(), embed_stage(), index_stage())
+            
+            # 解析完成后available中剩下的是新版本中已不存在的旧块（复用的块已在produce中取出）
+            removed_chunk_ids = [chunk_id for candidates in available.values() for chunk_id in candidates]
+            ingest_chunks_total.inc(len(chunk_refs) - state["new"], kind="reused")
+            job.update(
+                stage="indexing",
+                reused_chunk_count=len(chunk_refs) - state["new"],
+                removed_chunk_count=len(removed_chunk_ids)
+            )
+            if job.wait_for_durability:
+                await self._with_retry(
+                    job,
+                    "indexing",
+                    lambda: self.vector_store.flush_buffer(seal=True)
+                )
+            
+            # 在文档登记表中记录文档块，供去重和增量更新使用（替换任务的内容哈希已在提交时预留，不会冲突）；
+            # 同一事务中一步切换版本：隐藏新版本中已不存在的旧块，同时显示新块
+            if job.replace:
+                self.document_registry.mark_replaced(
+                    job.doc_id,
+                    job.content_hash,
+                    job.filename,
+                    job.file_path,
+                    job.file_size,
+                    chunk_refs,
+                    hide=removed_chunk_ids,
+                    show=hidden_chunk_ids
+                )
+            elif job.content_hash is not None:
+                self.document_registry.mark_completed(job.doc_id, chunk_refs, show=hidden_chunk_ids)
+            else:
+                self.document_registry.show_chunks(hidden_chunk_ids)
+        except (Exception, asyncio.CancelledError):
+            # 已分批写入的块需要撤销（它们一直处于隐藏状态，检索不会看到）
+            # 撤销失败时保持隐藏，残留的块不会被检索到
+            if not inserted_chunk_ids or await self._discard_chunks(inserted_chunk_ids):
+                self.document_registry.show_chunks(hidden_chunk_ids)
+            raise
+        
+        # 删除旧块；要求持久化时立即写入并落盘，失败可安全重试（删除前旧块一直保持隐藏）
+        if removed_chunk_ids:
+            await self._with_retry(
+                job,
+                "indexing",
+                lambda: self.vector_store.delete_by_chunk_ids(removed_chunk_ids)
+            )
+            await asyncio.to_thread(self.bm25_index.remove_chunks, removed_chunk_ids)
+            self.document_registry.show_chunks(removed_chunk_ids)
+            if job.wait_for_durability:
+                await self._with_retry(
+                    job,
+                    "indexing",
+                    lambda: self.vector_store.flush_buffer(seal=True)
+                )
+        
+        # 旧版本文件已不再被引用
+        if job.replace and old_file_path and old_file_path != job.file_path and os.path.exists(old_file_path):
+            os.remove(old_file_path)
+
+        job.update(status="completed", stage="completed", progress=1.0)
+
+    async def _discard_chunks(self, chunk_ids: List[str]) -> bool:
+        """撤销入库失败的任务已写入的块（尽力而为，失败只记录日志），返回是否撤销成功"""
+        try:
+            await self.vector_store.delete_by_chunk_ids(chunk_ids)
+            await asyncio.to_thread(self.bm25_index.remove_chunks, chunk_ids)
+            return True
+        except Exception:
+            logger.exception("撤销已写入的文档块失败")
+            return False
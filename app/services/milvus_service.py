@@ -1,25 +1,106 @@
-from typing import List, Dict, Any
-from pymilvus import (
-    connections,
-    Collection,
-    FieldSchema,
-    CollectionSchema,
-    DataType,
-    utility
-)
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import os
+import time
+from typing import TYPE_CHECKING, Callable, Iterator, List, Dict, Any, Optional, Tuple
+import numpy as np
 from app.config.settings import settings
+from app.services.vector_store import ChunkBatch, VectorStore
+from app.utils.file_lock import FileLock
+
+if TYPE_CHECKING:
+    from pymilvus import Collection
+
+logger = logging.getLogger(__name__)
+
+
+def choose_index_params(row_count: int) -> Dict[str, Any]:
+    """按集合行数选择向量索引：小集合精确检索，中等规模IVF_FLAT，大规模HNSW"""
+    if row_count >= settings.MILVUS_HNSW_MIN_ROWS:
+        index_type = "HNSW"
+        params = {"M": settings.MILVUS_HNSW_M, "efConstruction": settings.MILVUS_HNSW_EF_CONSTRUCTION}
+    elif row_count >= settings.MILVUS_IVF_MIN_ROWS:
+        index_type = "IVF_FLAT"
+        params = {"nlist": min(max(int(4 * math.sqrt(row_count)), 64), 65536)}
+    else:
+        index_type = "FLAT"
+        params = {}
+    return {"metric_type": "COSINE", "index_type": index_type, "params": params}
+
+
+# 索引类型从小到大的顺序，只升级不降级，避免删除数据后反复重建
+_INDEX_ORDER = {"FLAT": 0, "IVF_FLAT": 1, "HNSW": 2}
+# 单次search请求的查询向量数上限（Milvus限制nq不超过16384，同时控制单个请求的大小）
+_MAX_SEARCH_NQ = 1024
+# 重建索引时新集合的命名：COLLECTION_NAME + 分隔符 + 毫秒时间戳，完成后别名COLLECTION_NAME指向新集合
+_SHADOW_SEPARATOR = "__v"
+# 重建索引时从旧集合复制数据的每批行数
+_COPY_BATCH_SIZE = 1000
+# 开始重建前等待其他进程进行中的写入结束、取得排他锁的最长时间（秒）
+_REBUILD_LOCK_WAIT = 1.0
+# 未能取得排他锁时，间隔该时间（秒）后才再次尝试重建
+_REBUILD_RETRY_INTERVAL = 60.0
+
+class MilvusService(VectorStore):
+    """Milvus访问封装：构造时不连接，首次使用（或启动预热时调用connect）才导入pymilvus并建立连接"""
 
-class MilvusService:
     def __init__(self):
         self.host = settings.MILVUS_HOST
         self.port = settings.MILVUS_PORT
         self.collection_name = settings.COLLECTION_NAME
         self.dim = settings.VECTOR_DIM
+        self._collection: Optional["Collection"] = None
+        self._signature: Optional[Tuple[str, Tuple[Tuple[str, str], ...]]] = None
+        # 写缓冲区：跨上传累积文档块，按数量/时间阈值批量写入，避免每次上传都flush
+        self._buffer: List[ChunkBatch] = []
+        self._buffer_rows = 0
+        self._buffer_since: Optional[float] = None
+        # 串行化所有写入（插入、落盘、删除）以及重建索引时影子集合的启用和切换；阻塞的pymilvus调用在线程中执行
+        self._write_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        # 当前索引参数和估计的行数，用于按规模切换索引类型
+        self._index_params: Optional[Dict[str, Any]] = None
+        self._row_count = 0
+        self._rebuild_task: Optional[asyncio.Task] = None
+        # 重建索引时的影子集合：重建期间的写入和删除同步到影子集合，删除条件另行记录，复制完成后重放
+        self._shadow: Optional["Collection"] = None
+        self._shadow_deletes: List[str] = []
+        # 同一台机器上的多个应用进程共用集合时的写入锁：写入持有共享锁，重建索引的进程持有排他锁，
+        # 使重建只在一个进程中进行，且其他进程的写入在重建期间等待（否则不会同步到影子集合而丢失）
+        self._lock_path = os.path.join(settings.DATA_DIR, f"milvus_{self.collection_name}.lock")
+        self._rebuild_lock: Optional[FileLock] = None
+        self._rebuild_retry_at = 0.0
+        self._closing = False
+        # 向量字段的实际精度以已有集合的schema为准，新建集合时取MILVUS_VECTOR_DTYPE
+        self._vector_dtype = np.dtype(settings.MILVUS_VECTOR_DTYPE)
+
+    def connect(self):
+        """连接Milvus，确保集合存在并加载到内存（幂等，失败时下次使用再重试）"""
+        if self._collection is not None:
+            return
+        from pymilvus import Collection
         self._ensure_connection()
         self._ensure_collection()
+        self._collection = Collection(self.collection_name)
+        try:
+            self.warmup()
+        except Exception:
+            self._collection = None
+            raise
+        self._row_count = self._collection.num_entities
+        self._drop_stale_shadows()
+
+    @property
+    def connected(self) -> bool:
+        """是否已连接并加载集合"""
+        return self._collection is not None
 
     def _ensure_connection(self):
         """确保与Milvus的连接"""
+        from pymilvus import connections
         try:
             connections.connect(
                 alias="default",
@@ -29,83 +110,555 @@ class MilvusService:
         except Exception as e:
             raise Exception(f"连接Milvus失败：{str(e)}")
 
+    @contextlib.contextmanager
+    def _writing(self) -> Iterator[None]:
+        """写入Milvus期间持有共享锁（其他进程正在重建索引时等待其完成），本进程正在重建时已持有排他锁"""
+        if self._rebuild_lock is not None:
+            yield
+            return
+        lock = FileLock(self._lock_path)
+        lock.acquire(shared=True)
+        try:
+            yield
+        finally:
+            lock.release()
+
     def _ensure_collection(self):
-        """确保集合存在，如果不存在则创建"""
+        """确保集合存在，如果不存在则创建（持有写入锁，不会与其他进程进行中的重建交错）"""
+        with self._writing():
+            self._create_collection()
+
+    def _create_collection(self):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
         if not utility.has_collection(self.collection_name):
+            shadows = self._list_shadows()
+            if shadows:
+                # 上次重建在删除旧集合之后、创建别名之前中断：别名指向最新的集合
+                utility.create_alias(shadows[-1], self.collection_name)
+                return
             fields = [
                 FieldSchema(name="id", dtype=DataType.VARCHAR, max_length=36, is_primary=True),
                 FieldSchema(name="doc_id", dtype=DataType.VARCHAR, max_length=36),
                 FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=36),
                 FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
-                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=self.dim)
+                FieldSchema(
+                    name="embedding",
+                    dtype=DataType.FLOAT16_VECTOR if self._vector_dtype == np.float16 else DataType.FLOAT_VECTOR,
+                    dim=self.dim
+                )
             ]
             schema = CollectionSchema(fields=fields, description="文档块存储")
             collection = Collection(name=self.collection_name, schema=schema)
             
-            # 创建IVF_FLAT索引
-            index_params = {
-                "metric_type": "COSINE",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 1024}
-            }
-            collection.create_index(field_name="embedding", index_params=index_params)
-
-    async def insert_chunks(self, chunks: List[Dict[str, Any]]):
-        """插入文档块"""
-        collection = Collection(self.collection_name)
-        
+            # 新集合为空，先使用精确检索，数据增长后自动切换索引
+            collection.create_index(field_name="embedding", index_params=choose_index_params(0))
+
+    def _list_shadows(self) -> List[str]:
+        """重建索引产生的集合名，按创建时间排序"""
+        from pymilvus import utility
+        prefix = f"{self.collection_name}{_SHADOW_SEPARATOR}"
+        names = [
+            name for name in utility.list_collections()
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        ]
+        return sorted(names, key=lambda name: int(name[len(prefix):]))
+
+    def _drop_stale_shadows(self):
+        """删除上次重建中断时遗留的影子集合（别名当前指向的集合除外）；
+        只在能立即取得排他锁时清理，其他进程正在重建（或写入）时跳过，不会删除其影子集合"""
+        from pymilvus import utility
+        if self._rebuild_lock is not None:
+            return
+        lock = FileLock(self._lock_path)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            current = self._collection.describe()["collection_name"]
+            for name in self._list_shadows():
+                if name != current:
+                    logger.warning("删除中断的索引重建遗留的集合：%s", name)
+                    utility.drop_collection(name)
+        except Exception as e:
+            logger.warning("清理遗留的影子集合失败：%s", e)
+        finally:
+            lock.release()
+
+    @property
+    def collection(self) -> "Collection":
+        """缓存的集合句柄，避免每次操作都重新构造Collection"""
+        if self._collection is None:
+            self.connect()
+        return self._collection
+
+    def _schema_signature(self, collection: "Collection") -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        """集合schema和索引的签名，用于判断是否需要重新加载"""
+        indexes = tuple(sorted((index.field_name, str(index.params)) for index in collection.indexes))
+        return str(collection.schema), indexes
+
+    def _read_index_params(self, collection: "Collection") -> Optional[Dict[str, Any]]:
+        """读取向量字段当前的索引参数"""
+        for index in collection.indexes:
+            if index.field_name == "embedding":
+                params = dict(index.params)
+                if isinstance(params.get("params"), str):
+                    params["params"] = json.loads(params["params"])
+                return params
+        return None
+
+    def _read_vector_dtype(self, collection: "Collection") -> np.dtype:
+        """读取向量字段的精度（FLOAT16_VECTOR对应float16，其余为float32）"""
+        from pymilvus import DataType
+        for field in collection.schema.fields:
+            if field.name == "embedding":
+                return np.dtype(np.float16 if field.dtype == DataType.FLOAT16_VECTOR else np.float32)
+        return np.dtype(np.float32)
+
+    def _vector_column(self, embeddings: np.ndarray) -> np.ndarray:
+        """按向量字段精度转换嵌入矩阵（float16字段要求每行为float16数组）"""
+        return embeddings.astype(self._vector_dtype, copy=False)
+
+    def warmup(self):
+        """将集合加载到内存并记录schema/索引签名（应用启动时调用一次）"""
         try:
-            collection.insert(chunks)
-            collection.flush()
+            self.collection.load()
+            self._signature = self._schema_signature(self.collection)
+            self._index_params = self._read_index_params(self.collection)
+            self._vector_dtype = self._read_vector_dtype(self.collection)
         except Exception as e:
-            raise Exception(f"插入文档块失败：{str(e)}")
+            raise Exception(f"加载集合失败：{str(e)}")
 
-    async def search_similar(self, query_embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
-        """搜索相似文档块"""
+    def refresh(self):
+        """重新获取集合句柄，仅当schema或索引发生变化（或集合未加载）时重新加载"""
+        from pymilvus import Collection, utility
+        from pymilvus.client.types import LoadState
+        if self._collection is None:
+            self.connect()
+            return
         collection = Collection(self.collection_name)
-        collection.load()
+        signature = self._schema_signature(collection)
+        loaded = utility.load_state(self.collection_name) == LoadState.Loaded
+        self._collection = collection
+        if signature != self._signature or not loaded:
+            self.warmup()
+
+    async def insert_chunks(self, chunks: ChunkBatch, wait_for_durability: bool = False):
+        """插入文档块（写入缓冲区，wait_for_durability为True时立即写入并落盘）"""
+        if len(chunks):
+            self._buffer.append(chunks)
+            self._buffer_rows += len(chunks)
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+            self._ensure_flusher()
         
+        if wait_for_durability:
+            await self.flush_buffer(seal=True)
+        elif self._buffer_rows >= settings.MILVUS_BUFFER_MAX_ROWS:
+            try:
+                await self.flush_buffer()
+            except Exception as e:
+                # 数据仍保留在缓冲区中，由后台任务稍后重试
+                logger.warning("批量写入文档块失败，将稍后重试：%s", e)
+
+    async def flush_buffer(self, seal: bool = False):
+        """将缓冲区中的文档块按列批量写入Milvus，seal为True时同时flush使数据持久化"""
+        async with self._write_lock:
+            batches = self._buffer
+            self._buffer = []
+            self._buffer_rows = 0
+            self._buffer_since = None
+            try:
+                if batches:
+                    batch = ChunkBatch.concat(batches)
+                    # 按schema字段顺序逐列写入，向量列直接传入连续矩阵
+                    columns = [
+                        batch.ids,
+                        batch.doc_ids,
+                        batch.chunk_ids,
+                        batch.contents,
+                        self._vector_column(batch.embeddings)
+                    ]
+                    await asyncio.to_thread(self._insert, columns)
+                    self._row_count += len(batch)
+                # 从未连接过时没有需要落盘的数据
+                if seal and self._collection is not None:
+                    await asyncio.to_thread(self._seal)
+            except Exception as e:
+                # 写入失败时放回缓冲区，等待下次重试
+                self._buffer = batches + self._buffer
+                self._buffer_rows = sum(len(batch) for batch in self._buffer)
+                if self._buffer_since is None and self._buffer:
+                    self._buffer_since = time.monotonic()
+                raise Exception(f"插入文档块失败：{str(e)}")
+        self._maybe_rebuild_index()
+
+    @staticmethod
+    def _needs_rebuild(current: Dict[str, Any], target: Dict[str, Any]) -> bool:
+        """是否值得从当前索引重建为目标索引"""
+        current_type = current.get("index_type")
+        current_rank = _INDEX_ORDER.get(current_type, -1)
+        target_rank = _INDEX_ORDER[target["index_type"]]
+        if target_rank < current_rank:
+            return False
+        if target_rank == current_rank:
+            # 同为IVF时，nlist需要增长到4倍以上才值得重建
+            if current_type != "IVF_FLAT":
+                return False
+            current_nlist = int(current.get("params", {}).get("nlist", 0))
+            if target["params"]["nlist"] < current_nlist * 4:
+                return False
+        return True
+
+    def _maybe_rebuild_index(self):
+        """行数越过阈值、需要更大规模的索引时，在后台重建索引"""
+        if self._closing or not settings.MILVUS_INDEX_AUTO_REBUILD or self._index_params is None:
+            return
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+        if time.monotonic() < self._rebuild_retry_at:
+            return
+        target = choose_index_params(self._row_count)
+        if not self._needs_rebuild(self._index_params, target):
+            return
+        self._rebuild_task = asyncio.get_running_loop().create_task(self._rebuild_index(target))
+
+    def _mirror(self, operation: Callable[["Collection"], Any]):
+        """重建索引期间把写操作同步到影子集合；同步失败时放弃本次重建（旧索引继续提供检索）"""
+        shadow = self._shadow
+        if shadow is None:
+            return
         try:
-            search_params = {
-                "metric_type": "COSINE",
-                "params": {"nprobe": 10}
-            }
-            
+            operation(shadow)
+        except Exception as e:
+            logger.warning("同步写入影子集合失败，放弃本次索引重建：%s", e)
+            self._shadow = None
+
+    def _insert(self, columns: List[Any]):
+        """按列写入集合，重建索引期间同时写入影子集合（阻塞调用，在线程中执行）"""
+        with self._writing():
+            self.collection.insert(columns)
+            self._mirror(lambda shadow: shadow.insert(columns))
+
+    def _seal(self):
+        """flush集合使数据持久化（阻塞调用，在线程中执行）"""
+        with self._writing():
+            self.collection.flush()
+            self._mirror(lambda shadow: shadow.flush())
+
+    def _delete(self, exprs: List[str]):
+        """按条件删除，重建索引期间同时删除影子集合中的数据（阻塞调用，在线程中执行）"""
+        with self._writing():
+            for expr in exprs:
+                self.collection.delete(expr)
+                if self._shadow is not None:
+                    self._shadow_deletes.append(expr)
+                    self._mirror(lambda shadow: shadow.delete(expr))
+
+    async def _acquire_rebuild_lock(self) -> Optional[FileLock]:
+        """取得排他锁（需持有_write_lock，本进程没有进行中的写入）：等待其他进程进行中的写入结束，
+        其他进程正在重建或写入持续不断时放弃，返回None"""
+        lock = FileLock(self._lock_path)
+        deadline = time.monotonic() + _REBUILD_LOCK_WAIT
+        while not await asyncio.to_thread(lock.acquire, False, False):
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(0.01)
+        return lock
+
+    def _create_shadow(self, index_params: Dict[str, Any]) -> "Collection":
+        """按当前集合的schema创建影子集合并建好新索引（阻塞调用，在线程中执行）"""
+        from pymilvus import Collection
+        name = f"{self.collection_name}{_SHADOW_SEPARATOR}{int(time.time() * 1000)}"
+        shadow = Collection(name=name, schema=self.collection.schema)
+        shadow.create_index(field_name="embedding", index_params=index_params)
+        return shadow
+
+    def _decode_vector(self, value: Any) -> np.ndarray:
+        """把查询返回的向量（float16字段为字节串）转换为向量字段精度的数组"""
+        if isinstance(value, (list, tuple)) and len(value) == 1 and isinstance(value[0], bytes):
+            value = value[0]
+        if isinstance(value, bytes):
+            return np.frombuffer(value, dtype=self._vector_dtype)
+        return np.asarray(value, dtype=self._vector_dtype)
+
+    def _copy_to_shadow(self, source: "Collection", shadow: "Collection"):
+        """把旧集合的全部数据分批复制到影子集合，等待新索引建好后加载（阻塞调用，在线程中执行）。
+        复制使用upsert，与重建期间同步写入的行不会重复"""
+        from pymilvus import utility
+        iterator = source.query_iterator(
+            batch_size=_COPY_BATCH_SIZE,
+            expr='id != ""',
+            output_fields=["id", "doc_id", "chunk_id", "content", "embedding"],
+            consistency_level="Strong"
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                shadow.upsert([
+                    [row["id"] for row in rows],
+                    [row["doc_id"] for row in rows],
+                    [row["chunk_id"] for row in rows],
+                    [row["content"] for row in rows],
+                    np.stack([self._decode_vector(row["embedding"]) for row in rows])
+                ])
+        finally:
+            iterator.close()
+        shadow.flush()
+        utility.wait_for_index_building_complete(shadow.name)
+
+    def _load_shadow(
+        self,
+        shadow: "Collection",
+        deletes: List[str],
+        index_params: Dict[str, Any]
+    ) -> Tuple[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[str, Any]]:
+        """重放复制期间的删除（对应的行可能在删除之后才被复制过来），再加载影子集合，返回其签名和索引参数"""
+        for expr in deletes:
+            shadow.delete(expr)
+        shadow.load()
+        return self._schema_signature(shadow), self._read_index_params(shadow) or index_params
+
+    def _retire(self, previous: "Collection", current: "Collection") -> "Collection":
+        """让别名COLLECTION_NAME指向新集合并删除旧集合，返回按别名访问的集合句柄（阻塞调用，在线程中执行）。
+        之后按别名访问，其他进程再次重建、删除这个集合后句柄仍然有效"""
+        from pymilvus import Collection, utility
+        previous_name = previous.describe()["collection_name"]
+        if previous_name == self.collection_name:
+            # 首次重建：旧集合本身名为COLLECTION_NAME，删除后才能创建同名别名
+            utility.drop_collection(previous_name)
+            utility.create_alias(current.name, self.collection_name)
+        else:
+            utility.alter_alias(current.name, self.collection_name)
+            utility.drop_collection(previous_name)
+        return Collection(self.collection_name)
+
+    async def _rebuild_index(self, index_params: Dict[str, Any]):
+        """在线重建索引：在影子集合上建新索引并复制数据，新集合加载完成后才切换，期间旧索引照常提供检索"""
+        started = time.monotonic()
+        shadow = None
+        try:
+            # 持有写锁时开始同步写入：此前完成的写入由复制带过去，此后的写入直接同步到影子集合；
+            # 同时取得跨进程的排他锁，其他进程的写入等到切换完成后再进行，也不会同时开始重建
+            async with self._write_lock:
+                self._rebuild_lock = await self._acquire_rebuild_lock()
+                if self._rebuild_lock is None:
+                    logger.info("其他进程正在重建索引或写入，稍后再重建")
+                    self._rebuild_retry_at = time.monotonic() + _REBUILD_RETRY_INTERVAL
+                    return
+                # 其他进程可能已经完成了重建：以集合当前的索引为准
+                current = await asyncio.to_thread(self._read_index_params, self.collection)
+                if current is not None and not self._needs_rebuild(current, index_params):
+                    self._index_params = current
+                    return
+                logger.info(
+                    "集合约%d行，重建向量索引：%s -> %s",
+                    self._row_count,
+                    self._index_params,
+                    index_params
+                )
+                shadow = await asyncio.to_thread(self._create_shadow, index_params)
+                self._shadow = shadow
+                self._shadow_deletes = []
+                source = self.collection
+            await asyncio.to_thread(self._copy_to_shadow, source, shadow)
+            async with self._write_lock:
+                deletes, self._shadow_deletes = self._shadow_deletes, []
+            signature, params = await asyncio.to_thread(self._load_shadow, shadow, deletes, index_params)
+            # 切换到新集合（之后的检索和写入都使用新集合），再切换别名并删除旧集合；
+            # 持有写锁切换，不会有写入在切换后才落到旧集合
+            async with self._write_lock:
+                if self._shadow is not shadow:
+                    raise Exception("重建期间同步写入影子集合失败")
+                previous = self._collection
+                self._collection = shadow
+                self._signature = signature
+                self._index_params = params
+                self._shadow = None
+                shadow = None
+            collection = await asyncio.to_thread(self._retire, previous, self._collection)
+            async with self._write_lock:
+                self._collection = collection
+            logger.info("向量索引重建完成，耗时%.1f秒", time.monotonic() - started)
+        except Exception:
+            logger.exception("重建向量索引失败，继续使用原索引")
+        finally:
+            self._shadow = None
+            self._shadow_deletes = []
+            if shadow is not None:
+                try:
+                    await asyncio.to_thread(shadow.drop)
+                except Exception as e:
+                    logger.warning("删除影子集合%s失败：%s", shadow.name, e)
+            if self._rebuild_lock is not None:
+                async with self._write_lock:
+                    self._rebuild_lock.release()
+                    self._rebuild_lock = None
+
+    @property
+    def rebuilding(self) -> bool:
+        """是否正在重建索引"""
+        return self._rebuild_task is not None and not self._rebuild_task.done()
+
+    def search_params(
+        self,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """按当前索引类型生成检索参数：nprobe/ef越大召回率越高、延迟越大，未指定时使用默认值"""
+        index_type = (self._index_params or {}).get("index_type")
+        params: Dict[str, Any] = {}
+        if index_type == "IVF_FLAT":
+            nlist = int(self._index_params.get("params", {}).get("nlist", 1024))
+            nprobe = nprobe or settings.MILVUS_SEARCH_NPROBE or max(8, nlist // 32)
+            params["nprobe"] = min(nprobe, nlist)
+        elif index_type == "HNSW":
+            ef = ef or settings.MILVUS_SEARCH_EF or max(64, 2 * top_k)
+            # HNSW要求ef不小于返回条数
+            params["ef"] = max(ef, top_k)
+        return {"metric_type": "COSINE", "params": params}
+
+    def _ensure_flusher(self):
+        """按需启动后台定时写入任务"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        """后台任务：缓冲数据等待超过MILVUS_BUFFER_MAX_DELAY时写入"""
+        interval = max(settings.MILVUS_BUFFER_MAX_DELAY / 4, 0.05)
+        while True:
+            await asyncio.sleep(interval)
+            since = self._buffer_since
+            if since is not None and time.monotonic() - since >= settings.MILVUS_BUFFER_MAX_DELAY:
+                try:
+                    await self.flush_buffer()
+                except Exception as e:
+                    logger.warning("后台写入文档块失败，将稍后重试：%s", e)
+
+    async def shutdown(self):
+        """停止后台写入任务，并将剩余缓冲数据写入和落盘（应用退出时调用）"""
+        self._closing = True
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush_buffer(seal=True)
+
+    def _search(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """在已加载的集合上执行向量检索，多个查询向量合并为一次请求（超过_MAX_SEARCH_NQ时分段）"""
+        collection = self.collection
+        queries = self._vector_column(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim))
+        param = self.search_params(top_k, nprobe, ef)
+        
+        hits = []
+        for start in range(0, len(queries), _MAX_SEARCH_NQ):
             results = collection.search(
-                data=[query_embedding],
+                data=list(queries[start:start + _MAX_SEARCH_NQ]),
                 anns_field="embedding",
-                param=search_params,
+                param=param,
                 limit=top_k,
                 output_fields=["doc_id", "chunk_id", "content"]
             )
-            
-            hits = []
-            for hit in results[0]:
-                hits.append({
-                    "doc_id": hit.entity.get("doc_id"),
-                    "chunk_id": hit.entity.get("chunk_id"),
-                    "content": hit.entity.get("content"),
-                    "score": hit.score
-                })
-            
-            return hits
-            
-        except Exception as e:
-            raise Exception(f"搜索相似文档块失败：{str(e)}")
-        finally:
-            collection.release()
+            for result in results:
+                hits.append([
+                    {
+                        "doc_id": hit.entity.get("doc_id"),
+                        "chunk_id": hit.entity.get("chunk_id"),
+                        "content": hit.entity.get("content"),
+                        "score": hit.score
+                    }
+                    for hit in result
+                ])
+        
+        return hits
+
+    async def search_similar_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """搜索相似文档块（集合保持加载状态，不再每次load/release）；nprobe/ef用于按请求调整召回率与延迟。
+        pymilvus的search是阻塞调用，在线程中执行以免阻塞事件循环"""
+        try:
+            return await asyncio.to_thread(self._search, query_embeddings, top_k, nprobe, ef)
+        except Exception:
+            # 集合可能被外部释放或索引已变更，刷新后重试一次；
+            # 重建索引切换集合期间别名可能仍指向旧集合，只用当前句柄重试
+            try:
+                if not self.rebuilding:
+                    await asyncio.to_thread(self.refresh)
+                return await asyncio.to_thread(self._search, query_embeddings, top_k, nprobe, ef)
+            except Exception as e:
+                raise Exception(f"搜索相似文档块失败：{str(e)}")
+
+    async def search_similar(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """搜索单个查询向量的相似文档块"""
+        results = await self.search_similar_batch(
+            np.asarray(query_embedding, dtype=np.float32).reshape(1, -1),
+            top_k,
+            nprobe,
+            ef
+        )
+        return results[0]
+
+    def _drop_buffered(self, keep: Callable[[ChunkBatch], List[bool]]):
+        """丢弃缓冲区中尚未写入的部分文档块，keep返回每批中各块是否保留"""
+        self._buffer = [
+            kept for kept in (batch.select(keep(batch)) for batch in self._buffer) if len(kept)
+        ]
+        self._buffer_rows = sum(len(batch) for batch in self._buffer)
+        if not self._buffer:
+            self._buffer_since = None
 
     async def delete_by_doc_id(self, doc_id: str):
         """删除指定文档的所有块"""
-        collection = Collection(self.collection_name)
-        try:
-            expr = f'doc_id == "{doc_id}"'
-            collection.delete(expr)
-        except Exception as e:
-            raise Exception(f"删除文档块失败：{str(e)}")
+        async with self._write_lock:
+            # 尚在缓冲区中的块直接丢弃（持有写锁，写入失败放回缓冲区的块也会被丢弃）
+            self._drop_buffered(lambda batch: [value != doc_id for value in batch.doc_ids])
+            try:
+                await asyncio.to_thread(self._delete, [f'doc_id == "{doc_id}"'])
+            except Exception as e:
+                raise Exception(f"删除文档块失败：{str(e)}")
+
+    async def delete_by_chunk_ids(self, chunk_ids: List[str]):
+        """按chunk_id删除文档块（文档增量更新时删除已消失的块）"""
+        removed = set(chunk_ids)
+        # 分段删除，避免表达式过长
+        exprs = [
+            "chunk_id in [{}]".format(", ".join(f'"{chunk_id}"' for chunk_id in chunk_ids[start:start + 1000]))
+            for start in range(0, len(chunk_ids), 1000)
+        ]
+        async with self._write_lock:
+            self._drop_buffered(lambda batch: [value not in removed for value in batch.chunk_ids])
+            try:
+                await asyncio.to_thread(self._delete, exprs)
+            except Exception as e:
+                raise Exception(f"删除文档块失败：{str(e)}")
 
     def close(self):
         """关闭连接"""
+        if self._collection is None:
+            return
+        from pymilvus import connections
+        self._collection = None
         try:
             connections.disconnect("default")
         except Exception:
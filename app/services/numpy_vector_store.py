@@ -0,0 +1,412 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+import numpy as np
+from app.config.settings import settings
+from app.services.vector_store import ChunkBatch, VectorStore
+
+logger = logging.getLogger(__name__)
+
+# 检索时每次参与矩阵乘法的行数上限（float16需要先转换为float32，分块以限制临时内存）
+_SEARCH_BLOCK_ROWS = 65536
+# 检索时每块得分矩阵（查询数 × 行数）的元素数上限，查询越多每块的行数越少
+_SEARCH_BLOCK_SCORES = 1 << 22
+# 向量文件的最小容量（行），之后按倍数增长
+_MIN_CAPACITY = 1024
+
+
+class NumpyVectorStore(VectorStore):
+    """进程内向量存储：归一化后的向量按行存放在内存映射文件中，元数据存放在旁路SQLite中，
+    删除使用墓碑标记（压缩时才真正移除），检索为分块矩阵乘法的精确余弦相似度top-k"""
+
+    def __init__(
+        self,
+        path: str = settings.NUMPY_STORE_DIR,
+        dim: int = settings.VECTOR_DIM,
+        dtype: str = settings.NUMPY_STORE_DTYPE
+    ):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"不支持的向量存储精度：{dtype}")
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._generation = 0
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._count = 0
+        # 每行是否有效（墓碑标记），长度与容量一致
+        self._alive = np.zeros(0, dtype=bool)
+        self._rows_by_chunk: Dict[str, int] = {}
+        # 文档 -> 其chunk_id列表（按chunk_id单独删除后可能残留已删除的id，按文档删除时忽略即可）
+        self._chunks_by_doc: Dict[str, List[str]] = {}
+
+    # ---- 文件与加载 ----
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"vectors.{generation}.{self.dtype.name}")
+
+    def _open_vectors(self, capacity: int):
+        """按容量打开（必要时扩展）向量文件"""
+        file_path = self._vectors_path(self._generation)
+        size = capacity * self.dim * self.dtype.itemsize
+        with open(file_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(file_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:min(len(self._alive), capacity)] = self._alive[:capacity]
+        self._alive = alive
+        self._capacity = capacity
+
+    def _read_meta(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_committed_rows(self, rows: int):
+        """记录向量已刷到磁盘的行数（调用方需持有锁，不提交事务）"""
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rows', ?)", (str(rows),))
+
+    def connect(self):
+        """打开元数据库并加载行索引（向量本身通过内存映射按需读取，启动几乎不耗时）"""
+        with self._lock:
+            if self._conn is not None:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, "meta.sqlite3"), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    row INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            stored_dim = self._read_meta(conn, "dim")
+            stored_dtype = self._read_meta(conn, "dtype")
+            if stored_dim is None:
+                conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [("dim", str(self.dim)), ("dtype", self.dtype.name), ("generation", "0"), ("rows", "0")]
+                )
+            elif int(stored_dim) != self.dim or stored_dtype != self.dtype.name:
+                conn.close()
+                raise ValueError(
+                    f"向量文件的维度/精度（{stored_dim}/{stored_dtype}）与配置（{self.dim}/{self.dtype.name}）不一致"
+                )
+            conn.commit()
+            self._generation = int(self._read_meta(conn, "generation") or 0)
+
+            # 删除压缩中断时遗留的其他代向量文件
+            current = self._vectors_path(self._generation)
+            for stale in glob.glob(os.path.join(self.path, f"vectors.*.{self.dtype.name}")):
+                if stale != current:
+                    os.remove(stale)
+
+            rows = conn.execute("SELECT row, doc_id, chunk_id, deleted FROM chunks ORDER BY row").fetchall()
+            self._count = rows[-1][0] + 1 if rows else 0
+            self._conn = conn
+            self._alive = np.zeros(0, dtype=bool)
+            self._open_vectors(max(self._count, _MIN_CAPACITY))
+
+            # 向量文件按容量预先扩展，文件大小不能说明哪些行已写入；以记录的已落盘行数为准。
+            # 之后的行在元数据提交前已写入内存映射，进程异常退出时仍在页缓存中，但系统崩溃时可能丢失：
+            # 丢失的行读出为全零（写入的向量都已归一化），从元数据中删除
+            committed = self._read_meta(conn, "rows")
+            committed = self._count if committed is None else int(committed)
+            lost = [
+                row for row, in conn.execute("SELECT row FROM chunks WHERE row >= ?", (committed,))
+                if not self._vectors[row].any()
+            ]
+            if lost:
+                logger.warning("向量文件中有%d行在异常退出前未写入磁盘，已从元数据中删除", len(lost))
+                conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in lost])
+                lost_rows = set(lost)
+                rows = [row for row in rows if row[0] not in lost_rows]
+                self._count = rows[-1][0] + 1 if rows else 0
+            self._vectors.flush()
+            self._set_committed_rows(self._count)
+            conn.commit()
+
+            self._alive = np.zeros(self._capacity, dtype=bool)
+            self._rows_by_chunk = {}
+            self._chunks_by_doc = {}
+            for row, doc_id, chunk_id, deleted in rows:
+                if not deleted:
+                    self._alive[row] = True
+                    self._rows_by_chunk[chunk_id] = row
+                    self._chunks_by_doc.setdefault(doc_id, []).append(chunk_id)
+            self._compact_if_needed()
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def count(self) -> int:
+        """有效（未删除）的文档块数"""
+        with self._lock:
+            self.connect()
+            return len(self._rows_by_chunk)
+
+    # ---- 写入与删除 ----
+
+    def _tombstone(self, rows: List[int]):
+        """标记删除（调用方需持有锁，不提交事务）"""
+        if not rows:
+            return
+        self._alive[rows] = False
+        self._conn.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+
+    def _insert(self, chunks: ChunkBatch, durable: bool):
+        vectors = chunks.embeddings.reshape(len(chunks), self.dim).copy()
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            self.connect()
+            # 相同chunk_id再次写入时视为替换
+            self._tombstone([
+                self._rows_by_chunk.pop(chunk_id)
+                for chunk_id in chunks.chunk_ids if chunk_id in self._rows_by_chunk
+            ])
+            start = self._count
+            end = start + len(chunks)
+            if end > self._capacity:
+                self._open_vectors(max(end, self._capacity * 2))
+            self._vectors[start:end] = vectors.astype(self.dtype, copy=False)
+            self._conn.executemany(
+                "INSERT INTO chunks (row, id, doc_id, chunk_id, content) VALUES (?, ?, ?, ?, ?)",
+                zip(range(start, end), chunks.ids, chunks.doc_ids, chunks.chunk_ids, chunks.contents)
+            )
+            if durable:
+                self._vectors.flush()
+                self._set_committed_rows(end)
+            self._conn.commit()
+            self._alive[start:end] = True
+            self._count = end
+            for row, doc_id, chunk_id in zip(range(start, end), chunks.doc_ids, chunks.chunk_ids):
+                self._rows_by_chunk[chunk_id] = row
+                self._chunks_by_doc.setdefault(doc_id, []).append(chunk_id)
+
+    async def insert_chunks(self, chunks: ChunkBatch, wait_for_durability: bool = False):
+        """追加文档块，wait_for_durability为True时同时将向量文件刷到磁盘"""
+        if len(chunks):
+            await asyncio.to_thread(self._insert, chunks, wait_for_durability)
+        elif wait_for_durability:
+            await self.flush_buffer(seal=True)
+
+    def _flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._set_committed_rows(self._count)
+                self._conn.commit()
+
+    async def flush_buffer(self, seal: bool = False):
+        """写入即生效，seal为True时将向量文件刷到磁盘"""
+        if seal:
+            await asyncio.to_thread(self._flush)
+
+    def _delete_chunks(self, chunk_ids: List[str], doc_id: Optional[str] = None):
+        with self._lock:
+            self.connect()
+            if doc_id is not None:
+                chunk_ids = self._chunks_by_doc.pop(doc_id, [])
+            self._tombstone([
+                self._rows_by_chunk.pop(chunk_id) for chunk_id in chunk_ids if chunk_id in self._rows_by_chunk
+            ])
+            self._conn.commit()
+
+    async def delete_by_doc_id(self, doc_id: str):
+        """删除指定文档的所有块"""
+        await asyncio.to_thread(self._delete_chunks, [], doc_id)
+
+    async def delete_by_chunk_ids(self, chunk_ids: List[str]):
+        """按chunk_id删除文档块"""
+        await asyncio.to_thread(self._delete_chunks, chunk_ids)
+
+    # ---- 检索 ----
+
+    def _search(self, query_embeddings: np.ndarray, top_k: int) -> List[List[Dict[str, Any]]]:
+        """分块计算所有查询与全部向量的相似度，逐块合并维护每个查询的top-k"""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+        num_queries = len(queries)
+
+        with self._lock:
+            self.connect()
+            count = self._count
+            live = len(self._rows_by_chunk)
+            if count == 0 or live == 0 or top_k <= 0 or num_queries == 0:
+                return [[] for _ in range(num_queries)]
+
+            k = min(top_k, live)
+            block_rows = max(1024, min(_SEARCH_BLOCK_ROWS, _SEARCH_BLOCK_SCORES // num_queries))
+            best_scores = np.full((num_queries, k), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((num_queries, k), dtype=np.int64)
+            for start in range(0, count, block_rows):
+                end = min(start + block_rows, count)
+                block = self._vectors[start:end]
+                if block.dtype != np.float32:
+                    block = block.astype(np.float32)
+                scores = queries @ block.T
+                scores[:, ~self._alive[start:end]] = -np.inf
+                # 先在本块内取top-k，再与当前最优k个合并，合并只涉及2k列
+                if end - start > k:
+                    block_top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    scores = np.take_along_axis(scores, block_top, axis=1)
+                else:
+                    block_top = np.broadcast_to(np.arange(end - start), scores.shape)
+                candidate_scores = np.concatenate([best_scores, scores], axis=1)
+                candidate_rows = np.concatenate([best_rows, block_top + start], axis=1)
+                top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(candidate_scores, top, axis=1)
+                best_rows = np.take_along_axis(candidate_rows, top, axis=1)
+
+            order = np.argsort(-best_scores, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+            # 只为命中的行读取元数据（分段查询，避免超过SQLite的参数个数限制）
+            hit_rows = sorted({int(row) for row, score in zip(best_rows.flat, best_scores.flat) if score > -np.inf})
+            metadata = {}
+            for start in range(0, len(hit_rows), 900):
+                rows = hit_rows[start:start + 900]
+                placeholders = ", ".join("?" for _ in rows)
+                for row, doc_id, chunk_id, content in self._conn.execute(
+                    f"SELECT row, doc_id, chunk_id, content FROM chunks WHERE row IN ({placeholders})",
+                    rows
+                ):
+                    metadata[row] = (doc_id, chunk_id, content)
+
+        return [
+            [
+                {
+                    "doc_id": metadata[int(row)][0],
+                    "chunk_id": metadata[int(row)][1],
+                    "content": metadata[int(row)][2],
+                    "score": float(score)
+                }
+                for row, score in zip(rows, scores)
+                if score > -np.inf
+            ]
+            for rows, scores in zip(best_rows, best_scores)
+        ]
+
+    async def search_similar_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """多个查询一次矩阵乘法完成检索（nprobe/ef对精确检索无意义，忽略）"""
+        return await asyncio.to_thread(self._search, query_embeddings, top_k)
+
+    async def search_similar(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """精确余弦相似度检索（nprobe/ef对精确检索无意义，忽略）"""
+        results = await asyncio.to_thread(self._search, query_embedding, top_k)
+        return results[0]
+
+    # ---- 压缩与关闭 ----
+
+    def _compact_if_needed(self):
+        """已删除行占比超过NUMPY_STORE_COMPACT_RATIO时重写向量文件和元数据，去掉墓碑行"""
+        with self._lock:
+            if self._count == 0:
+                return
+            dead = self._count - len(self._rows_by_chunk)
+            if dead / self._count <= settings.NUMPY_STORE_COMPACT_RATIO:
+                return
+
+            live_rows = np.flatnonzero(self._alive[:self._count])
+            generation = self._generation + 1
+            capacity = max(len(live_rows), _MIN_CAPACITY)
+            # 新一代向量文件写完后，在同一事务中重排元数据并切换代号，避免中途退出导致不一致
+            new_vectors = np.memmap(
+                self._vectors_path(generation),
+                dtype=self.dtype,
+                mode="w+",
+                shape=(capacity, self.dim)
+            )
+            for start in range(0, len(live_rows), _SEARCH_BLOCK_ROWS):
+                rows = live_rows[start:start + _SEARCH_BLOCK_ROWS]
+                new_vectors[start:start + len(rows)] = self._vectors[rows]
+            new_vectors.flush()
+            del new_vectors
+
+            conn = self._conn
+            conn.execute("DROP TABLE IF EXISTS chunks_compacted")
+            conn.execute(
+                """CREATE TABLE chunks_compacted (
+                    row INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute(
+                """INSERT INTO chunks_compacted (row, id, doc_id, chunk_id, content)
+                    SELECT ROW_NUMBER() OVER (ORDER BY row) - 1, id, doc_id, chunk_id, content
+                    FROM chunks WHERE deleted = 0"""
+            )
+            conn.execute("DROP TABLE chunks")
+            conn.execute("ALTER TABLE chunks_compacted RENAME TO chunks")
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(generation),))
+            self._set_committed_rows(len(live_rows))
+            conn.commit()
+
+            old_path = self._vectors_path(self._generation)
+            self._vectors = None
+            self._generation = generation
+            os.remove(old_path)
+
+            remap = {int(old): new for new, old in enumerate(live_rows)}
+            self._rows_by_chunk = {chunk_id: remap[row] for chunk_id, row in self._rows_by_chunk.items()}
+            self._chunks_by_doc = {
+                doc_id: live_chunk_ids
+                for doc_id, chunk_ids in self._chunks_by_doc.items()
+                if (live_chunk_ids := [chunk_id for chunk_id in chunk_ids if chunk_id in self._rows_by_chunk])
+            }
+            self._count = len(live_rows)
+            self._alive = np.ones(self._count, dtype=bool)
+            self._open_vectors(capacity)
+            logger.info("向量文件压缩完成，移除%d个已删除的行", dead)
+
+    async def shutdown(self):
+        """刷盘并在需要时压缩（应用退出时调用）"""
+        if self._conn is None:
+            return
+        await asyncio.to_thread(self._compact_if_needed)
+        await self.flush_buffer(seal=True)
+
+    def close(self):
+        """关闭文件"""
+        with self._lock:
+            if self._vectors is not None:
+                self._flush()
+                self._vectors = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,264 @@
+import abc
+import asyncio
+import logging
+import os
+import pathlib
+import shutil
+import socket
+import sys
+from typing import List, Optional
+from app.config.settings import settings
+from app.utils.extract_text import doc_to_docx, ppt_to_pptx
+
+logger = logging.getLogger(__name__)
+
+# 目标格式对应的LibreOffice导出过滤器
+_SOFFICE_FILTERS = {
+    ".docx": "MS Word 2007 XML",
+    ".pptx": "Impress MS PowerPoint 2007 XML",
+}
+
+
+class ConversionError(Exception):
+    """.doc/.ppt转换失败"""
+
+
+class ConversionTimeout(ConversionError):
+    """.doc/.ppt转换超时"""
+
+
+class OfficeConverter(abc.ABC):
+    """旧版Office文件（.doc/.ppt）转换为.docx/.pptx的后端接口"""
+
+    @abc.abstractmethod
+    async def convert(self, source_path: str, target_path: str):
+        """将source_path转换为target_path，目标格式由target_path的扩展名决定"""
+
+    async def close(self):
+        """释放转换后端占用的资源（应用退出时调用）"""
+
+
+def _free_port() -> int:
+    """由系统分配一个本机空闲端口（同一台机器上的多个应用进程各自启动soffice，固定端口会冲突）"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _connect_desktop(port: int):
+    """通过UNO连接soffice进程，返回Desktop对象（uno仅在LibreOffice自带的Python环境中可用，按需导入）"""
+    import uno
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext(
+        "com.sun.star.bridge.UnoUrlResolver", local_context
+    )
+    context = resolver.resolve(
+        f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext"
+    )
+    return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+
+def _store_as(desktop, source_path: str, target_path: str, filter_name: str):
+    """在已连接的soffice中打开文件并导出为目标格式"""
+    import uno
+    from com.sun.star.beans import PropertyValue
+
+    def properties(**values):
+        return tuple(PropertyValue(Name=name, Value=value) for name, value in values.items())
+
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(os.path.abspath(source_path)),
+        "_blank",
+        0,
+        properties(Hidden=True, ReadOnly=True)
+    )
+    if document is None:
+        raise ConversionError(f"无法打开文件：{source_path}")
+    try:
+        document.storeToURL(
+            uno.systemPathToFileUrl(os.path.abspath(target_path)),
+            properties(FilterName=filter_name, Overwrite=True)
+        )
+    finally:
+        document.close(True)
+
+
+class _SofficeWorker:
+    """一个常驻的headless soffice进程，使用独立的用户配置目录以便多个进程并行。
+    端口在每次启动时由系统分配，配置目录按应用进程ID区分，多个应用进程（如uvicorn多worker）互不冲突"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port: Optional[int] = None
+        self.profile_dir: Optional[str] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.desktop = None
+        self.conversions = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.desktop is not None and self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        """启动soffice进程并等待UNO连接就绪"""
+        await self.stop()
+        self.port = _free_port()
+        self.profile_dir = os.path.abspath(
+            os.path.join(settings.DATA_DIR, "soffice", f"{os.getpid()}-worker{self.index}")
+        )
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.process = await asyncio.create_subprocess_exec(
+            settings.SOFFICE_PATH,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--nodefault",
+            "--nolockcheck",
+            f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+            f"-env:UserInstallation={pathlib.Path(self.profile_dir).as_uri()}",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.SOFFICE_START_TIMEOUT
+        while True:
+            returncode = self.process.returncode
+            if returncode is not None:
+                await self.stop()
+                raise ConversionError(f"soffice进程启动失败（退出码{returncode}）")
+            try:
+                self.desktop = await asyncio.to_thread(_connect_desktop, self.port)
+                return
+            except ImportError:
+                await self.stop()
+                raise ConversionError("未找到LibreOffice的Python UNO模块（uno），请使用LibreOffice自带的Python或安装python3-uno")
+            except Exception:
+                if loop.time() >= deadline:
+                    await self.stop()
+                    raise ConversionError(f"等待soffice就绪超时（{settings.SOFFICE_START_TIMEOUT:.0f}秒）")
+                await asyncio.sleep(0.5)
+
+    async def stop(self):
+        """终止soffice进程（超时、出错或达到转换次数上限时回收）"""
+        self.desktop = None
+        self.conversions = 0
+        process, self.process = self.process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def close(self):
+        """终止进程并删除本进程的用户配置目录（应用退出时调用）"""
+        await self.stop()
+        if self.profile_dir is not None:
+            await asyncio.to_thread(shutil.rmtree, self.profile_dir, True)
+            self.profile_dir = None
+
+
+class SofficeConverter(OfficeConverter):
+    """常驻headless LibreOffice进程池：进程在多次转换间复用，按需启动，超时或出错时终止并在下次使用时重启"""
+
+    def __init__(
+        self,
+        workers: int = settings.SOFFICE_WORKERS,
+        timeout: float = settings.OFFICE_CONVERT_TIMEOUT,
+        max_conversions: int = settings.SOFFICE_MAX_CONVERSIONS
+    ):
+        self.timeout = timeout
+        self.max_conversions = max_conversions
+        self._workers: List[_SofficeWorker] = [_SofficeWorker(index) for index in range(workers)]
+        self._idle: Optional[asyncio.Queue] = None
+
+    def _idle_workers(self) -> asyncio.Queue:
+        """空闲进程队列（需在事件循环中创建）"""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for worker in self._workers:
+                self._idle.put_nowait(worker)
+        return self._idle
+
+    async def convert(self, source_path: str, target_path: str):
+        filter_name = _SOFFICE_FILTERS.get(os.path.splitext(target_path)[1].lower())
+        if filter_name is None:
+            raise ConversionError(f"不支持的目标格式：{target_path}")
+
+        idle = self._idle_workers()
+        worker = await idle.get()
+        try:
+            if not worker.alive:
+                await worker.start()
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(_store_as, worker.desktop, source_path, target_path, filter_name),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                # 终止进程后，阻塞在UNO调用中的线程会随连接断开而退出
+                logger.error("文档转换超时（%.0f秒），重启soffice进程：%s", self.timeout, source_path)
+                await worker.stop()
+                raise ConversionTimeout(f"文档转换超时（{self.timeout:.0f}秒）") from None
+            except ConversionError:
+                raise
+            except Exception as e:
+                # 进程可能已处于异常状态，回收后重启
+                await worker.stop()
+                raise ConversionError(f"文档转换失败：{str(e)}")
+
+            worker.conversions += 1
+            if worker.conversions >= self.max_conversions:
+                await worker.stop()
+        finally:
+            idle.put_nowait(worker)
+
+    async def close(self):
+        for worker in self._workers:
+            await worker.close()
+
+
+def _convert_with_com(func, source_path: str, target_path: str):
+    """在线程中调用COM前需要初始化COM环境"""
+    import pythoncom
+    pythoncom.CoInitialize()
+    try:
+        func(os.path.abspath(source_path), os.path.abspath(target_path))
+    finally:
+        pythoncom.CoUninitialize()
+
+
+class Win32Converter(OfficeConverter):
+    """Windows上通过Word/PowerPoint COM接口转换（保留原有方式，每次转换启动Office，串行执行）"""
+
+    def __init__(self, timeout: float = settings.OFFICE_CONVERT_TIMEOUT):
+        self.timeout = timeout
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def convert(self, source_path: str, target_path: str):
+        func = doc_to_docx if target_path.lower().endswith(".docx") else ppt_to_pptx
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(_convert_with_com, func, source_path, target_path),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise ConversionTimeout(f"文档转换超时（{self.timeout:.0f}秒）") from None
+        if not os.path.exists(target_path):
+            raise ConversionError(f"文档转换失败：{source_path}")
+
+
+def create_office_converter(backend: str = settings.OFFICE_CONVERTER_BACKEND) -> OfficeConverter:
+    """按配置创建转换后端"""
+    if backend == "auto":
+        backend = "win32" if sys.platform == "win32" else "soffice"
+    if backend == "win32":
+        return Win32Converter()
+    if backend == "soffice":
+        return SofficeConverter()
+    raise ValueError(f"未知的文档转换后端：{backend}")
+
+
+# 全局共享的文档转换后端（soffice进程在首次转换时才启动）
+office_converter = create_office_converter()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json as jsonlib
+import aiohttp
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from app.config.settings import settings
+from app.services.ollama_scheduler import current_lane, ollama_scheduler
+from app.utils.metrics import ollama_requests_coalesced_total, ollama_requests_in_progress
+
+
+class OllamaResponse:
+    """已完整读取的Ollama响应（可在合并的请求之间共享）"""
+
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.body = body
+
+    def text(self) -> str:
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return jsonlib.loads(self.body)
+
+
+class OllamaClient:
+    """所有Ollama请求共享的HTTP客户端（应用生命周期内复用连接池）"""
+
+    def __init__(self):
+        self.base_url = settings.OLLAMA_BASE_URL.rstrip("/")
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 单飞（single-flight）：请求键 -> [执行上游调用的任务, 等待该结果的调用方数]
+        self._inflight: Dict[str, List[Any]] = {}
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        """创建带连接池和keep-alive的会话"""
+        connector = aiohttp.TCPConnector(
+            limit=settings.OLLAMA_POOL_SIZE,
+            limit_per_host=settings.OLLAMA_POOL_SIZE,
+            keepalive_timeout=settings.OLLAMA_KEEPALIVE_TIMEOUT
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(connect=settings.OLLAMA_CONNECT_TIMEOUT)
+        )
+
+    async def start(self):
+        """创建连接池，在应用启动时调用"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+
+    async def close(self):
+        """关闭连接池，在应用退出时调用"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """获取共享会话（未经lifespan启动时按需创建，便于脚本中直接使用服务）"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    @asynccontextmanager
+    async def post(
+        self,
+        path: str,
+        json: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """向Ollama发送POST请求，返回可用于async with的响应上下文（流式生成等需要逐行读取响应时使用）。
+        请求先经调度器按当前通道排队，占用名额直到响应上下文退出，期间计入进行中的Ollama请求数"""
+        async with ollama_scheduler.slot():
+            with ollama_requests_in_progress.track_inprogress(endpoint=path):
+                async with self.session.post(
+                    f"{self.base_url}{path}",
+                    json=json,
+                    timeout=aiohttp.ClientTimeout(
+                        total=timeout,
+                        connect=settings.OLLAMA_CONNECT_TIMEOUT
+                    )
+                ) as response:
+                    yield response
+
+    async def _fetch(self, path: str, json: Dict[str, Any], timeout: Optional[float]) -> OllamaResponse:
+        async with self.post(path, json=json, timeout=timeout) as response:
+            return OllamaResponse(response.status, await response.read())
+
+    def _forget(self, key: str, entry: List[Any]):
+        """上游调用结束后移除单飞记录（此后的相同请求重新调用）"""
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+        task = entry[0]
+        if not task.cancelled():
+            # 标记异常已读取：所有调用方都已离开时异常无人接收
+            task.exception()
+
+    async def request(
+        self,
+        path: str,
+        json: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> OllamaResponse:
+        """发送POST请求并读取完整响应。同一调度通道中请求体完全相同的并发请求合并为一次上游调用，
+        结果由所有调用方共享；只有全部调用方都取消时才取消上游调用"""
+        if not settings.OLLAMA_SINGLE_FLIGHT:
+            return await self._fetch(path, json, timeout)
+        
+        # 按通道区分：交互式请求不会等待排在bulk通道中的相同请求
+        key = hashlib.sha256(
+            (current_lane() + "\n" + path + jsonlib.dumps(json, sort_keys=True, ensure_ascii=False)).encode("utf-8")
+        ).hexdigest()
+        entry = self._inflight.get(key)
+        if entry is None:
+            # 上游调用在独立任务中执行，不受发起者取消的影响（沿用发起者的调度通道）
+            task = asyncio.ensure_future(self._fetch(path, json, timeout))
+            entry = [task, 0]
+            self._inflight[key] = entry
+            task.add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            ollama_requests_coalesced_total.inc(endpoint=path)
+        
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                # 先移除记录再取消，之后的相同请求重新调用，不会拿到已取消的任务
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+
+
+# 全局共享的Ollama客户端
+ollama_client = OllamaClient()
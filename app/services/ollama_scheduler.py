@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from app.config.settings import settings
+from app.utils.metrics import CallbackGauge, registry
+
+# Ollama请求调度：所有模型调用按优先级通道排队，交互式问答（interactive）优先于批量入库（bulk），
+# 各通道和全局分别限制并发数；通道排队过长时直接拒绝（接口返回429），不设上限的通道只排队等待（背压）
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# 通道按优先级从高到低排列，有空闲名额时先分配给高优先级通道的排队请求
+LANES = (INTERACTIVE, BULK)
+
+# 当前任务发出的Ollama请求所属通道，默认为交互式；入库worker设为bulk，其创建的子任务随之继承
+_current_lane: ContextVar[str] = ContextVar("ollama_lane", default=INTERACTIVE)
+
+ollama_queue_wait_seconds = registry.histogram(
+    "ollama_queue_wait_seconds",
+    "Ollama请求在调度队列中的等待时间（秒）",
+    ["lane"]
+)
+ollama_requests_rejected_total = registry.counter(
+    "ollama_requests_rejected_total",
+    "因通道排队过长被拒绝的Ollama请求数",
+    ["lane"]
+)
+
+
+class OllamaBusyError(Exception):
+    """通道排队请求数已达上限，调用方应稍后重试（接口返回429）"""
+
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"模型服务繁忙（{lane}通道排队已满），请稍后重试")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+@contextmanager
+def use_lane(lane: str) -> Iterator[None]:
+    """在代码块内（及其中创建的任务）发出的Ollama请求使用指定通道"""
+    if lane not in LANES:
+        raise ValueError(f"未知的Ollama调度通道：{lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+class _Lane:
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue  # 0表示不限制，只排队等待
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class OllamaScheduler:
+    """按优先级通道分配Ollama请求名额的调度器（单事件循环内使用）"""
+
+    def __init__(self, total_limit: int, lanes: Dict[str, Tuple[int, int]]):
+        """lanes：通道名 -> (并发上限, 排队上限)"""
+        self.total_limit = total_limit
+        self._active = 0
+        self._lanes = {name: _Lane(name, *lanes[name]) for name in LANES}
+
+    @asynccontextmanager
+    async def slot(self, lane: Optional[str] = None):
+        """占用一个请求名额，退出时释放；通道排队已满时抛出OllamaBusyError"""
+        state = self._lanes[lane or current_lane()]
+        started = time.perf_counter()
+        # 无人排队且有空闲名额时直接执行，否则按通道排队
+        if state.waiters or not self._can_start(state):
+            if state.max_queue and len(state.waiters) >= state.max_queue:
+                ollama_requests_rejected_total.inc(lane=state.name)
+                raise OllamaBusyError(state.name, settings.OLLAMA_BUSY_RETRY_AFTER)
+            waiter = asyncio.get_running_loop().create_future()
+            state.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 已分配到名额后才被取消，把名额交还给其他排队请求
+                    self._release(state)
+                elif waiter in state.waiters:
+                    state.waiters.remove(waiter)
+                raise
+        else:
+            self._acquire(state)
+        ollama_queue_wait_seconds.observe(time.perf_counter() - started, lane=state.name)
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    def _can_start(self, state: _Lane) -> bool:
+        return self._active < self.total_limit and state.active < state.limit
+
+    def _acquire(self, state: _Lane):
+        self._active += 1
+        state.active += 1
+
+    def _release(self, state: _Lane):
+        self._active -= 1
+        state.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """把空闲名额按优先级分配给排队请求"""
+        for state in self._lanes.values():
+            while state.waiters and self._can_start(state):
+                waiter = state.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._acquire(state)
+                waiter.set_result(None)
+
+    def stats(self) -> List[Tuple[Dict[str, str], float]]:
+        """各通道的排队数和进行中请求数，供/metrics采集"""
+        samples = []
+        for state in self._lanes.values():
+            samples.append(({"lane": state.name, "state": "queued"}, len(state.waiters)))
+            samples.append(({"lane": state.name, "state": "active"}, state.active))
+        return samples
+
+
+# 全局共享的Ollama调度器
+ollama_scheduler = OllamaScheduler(
+    settings.OLLAMA_MAX_CONCURRENCY,
+    {
+        INTERACTIVE: (settings.OLLAMA_INTERACTIVE_CONCURRENCY, settings.OLLAMA_INTERACTIVE_MAX_QUEUE),
+        BULK: (settings.OLLAMA_BULK_CONCURRENCY, settings.OLLAMA_BULK_MAX_QUEUE),
+    }
+)
+
+registry.register(CallbackGauge(
+    "ollama_scheduler_requests",
+    "Ollama调度器各通道排队中（queued）和进行中（active）的请求数",
+    ollama_scheduler.stats,
+    labelnames=["lane", "state"]
+))
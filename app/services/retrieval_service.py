@@ -1,87 +1,147 @@
-from typing import List, Dict, Any
-import jieba
-from rank_bm25 import BM25Okapi
-from app.services.milvus_service import MilvusService
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+from app.services.vector_store import VectorStore, create_vector_store
 from app.services.embedding_service import EmbeddingService
+from app.services.bm25_index import bm25_index
+from app.services.document_registry import document_registry
+from app.services.ollama_scheduler import OllamaBusyError
 from app.config.settings import settings
+from app.utils.metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# 单次检索取回的候选数上限（Milvus的topk上限）
+_MAX_SEARCH_TOP_K = 16384
 
 class RetrievalService:
-    def __init__(self):
-        self.milvus_service = MilvusService()
-        self.embedding_service = EmbeddingService()
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        embedding_service: Optional[EmbeddingService] = None
+    ):
+        self.vector_store = vector_store if vector_store is not None else create_vector_store()
+        self.embedding_service = embedding_service if embedding_service is not None else EmbeddingService()
+        self.bm25_index = bm25_index
+        self.document_registry = document_registry
         self.vector_weight = settings.VECTOR_SEARCH_WEIGHT
         self.bm25_weight = settings.BM25_WEIGHT
 
-    def _tokenize(self, text: str) -> List[str]:
-        """使用jieba分词"""
-        return list(jieba.cut(text))
+    def _oversampled(self, top_k: int) -> int:
+        """隐藏的文档块在取回后才被过滤，按隐藏块数多取候选，使入库进行中的检索结果不会变少"""
+        return min(top_k + self.document_registry.hidden_count(), max(top_k, _MAX_SEARCH_TOP_K))
 
-    async def _bm25_search(self, query: str, documents: List[str], top_k: int = 5) -> List[Dict[str, Any]]:
-        """使用BM25算法进行检索"""
-        # 对查询和文档进行分词
-        tokenized_query = self._tokenize(query)
-        tokenized_documents = [self._tokenize(doc) for doc in documents]
-        
-        # 创建BM25模型
-        bm25 = BM25Okapi(tokenized_documents)
-        
-        # 计算得分
-        scores = bm25.get_scores(tokenized_query)
-        
-        # 将文档和得分组合，并按得分排序
-        results = [
-            {"content": documents[i], "score": float(scores[i])}
-            for i in range(len(documents))
-        ]
-        results.sort(key=lambda x: x["score"], reverse=True)
-        
-        return results[:top_k]
+    async def _bm25_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """在全语料BM25倒排索引上检索，与向量检索相互独立。
+        索引锁在入库写SQLite期间会被长时间持有，放到线程中执行以免阻塞事件循环"""
+        return await asyncio.to_thread(self.bm25_index.search, query, top_k)
 
-    async def hybrid_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """混合检索（向量检索 + BM25）"""
+    async def hybrid_search(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """混合检索（向量检索 + BM25），nprobe/ef调整向量检索的召回率与延迟（分别对应IVF和HNSW索引）"""
         # 1. 向量检索
-        query_embedding = await self.embedding_service.get_embedding(query)
-        vector_results = await self.milvus_service.search_similar(query_embedding, top_k=top_k)
-        
-        # 2. BM25检索
-        documents = [result["content"] for result in vector_results]
-        bm25_results = await self._bm25_search(query, documents, top_k=top_k)
-        
-        # 3. 合并结果
-        merged_results = {}
-        for i, vec_result in enumerate(vector_results):
-            doc_id = vec_result["doc_id"]
-            merged_results[doc_id] = {
-                "content": vec_result["content"],
-                "vector_score": vec_result["score"],
-                "bm25_score": 0.0,
-                "final_score": 0.0
-            }
-        
-        for i, bm25_result in enumerate(bm25_results):
-            content = bm25_result["content"]
-            for doc_id, result in merged_results.items():
-                if result["content"] == content:
-                    result["bm25_score"] = bm25_result["score"]
-                    break
+        with timed_stage("embed"):
+            query_embedding = await self.embedding_service.get_embedding(query, persist=False)
+        with timed_stage("vector_search"):
+            vector_results = await self.vector_store.search_similar(
+                query_embedding,
+                top_k=self._oversampled(top_k),
+                nprobe=nprobe,
+                ef=ef
+            )
         
-        # 4. 计算最终得分
-        for result in merged_results.values():
-            result["final_score"] = (
-                self.vector_weight * result["vector_score"] +
-                self.bm25_weight * result["bm25_score"]
+        return await self.fuse_and_rerank(query, vector_results, top_k)
+
+    async def vector_search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """批量向量检索：所有问题批量嵌入，再以一次多向量检索取回各自的结果"""
+        with timed_stage("embed"):
+            query_embeddings = await self.embedding_service.get_embeddings_batch(queries, persist=False)
+        with timed_stage("vector_search"):
+            return await self.vector_store.search_similar_batch(
+                query_embeddings,
+                top_k=self._oversampled(top_k),
+                nprobe=nprobe,
+                ef=ef
             )
+
+    async def fuse_and_rerank(
+        self,
+        query: str,
+        vector_results: List[Dict[str, Any]],
+        top_k: int = 5
+    ) -> List[Dict[str, Any]]:
+        """把向量检索结果与BM25检索结果加权融合，再用重排序模型排序"""
+        # 2. BM25检索（全语料，可召回向量检索遗漏的文档块）
+        with timed_stage("bm25"):
+            bm25_results = await self._bm25_search(query, top_k=self._oversampled(top_k))
         
-        # 5. 按最终得分排序
-        final_results = list(merged_results.values())
-        final_results.sort(key=lambda x: x["final_score"], reverse=True)
+        with timed_stage("fusion"):
+            # 3. 按chunk_id合并结果（跳过入库或替换尚未完成、暂时隐藏的文档块）
+            is_hidden = self.document_registry.is_hidden
+            vector_results = [result for result in vector_results if not is_hidden(result["chunk_id"])][:top_k]
+            bm25_results = [result for result in bm25_results if not is_hidden(result["chunk_id"])][:top_k]
+            merged_results = {}
+            for vec_result in vector_results:
+                merged_results[vec_result["chunk_id"]] = {
+                    "chunk_id": vec_result["chunk_id"],
+                    "content": vec_result["content"],
+                    "vector_score": vec_result["score"],
+                    "bm25_score": 0.0,
+                    "final_score": 0.0
+                }
+            
+            # BM25得分无上界，按本次最高分归一化到[0, 1]后再与向量得分加权
+            max_bm25_score = max((result["score"] for result in bm25_results), default=0.0)
+            for bm25_result in bm25_results:
+                bm25_score = bm25_result["score"] / max_bm25_score if max_bm25_score > 0 else 0.0
+                merged = merged_results.setdefault(bm25_result["chunk_id"], {
+                    "chunk_id": bm25_result["chunk_id"],
+                    "content": bm25_result["content"],
+                    "vector_score": 0.0,
+                    "bm25_score": 0.0,
+                    "final_score": 0.0
+                })
+                merged["bm25_score"] = bm25_score
+            
+            # 4. 计算最终得分
+            for result in merged_results.values():
+                result["final_score"] = (
+                    self.vector_weight * result["vector_score"] +
+                    self.bm25_weight * result["bm25_score"]
+                )
+            
+            # 5. 按最终得分排序
+            final_results = list(merged_results.values())
+            final_results.sort(key=lambda x: x["final_score"], reverse=True)
         
         # 6. 重排序
         if len(final_results) > 0:
-            reranked_results = await self.embedding_service.rerank_chunks(
-                query,
-                [result["content"] for result in final_results[:top_k]]
-            )
+            with timed_stage("rerank"):
+                try:
+                    reranked_results = await self.embedding_service.rerank_chunks(
+                        query,
+                        [result["content"] for result in final_results[:top_k]],
+                        chunk_ids=[result["chunk_id"] for result in final_results[:top_k]]
+                    )
+                except OllamaBusyError:
+                    raise
+                except Exception as e:
+                    # 重排序失败不影响问答，按融合得分的顺序返回
+                    logger.warning("重排序失败，按融合得分排序：%s", e)
+                    reranked_results = [
+                        (result["content"], result["final_score"]) for result in final_results[:top_k]
+                    ]
             
             # 更新最终结果
             final_results = [
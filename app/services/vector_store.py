@@ -0,0 +1,129 @@
+import abc
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+import numpy as np
+from app.config.settings import settings
+
+
+class ChunkBatch:
+    """按列存放的一批文档块：字符串字段各为一列，嵌入向量为连续的float32矩阵（每行一个块），
+    从解码嵌入接口响应到写入向量存储全程不产生逐行字典和Python浮点数列表"""
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        doc_ids: Sequence[str],
+        chunk_ids: Sequence[str],
+        contents: Sequence[str],
+        embeddings: np.ndarray
+    ):
+        self.ids = list(ids)
+        self.doc_ids = list(doc_ids)
+        self.chunk_ids = list(chunk_ids)
+        self.contents = list(contents)
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.embeddings.ndim != 2 or not (
+            len(self.ids) == len(self.doc_ids) == len(self.chunk_ids) == len(self.contents) == len(self.embeddings)
+        ):
+            raise ValueError("文档块各列的长度不一致")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls, dim: int = settings.VECTOR_DIM) -> "ChunkBatch":
+        return cls([], [], [], [], np.empty((0, dim), dtype=np.float32))
+
+    @classmethod
+    def concat(cls, batches: Iterable["ChunkBatch"]) -> "ChunkBatch":
+        """按顺序合并多批文档块"""
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return cls(
+            [value for batch in batches for value in batch.ids],
+            [value for batch in batches for value in batch.doc_ids],
+            [value for batch in batches for value in batch.chunk_ids],
+            [value for batch in batches for value in batch.contents],
+            np.concatenate([batch.embeddings for batch in batches])
+        )
+
+    def select(self, mask: Union[np.ndarray, List[bool]]) -> "ChunkBatch":
+        """按布尔掩码选取部分文档块"""
+        mask = np.asarray(mask, dtype=bool)
+        indices = np.flatnonzero(mask)
+        return ChunkBatch(
+            [self.ids[i] for i in indices],
+            [self.doc_ids[i] for i in indices],
+            [self.chunk_ids[i] for i in indices],
+            [self.contents[i] for i in indices],
+            self.embeddings[mask]
+        )
+
+
+class VectorStore(abc.ABC):
+    """向量存储接口：文档块的写入、删除和相似度检索。文档块按列以ChunkBatch传入，查询向量为float32数组"""
+
+    def connect(self):
+        """建立连接或加载数据（幂等，首次使用时也会自动调用）"""
+
+    @property
+    def connected(self) -> bool:
+        """是否已可用"""
+        return True
+
+    @abc.abstractmethod
+    async def insert_chunks(self, chunks: ChunkBatch, wait_for_durability: bool = False):
+        """插入文档块，wait_for_durability为True时等待数据持久化"""
+
+    @abc.abstractmethod
+    async def flush_buffer(self, seal: bool = False):
+        """写入缓冲中的数据，seal为True时同时持久化"""
+
+    @abc.abstractmethod
+    async def search_similar(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """检索最相似的top_k个文档块，返回doc_id、chunk_id、content、score（余弦相似度）。
+        nprobe/ef为近似索引的召回率参数，精确检索的实现可以忽略"""
+
+    async def search_similar_batch(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """一次检索多个查询向量（每行一个），按顺序返回各自的结果；默认逐个调用search_similar"""
+        return [await self.search_similar(query_embedding, top_k, nprobe, ef) for query_embedding in query_embeddings]
+
+    @abc.abstractmethod
+    async def delete_by_doc_id(self, doc_id: str):
+        """删除指定文档的所有块"""
+
+    @abc.abstractmethod
+    async def delete_by_chunk_ids(self, chunk_ids: List[str]):
+        """按chunk_id删除文档块"""
+
+    async def shutdown(self):
+        """写入并持久化剩余数据（应用退出时调用）"""
+        await self.flush_buffer(seal=True)
+
+    def close(self):
+        """释放连接或文件"""
+
+
+def create_vector_store(backend: str = settings.VECTOR_STORE_BACKEND) -> VectorStore:
+    """按配置创建向量存储后端（对应模块按需导入）"""
+    if backend == "milvus":
+        from app.services.milvus_service import MilvusService
+        return MilvusService()
+    if backend == "numpy":
+        from app.services.numpy_vector_store import NumpyVectorStore
+        return NumpyVectorStore()
+    raise ValueError(f"未知的向量存储后端：{backend}")
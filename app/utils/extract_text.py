@@ -3,43 +3,58 @@ import re
 import sys
 import tempfile
 import uuid
-import fitz  # PyMuPDF 用于处理PDF文件
-import docx  # python-docx 用于处理Word文件
-from pptx import Presentation  # python-pptx 用于处理PPT文件
-from win32com import client as win32
-from docx.document import Document as _Document
-from docx.oxml.text.paragraph import CT_P
-from docx.oxml.table import CT_Tbl
-from docx.table import _Cell, Table, _Row
-from docx.text.paragraph import Paragraph
-
-
-#
-def extract_text_from_pdf(pdf_path):
+
+# 解析库按文件类型在使用时才导入：PyMuPDF、python-docx、python-pptx导入较慢，win32com仅在Windows上可用
+
+
+# 获取pdf页数
+def get_pdf_page_count(pdf_path):
+    import fitz  # PyMuPDF 用于处理PDF文件
+    with fitz.open(pdf_path) as document:
+        return len(document)
+
+
+# 逐页提取pdf中的文本，可指定页码范围[start_page, end_page)，每页文本以空行结尾
+def iter_text_from_pdf(pdf_path, start_page=0, end_page=None):
+    import fitz  # PyMuPDF 用于处理PDF文件
     # 定义页眉页脚的高度占比
     header_footer_threshold = 0.1
     # 打开pdf文件
     document = fitz.open(pdf_path)
-    extracted_text = ""
-    for page_num in range(len(document)):
-        page = document.load_page(page_num)
-        # 获取页面的文本块
-        text_blocks = page.get_text("blocks")
-        # 获取页面高度
-        page_height = page.rect.height
-        page_text = ""
-        for block in text_blocks:
-            x0, y0, x1, y1, text = block[:5]  # 文本块位置和内容
-            # 如果文本位于页眉或页脚区域，跳过处理
-            if y0 < header_footer_threshold * page_height or y1 > (1 - header_footer_threshold) * page_height:
-                continue
-            page_text += text.strip() + "\n"
-        extracted_text += page_text.strip() + "\n\n"
-    return extracted_text
+    try:
+        if end_page is None or end_page > len(document):
+            end_page = len(document)
+        for page_num in range(start_page, end_page):
+            page = document.load_page(page_num)
+            # 获取页面的文本块
+            text_blocks = page.get_text("blocks")
+            # 获取页面高度
+            page_height = page.rect.height
+            page_text = ""
+            for block in text_blocks:
+                x0, y0, x1, y1, text = block[:5]  # 文本块位置和内容
+                # 如果文本位于页眉或页脚区域，跳过处理
+                if y0 < header_footer_threshold * page_height or y1 > (1 - header_footer_threshold) * page_height:
+                    continue
+                page_text += text.strip() + "\n"
+            yield page_text.strip() + "\n\n"
+    finally:
+        document.close()
+
+
+# 提取pdf中的文本，可指定页码范围[start_page, end_page)以便多进程分段并行解析
+def extract_text_from_pdf(pdf_path, start_page=0, end_page=None):
+    return "".join(iter_text_from_pdf(pdf_path, start_page, end_page))
+
+
+# 按页提取pdf文本并以列表返回（供解析进程池分段流式解析使用）
+def extract_pages_from_pdf(pdf_path, start_page=0, end_page=None):
+    return list(iter_text_from_pdf(pdf_path, start_page, end_page))
 
 
 # 提取ppt、pptx中的文本
 def extract_text_from_pptx(ppt_path):
+    from pptx import Presentation  # python-pptx 用于处理PPT文件
     # 打开PPT文件
     presentation = Presentation(ppt_path)
     text_content = []
@@ -64,8 +79,15 @@ def extract_text_from_pptx(ppt_path):
     return "\n".join(text_content)
 
 
-# 提取Word文件中的文本
-def extract_text_from_docx(docx_path):
+# 逐块提取Word文件中的文本（每个段落或表格行为一块）
+def iter_text_from_docx(docx_path):
+    import docx  # python-docx 用于处理Word文件
+    from docx.document import Document as _Document
+    from docx.oxml.text.paragraph import CT_P
+    from docx.oxml.table import CT_Tbl
+    from docx.table import _Cell, Table, _Row
+    from docx.text.paragraph import Paragraph
+
     document = docx.Document(docx_path)
 
     def iterate_block_items(parent):
@@ -98,13 +120,12 @@ def extract_text_from_docx(docx_path):
 
     # 缓存机制，记录已经处理的合并单元格
     processed_cells = set()
-    extracted_content = []
     for block in iterate_block_items(document):
         # 如果是段落，提取文本
         if isinstance(block, Paragraph):
             paragraph_text = block.text.strip()
             if paragraph_text:
-                extracted_content.append(paragraph_text)
+                yield paragraph_text
         # 如果是表格，处理表格中的每一行
         elif isinstance(block, Table):
             for row in block.rows:
@@ -129,11 +150,16 @@ def extract_text_from_docx(docx_path):
                     processed_cells.add(cell_key)
                 # 只添加包含文本的行
                 if row_data:
-                    extracted_content.append("\t".join(row_data))  # 使用制表符对齐表格内容
-    return "\n".join(extracted_content)
+                    yield "\t".join(row_data)  # 使用制表符对齐表格内容
+
+
+# 提取Word文件中的文本
+def extract_text_from_docx(docx_path):
+    return "\n".join(iter_text_from_docx(docx_path))
 
 
 def doc_to_docx(doc_path, docx_path):
+    from win32com import client as win32
     try:
         word_app = win32.Dispatch('Word.Application')
         doc = word_app.Documents.Open(doc_path)
@@ -146,6 +172,7 @@ def doc_to_docx(doc_path, docx_path):
 
 
 def ppt_to_pptx(ppt_path, pptx_path):
+    from win32com import client as win32
     try:
         powerpoint_app = win32.Dispatch('PowerPoint.Application')
         ppt = powerpoint_app.Presentations.Open(ppt_path)
@@ -207,4 +234,15 @@ def extract_text_from_file(file_path):
         text = extract_text_from_txt(file_path)
     else:
         not_support.append(file_path)
-    return text
\ No newline at end of file
+    return text
+
+
+# 提取文件文本并按块以列表返回，各块依次拼接即为完整文本（供解析进程池流式解析使用）
+def extract_blocks_from_file(file_path):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension == '.pdf':
+        return extract_pages_from_pdf(file_path)
+    if file_extension == '.docx':
+        return [block + "\n" for block in iter_text_from_docx(file_path)]
+    text = extract_text_from_file(file_path)
+    return [text] if text else []
@@ -0,0 +1,77 @@
+import os
+import sys
+from typing import Optional
+
+if sys.platform == "win32":
+    import msvcrt
+    import pywintypes
+    import win32con
+    import win32file
+
+    def _lock(fd: int, shared: bool, blocking: bool) -> bool:
+        flags = 0 if shared else win32con.LOCKFILE_EXCLUSIVE_LOCK
+        if not blocking:
+            flags |= win32con.LOCKFILE_FAIL_IMMEDIATELY
+        try:
+            win32file.LockFileEx(msvcrt.get_osfhandle(fd), flags, 1, 0, pywintypes.OVERLAPPED())
+        except pywintypes.error:
+            if blocking:
+                raise
+            return False
+        return True
+
+    def _unlock(fd: int):
+        win32file.UnlockFileEx(msvcrt.get_osfhandle(fd), 1, 0, pywintypes.OVERLAPPED())
+else:
+    import fcntl
+
+    def _lock(fd: int, shared: bool, blocking: bool) -> bool:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """跨进程的读写锁（同一台机器上的多个应用进程之间）：共享模式可同时持有，排他模式独占。
+    每个实例各自打开锁文件，同一进程内的两个实例之间同样互斥，持有排他锁时不要再获取同一文件的共享锁"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, shared: bool = False, blocking: bool = True) -> bool:
+        """获取锁，blocking为False时无法立即获取则返回False"""
+        if self._fd is not None:
+            raise RuntimeError(f"锁已被持有：{self.path}")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            acquired = _lock(fd, shared, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not acquired:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        """释放锁"""
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
@@ -1,15 +1,15 @@
-from fastapi import HTTPException, UploadFile
+from typing import Optional
+from fastapi import HTTPException
 from app.config.settings import settings
 import os
 
-def validate_file_size(file: UploadFile) -> None:
-    """验证文件大小是否在限制范围内"""
-    # 获取文件大小
-    file.file.seek(0, 2)  # 移动到文件末尾
-    file_size = file.file.tell()  # 获取文件大小
-    file.file.seek(0)  # 重置文件指针到开头
-    
-    if file_size > settings.MAX_FILE_SIZE:
+# multipart表单除文件内容外的开销（分隔符、各部分的头）上限
+_MULTIPART_OVERHEAD = 64 * 1024
+
+def validate_content_length(content_length: Optional[str]) -> None:
+    """请求声明的长度已超过限制时不读取请求体直接拒绝（接收过程中还会逐块检查文件大小）"""
+    if content_length is not None and content_length.isdigit() \
+            and int(content_length) > settings.MAX_FILE_SIZE + _MULTIPART_OVERHEAD:
         raise HTTPException(
             status_code=400,
             detail=f"文件大小超过限制：{settings.MAX_FILE_SIZE / 1024 / 1024}MB"
@@ -24,22 +24,8 @@ def validate_file_extension(filename: str) -> None:
             detail=f"不支持的文件类型。允许的文件类型：{', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
 
-def get_safe_filename(filename: str) -> str:
-    """生成安全的文件名，避免文件名冲突"""
-    base_name = os.path.splitext(filename)[0]
-    extension = os.path.splitext(filename)[1]
-    counter = 1
-    new_filename = filename
-    
-    while os.path.exists(os.path.join(settings.UPLOAD_DIR, new_filename)):
-        new_filename = f"{base_name}_{counter}{extension}"
-        counter += 1
-        
-    return new_filename
+def get_storage_path(content_hash: str, filename: str) -> str:
+    """按内容哈希生成存储路径（内容寻址，相同文件只存一份）"""
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(settings.UPLOAD_DIR, content_hash[:2], f"{content_hash}{extension}")
 
-def validate_file(file: UploadFile) -> str:
-    """完整的文件验证流程"""
-    validate_file_extension(file.filename)
-    validate_file_size(file)
-    safe_filename = get_safe_filename(file.filename)
-    return safe_filename
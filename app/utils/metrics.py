@@ -0,0 +1,312 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 轻量级指标注册表：Counter、Gauge、Histogram和回调指标，按Prometheus文本格式（0.0.4）输出，不依赖prometheus_client
+
+LabelValues = Tuple[str, ...]
+
+# 默认的延迟分桶（秒），覆盖从毫秒级检索到分钟级生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标{self.name}的标签应为{self.labelnames}，实际为{tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """可增可减的当前值（如进行中的请求数）"""
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: str):
+        """进入时加一、退出时减一"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class CallbackGauge(_Metric):
+    """采集时才调用回调取值的指标，适合暴露已有对象的统计（缓存命中数、队列长度等）"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+        labelnames: Sequence[str] = (),
+        type_name: str = "gauge"
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.type_name = type_name
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.callback():
+            yield f"{self.name}{_format_labels(self.labelnames, self._label_values(labels))} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """分桶统计的耗时分布"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：各桶的计数（最后一个为+Inf）、总和、总数
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """记录代码块的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标{metric.name}已注册")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """输出Prometheus文本格式"""
+        return "\n".join(metric.render() for metric in list(self._metrics.values())) + "\n"
+
+
+# 全局指标注册表
+registry = MetricsRegistry()
+
+# 问答链路各阶段耗时：embed、vector_search、bm25、fusion、rerank、prompt_build、llm_first_token、llm_total
+qa_stage_seconds = registry.histogram("qa_stage_seconds", "问答各阶段耗时（秒）", ["stage"])
+# 入库各阶段耗时：extract（整个解析切分阶段）、embed/tokenize/vector_insert/bm25_insert（每批），以及整个任务job
+ingest_stage_seconds = registry.histogram("ingest_stage_seconds", "入库各阶段耗时（秒）", ["stage"])
+ingest_documents_total = registry.counter("ingest_documents_total", "结束的入库任务数", ["status"])
+ingest_chunks_total = registry.counter("ingest_chunks_total", "入库的文档块数（new为新嵌入，reused为增量更新时复用）", ["kind"])
+ingest_bytes_total = registry.counter("ingest_bytes_total", "成功入库的文件字节数")
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds",
+    "HTTP请求耗时（秒，流式响应统计到响应结束）",
+    ["method", "handler", "status"]
+)
+http_requests_in_progress = registry.gauge("http_requests_in_progress", "进行中的HTTP请求数", ["method"])
+ollama_requests_in_progress = registry.gauge("ollama_requests_in_progress", "进行中的Ollama请求数", ["endpoint"])
+ollama_requests_coalesced_total = registry.counter(
+    "ollama_requests_coalesced_total",
+    "与进行中的相同请求合并、未单独调用Ollama的请求数",
+    ["endpoint"]
+)
+ingest_jobs_queued = registry.gauge("ingest_jobs_queued", "入库队列中等待的任务数")
+ingest_jobs_in_progress = registry.gauge("ingest_jobs_in_progress", "正在执行的入库任务数")
+rerank_cache_lookups_total = registry.counter("rerank_cache_lookups_total", "重排序得分缓存查询次数", ["result"])
+
+
+# 当前请求的Server-Timing记录：(阶段, 耗时秒)，由中间件在请求开始时创建，请求内创建的任务共享同一列表
+_server_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timings", default=None)
+
+
+def start_server_timing() -> List[Tuple[str, float]]:
+    """为当前请求开始记录Server-Timing"""
+    timings: List[Tuple[str, float]] = []
+    _server_timings.set(timings)
+    return timings
+
+
+def observe_stage(histogram: Histogram, stage: str, seconds: float):
+    """记录一个阶段的耗时，并加入当前请求的Server-Timing（不在请求中时只记录直方图）"""
+    histogram.observe(seconds, stage=stage)
+    timings = _server_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed_stage(stage: str, histogram: Histogram = qa_stage_seconds):
+    """记录代码块的阶段耗时（默认计入问答阶段直方图）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(histogram, stage, time.perf_counter() - started)
+
+
+def format_server_timing(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """格式化Server-Timing响应头（毫秒），同一阶段多次出现时（如批量问答）合并耗时并记录次数"""
+    merged: Dict[str, List[float]] = {}
+    for stage, seconds in timings:
+        entry = merged.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f"{stage};dur={seconds * 1000:.1f}" + (f';desc="x{count}"' if count > 1 else "")
+        for stage, (seconds, count) in merged.items()
+    ]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """ASGI中间件：统计HTTP请求耗时和进行中的请求数，并把本次请求记录的各阶段耗时写入Server-Timing响应头
+    （/ask/stream在检索完成后、生成开始前发出响应头，因此只包含检索各阶段，不含生成）"""
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = start_server_timing()
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", format_server_timing(timings, time.perf_counter() - started))
+            await send(message)
+
+        with http_requests_in_progress.track_inprogress(method=method):
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                # 按路由的处理函数名统计（路由匹配后才能得到），未匹配的请求归为一类，避免标签基数随路径增长
+                handler = getattr(scope.get("route"), "name", None) or "unmatched"
+                http_request_seconds.observe(
+                    time.perf_counter() - started,
+                    method=method,
+                    handler=handler,
+                    status=str(status["code"])
+                )
@@ -0,0 +1,32 @@
+import asyncio
+import sys
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp
+
+# 可重试的瞬时错误（Ollama/Milvus连接问题、超时、解析进程池被重建等）
+TRANSIENT_ERRORS = (
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    ConnectionError,
+    BrokenProcessPool
+)
+
+
+def _is_milvus_error(error: BaseException) -> bool:
+    """pymilvus按需导入：尚未导入时不可能抛出MilvusException"""
+    exceptions = sys.modules.get("pymilvus.exceptions")
+    return exceptions is not None and isinstance(error, exceptions.MilvusException)
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """判断异常（含被包装的原始异常）是否为可重试的瞬时错误"""
+    while error is not None:
+        if isinstance(error, TRANSIENT_ERRORS) or _is_milvus_error(error):
+            return True
+        if error.__cause__ is not None:
+            error = error.__cause__
+        elif not error.__suppress_context__:
+            error = error.__context__
+        else:
+            error = None
+    return False
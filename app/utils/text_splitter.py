@@ -1,96 +1,192 @@
-from typing import List
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+from collections import deque
+import math
 import re
 from app.config.settings import settings
 
+# 句子结束符（中英文句号、问号、感叹号、分号）或段落分隔（空行）作为切分单元的边界
+_BOUNDARY_PATTERN = re.compile(r'[。！？；!?;]+|\.(?=\s)|\n\s*\n')
+# 近似分词：CJK字符各算一个token，连续的字母数字按每4个字符一个token，其余符号各算一个
+_TOKEN_PATTERN = re.compile(r'[぀-ヿ㐀-鿿가-힯豈-﫿]|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]')
+
+
+def approximate_token_count(text: str) -> int:
+    """估算文本在嵌入模型中的token数（无需加载分词器）"""
+    return sum(
+        1 if len(token) == 1 else math.ceil(len(token) / 4)
+        for token in _TOKEN_PATTERN.findall(text)
+    )
+
+
+class TextChunk(NamedTuple):
+    """切分出的文本块及其在原文中的字符偏移[start, end)"""
+    text: str
+    start: int
+    end: int
+
+
+class _Unit(NamedTuple):
+    """切分单元（句子或段落片段），相邻单元在原文中首尾相接"""
+    text: str
+    start: int
+    length: int
+
+
+class _ChunkBuilder:
+    """增量组装文本块：逐个接收切分单元，满足大小时输出文本块并保留末尾若干单元作为重叠
+    （末尾单元本身超过重叠长度时保留它的一段结尾）"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, length_function: Callable[[str], int] = len):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+        self._window: "deque[_Unit]" = deque()
+        self._window_length = 0
+        # 窗口中是否有尚未输出过的单元（只剩重叠部分时不再单独输出）
+        self._has_new = False
+
+    def _emit(self) -> Optional[TextChunk]:
+        """输出当前窗口对应的文本块（去掉首尾空白并相应调整偏移）"""
+        raw = "".join(unit.text for unit in self._window)
+        start = self._window[0].start
+        stripped = raw.lstrip()
+        start += len(raw) - len(stripped)
+        stripped = stripped.rstrip()
+        self._has_new = False
+        if not stripped:
+            return None
+        return TextChunk(stripped, start, start + len(stripped))
+
+    def _tail(self, unit: _Unit, budget: int) -> Optional[_Unit]:
+        """取单元末尾长度不超过budget的部分（按长度比例估算字符数，再逐步收缩）"""
+        if budget <= 0 or unit.length <= 0:
+            return None
+        size = min(len(unit.text), len(unit.text) * budget // unit.length)
+        while size > 0:
+            text = unit.text[-size:]
+            length = self.length_function(text)
+            if length <= budget:
+                # 不从英文单词中间开始
+                if text[0].isascii() and text[0].isalnum() and unit.text[-size - 1:-size].isalnum() and " " in text:
+                    cut = text.index(" ") + 1
+                    text, size = text[cut:], size - cut
+                    length = self.length_function(text)
+                return _Unit(text, unit.start + len(unit.text) - size, length)
+            size -= max(1, size // 10)
+        return None
+
+    def add(self, unit: _Unit) -> Optional[TextChunk]:
+        """加入一个单元，若因此需要输出文本块则返回该块"""
+        chunk = None
+        if self._window and self._window_length + unit.length > self.chunk_size:
+            if self._has_new:
+                chunk = self._emit()
+            # 只保留不超过chunk_overlap的末尾单元，并确保与新单元合计不超过chunk_size
+            last = None
+            while self._window and (
+                self._window_length > self.chunk_overlap
+                or self._window_length + unit.length > self.chunk_size
+            ):
+                last = self._window.popleft()
+                self._window_length -= last.length
+            # 连最后一个单元（如较长的中文句子）都放不进重叠时，改为保留它的结尾部分
+            if not self._window and last is not None:
+                tail = self._tail(last, min(self.chunk_overlap, self.chunk_size - unit.length))
+                if tail is not None:
+                    self._window.append(tail)
+                    self._window_length = tail.length
+        self._window.append(unit)
+        self._window_length += unit.length
+        self._has_new = True
+        return chunk
+
+    def finish(self) -> Optional[TextChunk]:
+        """输出剩余内容"""
+        if self._window and self._has_new:
+            return self._emit()
+        return None
+
+
+class ChunkStream:
+    """流式切分：逐块接收文本（如PDF的页、Word的段落），随到随切，偏移相对于所有已接收文本"""
+
+    def __init__(self, splitter: "TextSplitter"):
+        self._splitter = splitter
+        self._builder = _ChunkBuilder(splitter.chunk_size, splitter.chunk_overlap, splitter.length_function)
+        # 尚未遇到边界的末尾文本及其在全文中的起始偏移
+        self._pending = ""
+        self._pending_start = 0
+        # 没有边界的超长文本达到此长度时直接按单元切出，避免反复扫描
+        self._max_pending = max(splitter.chunk_size * 4, 4096)
+
+    def _add_units(self, units: Iterable[_Unit]) -> List[TextChunk]:
+        chunks = []
+        for unit in units:
+            chunk = self._builder.add(unit)
+            if chunk is not None:
+                chunks.append(chunk)
+        return chunks
+
+    def feed(self, text: str) -> List[TextChunk]:
+        """接收一段文本，返回因此而完成的文本块"""
+        buffer = self._pending + text
+        start = self._pending_start
+        chunks = []
+        position = 0
+        for match in _BOUNDARY_PATTERN.finditer(buffer):
+            # 边界恰好位于缓冲区末尾时可能与下一段文本连成更长的边界，留待下次处理
+            if match.end() == len(buffer):
+                break
+            chunks.extend(self._add_units(self._splitter._make_units(buffer[position:match.end()], start + position)))
+            position = match.end()
+        if len(buffer) - position >= self._max_pending:
+            chunks.extend(self._add_units(self._splitter._make_units(buffer[position:], start + position)))
+            position = len(buffer)
+        self._pending = buffer[position:]
+        self._pending_start = start + position
+        return chunks
+
+    def close(self) -> List[TextChunk]:
+        """输入结束，返回剩余的文本块"""
+        chunks = []
+        if self._pending:
+            chunks = self._add_units(self._splitter._make_units(self._pending, self._pending_start))
+            self._pending_start += len(self._pending)
+            self._pending = ""
+        chunk = self._builder.finish()
+        if chunk is not None:
+            chunks.append(chunk)
+        return chunks
+
+
 class TextSplitter:
     def __init__(
         self,
         chunk_size: int = settings.CHUNK_SIZE,
-        chunk_overlap: int = settings.CHUNK_OVERLAP
+        chunk_overlap: int = settings.CHUNK_OVERLAP,
+        length_function: Optional[Callable[[str], int]] = None
     ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap必须小于chunk_size")
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        # 长度计算方式：默认按字符数，CHUNK_SIZE_UNIT为token时按近似token数
+        if length_function is None:
+            length_function = approximate_token_count if settings.CHUNK_SIZE_UNIT == "token" else len
+        self.length_function = length_function
 
-    def split_by_paragraph(self, text: str) -> List[str]:
-        """按段落分割文本"""
-        # 使用多个换行符作为段落分隔符
-        paragraphs = re.split(r'\n\s*\n', text.strip())
-        # 过滤掉空段落
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        return paragraphs
-
-    def merge_short_paragraphs(self, paragraphs: List[str]) -> List[str]:
-        """合并过短的段落"""
-        result = []
-        current_chunk = ""
-        
-        for para in paragraphs:
-            if len(current_chunk) + len(para) <= self.chunk_size:
-                if current_chunk:
-                    current_chunk += "\n\n"
-                current_chunk += para
-            else:
-                if current_chunk:
-                    result.append(current_chunk)
-                current_chunk = para
-        
-        if current_chunk:
-            result.append(current_chunk)
-        
-        return result
-
-    def split_long_paragraph(self, paragraph: str) -> List[str]:
-        """将过长的段落按句子分割"""
-        # 中文句子分隔符
-        sentence_endings = r'[。！？!?]+'
-        sentences = re.split(f'({sentence_endings})', paragraph)
-        chunks = []
-        current_chunk = ""
-        
-        i = 0
-        while i < len(sentences):
-            sentence = sentences[i]
-            # 如果是句子结束符，将其附加到当前句子
-            if i + 1 < len(sentences) and re.match(sentence_endings, sentences[i + 1]):
-                sentence += sentences[i + 1]
-                i += 1
-            
-            if len(current_chunk) + len(sentence) <= self.chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = sentence
-            i += 1
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+    def _make_units(self, text: str, start: int) -> Iterator[_Unit]:
+        """生成一个单元；超过chunk_size的单元按长度比例硬切分为chunk_size - chunk_overlap大小的片段，
+        组装时每块再带上前一片段结尾chunk_overlap长度的重叠"""
+        length = self.length_function(text)
+        if length <= self.chunk_size:
+            yield _Unit(text, start, length)
+            return
+        step = max(1, len(text) * (self.chunk_size - self.chunk_overlap) // length)
+        for offset in range(0, len(text), step):
+            piece = text[offset:offset + step]
+            yield _Unit(piece, start + offset, self.length_function(piece))
 
-    def split_text(self, text: str) -> List[str]:
-        """主分割函数"""
-        # 1. 首先按段落分割
-        paragraphs = self.split_by_paragraph(text)
-        chunks = []
-        
-        # 2. 处理每个段落
-        for para in paragraphs:
-            # 如果段落长度超过chunk_size，需要进一步分割
-            if len(para) > self.chunk_size:
-                chunks.extend(self.split_long_paragraph(para))
-            else:
-                chunks.append(para)
-        
-        # 3. 合并过短的块
-        chunks = self.merge_short_paragraphs(chunks)
-        
-        # 4. 确保所有块都不超过最大长度
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk) > self.chunk_size:
-                final_chunks.extend(self.split_long_paragraph(chunk))
-            else:
-                final_chunks.append(chunk)
-        
-        return final_chunks
+    def stream(self) -> ChunkStream:
+        """创建流式切分器，用于逐页/逐段接收文本的场景"""
+        return ChunkStream(self)
@@ -0,0 +1,55 @@
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional
+from app.config.settings import settings
+
+if TYPE_CHECKING:
+    import jieba
+
+logger = logging.getLogger(__name__)
+
+_tokenizer: Optional["jieba.Tokenizer"] = None
+_lock = threading.Lock()
+
+
+def get_tokenizer() -> "jieba.Tokenizer":
+    """进程内共享的jieba分词器：编译后的词典缓存在DATA_DIR中，并加载自定义词典（jieba在首次使用时才导入）"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _lock:
+            if _tokenizer is None:
+                import jieba
+                tokenizer = jieba.Tokenizer()
+                tokenizer.tmp_dir = settings.DATA_DIR
+                tokenizer.cache_file = "jieba.cache"
+                tokenizer.initialize()
+                user_dict = settings.JIEBA_USER_DICT
+                if user_dict:
+                    if os.path.exists(user_dict):
+                        tokenizer.load_userdict(user_dict)
+                    else:
+                        logger.warning("jieba自定义词典不存在：%s", user_dict)
+                _tokenizer = tokenizer
+    return _tokenizer
+
+
+def warm_up():
+    """预先加载词典（应用启动时调用，避免首个查询承担数秒的加载开销）"""
+    get_tokenizer()
+
+
+def tokenize(text: str) -> List[str]:
+    """使用jieba分词，统一小写并去掉空白词元"""
+    return [token.lower() for token in get_tokenizer().cut(text) if token.strip()]
+
+
+def term_frequencies(texts: List[str]) -> List[Dict[str, int]]:
+    """批量计算词频（可在解析进程池中执行，结果可序列化）"""
+    frequencies = []
+    for text in texts:
+        counts: Dict[str, int] = {}
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+        frequencies.append(counts)
+    return frequencies
@@ -0,0 +1,107 @@
+import os
+import random
+from typing import List, NamedTuple
+
+# 合成中英文混合语料：按主题组织词表，文档由主题词和通用词组成的句子构成，问题取自文档中的句子，便于检查检索是否命中出处
+
+_ZH_CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所"
+    "民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日"
+    "那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想"
+)
+_EN_WORDS = (
+    "system data model index query vector search cache latency throughput memory storage network server client "
+    "request response batch stream token embedding document chunk retrieval ranking score metric pipeline worker "
+    "queue thread process file disk page block buffer schema table column row record update delete insert merge"
+).split()
+
+
+def _zh_word(rng: random.Random) -> str:
+    return "".join(rng.choice(_ZH_CHARS) for _ in range(rng.randint(2, 3)))
+
+
+class Document(NamedTuple):
+    name: str
+    text: str
+    sentences: List[str]
+
+
+class Question(NamedTuple):
+    question: str
+    document: str
+    sentence: str
+
+
+class SyntheticCorpus:
+    """确定性的中英文合成语料（相同的seed和参数生成完全相同的文档和问题）"""
+
+    def __init__(
+        self,
+        documents: int = 50,
+        sentences_per_document: int = 200,
+        english_ratio: float = 0.3,
+        topics: int = 20,
+        seed: int = 42
+    ):
+        rng = random.Random(seed)
+        self._rng = rng
+        # 每个主题有一组专属词，文档主要使用所属主题的词，使不同文档可区分
+        self._topic_words = [
+            [_zh_word(rng) if rng.random() >= english_ratio else f"{rng.choice(_EN_WORDS)}{topic}" for _ in range(40)]
+            for topic in range(topics)
+        ]
+        self._common_words = [_zh_word(rng) for _ in range(200)] + _EN_WORDS
+        self.english_ratio = english_ratio
+        self.documents = [
+            self._make_document(index, index % topics, sentences_per_document)
+            for index in range(documents)
+        ]
+
+    def _make_sentence(self, topic: int) -> str:
+        rng = self._rng
+        words = [
+            rng.choice(self._topic_words[topic]) if rng.random() < 0.5 else rng.choice(self._common_words)
+            for _ in range(rng.randint(6, 16))
+        ]
+        if rng.random() < self.english_ratio:
+            return " ".join(words) + "."
+        return "".join(words) + rng.choice("。！？；")
+
+    def _make_document(self, index: int, topic: int, sentence_count: int) -> Document:
+        sentences = [self._make_sentence(topic) for _ in range(sentence_count)]
+        paragraphs = []
+        position = 0
+        while position < len(sentences):
+            size = self._rng.randint(3, 8)
+            paragraphs.append(" ".join(sentences[position:position + size]))
+            position += size
+        return Document(f"doc_{index:05d}.txt", "\n\n".join(paragraphs) + "\n", sentences)
+
+    def questions(self, count: int, seed: int = 7) -> List[Question]:
+        """从文档中抽取句子，取其中一段连续的词作为问题"""
+        rng = random.Random(seed)
+        questions = []
+        for _ in range(count):
+            document = rng.choice(self.documents)
+            sentence = rng.choice(document.sentences)
+            body = sentence.rstrip("。！？；.")
+            if " " in body:
+                words = body.split()
+                start = rng.randint(0, max(0, len(words) - 4))
+                question = " ".join(words[start:start + 4]) + "?"
+            else:
+                start = rng.randint(0, max(0, len(body) - 8))
+                question = body[start:start + 8] + "？"
+            questions.append(Question(question, document.name, sentence))
+        return questions
+
+    def write(self, directory: str) -> List[str]:
+        """把文档写为UTF-8文本文件，返回文件路径"""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for document in self.documents:
+            path = os.path.join(directory, document.name)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(document.text)
+            paths.append(path)
+        return paths
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+from typing import Dict, List
+import numpy as np
+from aiohttp import web
+
+# 本地Ollama替身：实现/api/embed、/api/rerank、/api/generate，结果确定、延迟可配置，无需GPU即可压测完整链路
+
+_TOKEN_PATTERN = re.compile(r"[一-鿿]|[a-z0-9]+")
+_SCORE_PROMPT = re.compile(r"Query: (.*)\nDocument: (.*)\nScore:$", re.DOTALL)
+
+
+class FakeOllama:
+    """确定性的嵌入/重排序/生成服务。嵌入为词袋哈希向量（每个词对应固定的随机向量，求和后归一化），
+    因此含相同词的文本彼此相近，问题能检索到出处文档"""
+
+    def __init__(
+        self,
+        dim: int = 1024,
+        embed_latency: float = 0.02,
+        embed_item_latency: float = 0.002,
+        rerank_latency: float = 0.02,
+        rerank_item_latency: float = 0.002,
+        first_token_latency: float = 0.1,
+        token_latency: float = 0.01,
+        answer_tokens: int = 32,
+        rerank_endpoint: bool = False
+    ):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.embed_item_latency = embed_item_latency
+        self.rerank_latency = rerank_latency
+        self.rerank_item_latency = rerank_item_latency
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        # 标准Ollama没有/api/rerank，默认不提供，与真实环境一致
+        self.rerank_endpoint = rerank_endpoint
+        self._token_vectors: Dict[str, np.ndarray] = {}
+        self.requests: Dict[str, int] = {"embed": 0, "rerank": 0, "generate": 0}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+
+    def embed(self, text: str) -> np.ndarray:
+        """文本的确定性嵌入向量（单位长度）"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # 没有可识别词的文本（纯符号等）按整段文本取向量
+            vector = self._token_vector(text)
+            norm = np.linalg.norm(vector)
+        return vector / norm
+
+    def relevance(self, query: str, document: str) -> float:
+        """重排序得分：问题中的词在文档中出现的比例"""
+        query_tokens = set(_TOKEN_PATTERN.findall(query.lower()))
+        if not query_tokens:
+            return 0.0
+        document_tokens = set(_TOKEN_PATTERN.findall(document.lower()))
+        return len(query_tokens & document_tokens) / len(query_tokens)
+
+    async def handle_root(self, request: web.Request) -> web.Response:
+        # 与真实Ollama一致，根路径可用于探测服务是否启动
+        return web.Response(text="Ollama is running")
+
+    async def handle_embed(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs: List[str] = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        self.requests["embed"] += 1
+        await asyncio.sleep(self.embed_latency + self.embed_item_latency * len(inputs))
+        embeddings = np.stack([self.embed(text) for text in inputs])
+        return web.json_response({"model": body.get("model"), "embeddings": embeddings.tolist()})
+
+    async def handle_rerank(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        documents: List[str] = body["documents"]
+        self.requests["rerank"] += 1
+        await asyncio.sleep(self.rerank_latency + self.rerank_item_latency * len(documents))
+        results = [
+            {"index": index, "relevance_score": self.relevance(body["query"], document)}
+            for index, document in enumerate(documents)
+        ]
+        results.sort(key=lambda item: item["relevance_score"], reverse=True)
+        return web.json_response({"model": body.get("model"), "results": results})
+
+    async def handle_generate(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests["generate"] += 1
+        match = _SCORE_PROMPT.match(body.get("prompt", ""))
+        if match is not None:
+            # 生成式重排序打分的提示词：按重排序的延迟直接返回分数
+            await asyncio.sleep(self.rerank_latency + self.rerank_item_latency)
+            score = self.relevance(match.group(1), match.group(2))
+            return web.json_response({"model": body.get("model"), "response": f"{score:.4f}", "done": True})
+        tokens = [f"答{index % 10}" for index in range(self.answer_tokens)]
+        await asyncio.sleep(self.first_token_latency)
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_latency * len(tokens))
+            return web.json_response({"model": body.get("model"), "response": "".join(tokens), "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for token in tokens:
+            await response.write((json.dumps({"response": token, "done": False}) + "\n").encode("utf-8"))
+            await asyncio.sleep(self.token_latency)
+        await response.write((json.dumps({"response": "", "done": True}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_get("/", self.handle_root)
+        app.router.add_post("/api/embed", self.handle_embed)
+        if self.rerank_endpoint:
+            app.router.add_post("/api/rerank", self.handle_rerank)
+        app.router.add_post("/api/generate", self.handle_generate)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        """在当前事件循环中启动服务，返回runner（port为0时自动分配端口，可从runner.addresses读取）"""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动本地Ollama替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--rerank-latency", type=float, default=0.02)
+    parser.add_argument("--first-token-latency", type=float, default=0.1)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--rerank-endpoint", action="store_true", help="提供交叉编码器重排序接口/api/rerank")
+    args = parser.parse_args()
+    fake = FakeOllama(
+        dim=args.dim,
+        embed_latency=args.embed_latency,
+        rerank_latency=args.rerank_latency,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        rerank_endpoint=args.rerank_endpoint
+    )
+    web.run_app(fake.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import aiohttp
+import numpy as np
+from benchmarks.corpus import Question, SyntheticCorpus
+
+# 端到端基准测试：生成合成语料，启动Ollama替身和应用（numpy向量后端，数据写入临时目录），
+# 测量入库吞吐、/ask延迟分位数和峰值内存，结果保存为JSON以便跨提交对比
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT, "benchmarks", "results")
+API = "/api/v1"
+_SERVER_TIMING_PATTERN = re.compile(r"([\w-]+);dur=([\d.]+)")
+
+# 与基线对比时输出的指标：(路径, 越大越好)
+_COMPARED_METRICS = [
+    (("ingest", "docs_per_second"), True),
+    (("ingest", "chunks_per_second"), True),
+    (("ask", "p50_ms"), False),
+    (("ask", "p95_ms"), False),
+    (("ask", "p99_ms"), False),
+    (("ask", "requests_per_second"), True),
+    (("memory", "app_peak_rss_mb"), False),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> Dict[str, Optional[str]]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+        return {"commit": commit, "dirty": bool(dirty)}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+    """进程的峰值常驻内存（MB）：Linux读取/proc的VmHWM，其他平台在安装psutil时读取peak_wset（Windows），否则返回None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        peak = getattr(psutil.Process(pid).memory_info(), "peak_wset", None)
+        return peak / (1024 * 1024) if peak is not None else None
+    except Exception:
+        return None
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="local_ai_qa_bench_")
+        self.corpus = SyntheticCorpus(
+            documents=args.docs,
+            sentences_per_document=args.sentences,
+            english_ratio=args.english_ratio,
+            seed=args.seed
+        )
+        self.processes: List[subprocess.Popen] = []
+
+    def _spawn(self, command: List[str], env: Dict[str, str], name: str) -> subprocess.Popen:
+        log = open(os.path.join(self.workdir, f"{name}.log"), "wb")
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start_fake_ollama(self, port: int) -> subprocess.Popen:
+        args = self.args
+        return self._spawn(
+            [
+                sys.executable, "-m", "benchmarks.fake_ollama",
+                "--port", str(port),
+                "--dim", str(args.dim),
+                "--embed-latency", str(args.embed_latency),
+                "--rerank-latency", str(args.rerank_latency),
+                "--first-token-latency", str(args.first_token_latency),
+                "--token-latency", str(args.token_latency),
+            ] + (["--rerank-endpoint"] if args.rerank_mode == "cross_encoder" else []),
+            dict(os.environ),
+            "fake_ollama"
+        )
+
+    def start_app(self, port: int, ollama_port: int) -> subprocess.Popen:
+        data_dir = os.path.join(self.workdir, "data")
+        env = dict(os.environ)
+        env.update({
+            "UPLOAD_DIR": os.path.join(self.workdir, "uploads"),
+            "DATA_DIR": data_dir,
+            "DOCUMENT_REGISTRY_PATH": os.path.join(data_dir, "documents.sqlite3"),
+            "EMBEDDING_CACHE_PATH": os.path.join(data_dir, "embedding_cache.sqlite3"),
+            "BM25_INDEX_PATH": os.path.join(data_dir, "bm25_index.sqlite3"),
+            "NUMPY_STORE_DIR": os.path.join(data_dir, "vectors"),
+            "VECTOR_STORE_BACKEND": "numpy",
+            "VECTOR_DIM": str(self.args.dim),
+            "RERANK_MODE": self.args.rerank_mode,
+            "OLLAMA_BASE_URL": f"http://127.0.0.1:{ollama_port}",
+        })
+        return self._spawn(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning"],
+            env,
+            "app"
+        )
+
+    async def wait_ready(self, session: aiohttp.ClientSession, url: str, timeout: float = 120.0):
+        """等待服务可用（应用需等到后台预热完成）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for process in self.processes:
+                if process.poll() is not None:
+                    raise RuntimeError(f"子进程意外退出，日志见{self.workdir}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        if response.content_type != "application/json" or (await response.json()).get("ready"):
+                            return
+            except (aiohttp.ClientError, ValueError):
+                pass
+            await asyncio.sleep(0.2)
+        raise TimeoutError(f"等待{url}就绪超时")
+
+    async def ingest(self, session: aiohttp.ClientSession, base_url: str) -> Dict:
+        """上传全部文档（队列满返回503时稍后重试），等待所有入库任务结束"""
+        paths = self.corpus.write(os.path.join(self.workdir, "corpus"))
+        total_bytes = sum(os.path.getsize(path) for path in paths)
+        semaphore = asyncio.Semaphore(self.args.upload_concurrency)
+
+        async def upload(path: str) -> str:
+            with open(path, "rb") as f:
+                content = f.read()
+            async with semaphore:
+                while True:
+                    form = aiohttp.FormData()
+                    form.add_field("file", content, filename=os.path.basename(path), content_type="text/plain")
+                    async with session.post(f"{base_url}{API}/upload", data=form) as response:
+                        if response.status == 503:
+                            await asyncio.sleep(0.1)
+                            continue
+                        response.raise_for_status()
+                        return (await response.json())["job_id"]
+
+        async def wait_job(job_id: str) -> Dict:
+            while True:
+                async with session.get(f"{base_url}{API}/jobs/{job_id}") as response:
+                    response.raise_for_status()
+                    job = await response.json()
+                if job["status"] in ("completed", "failed"):
+                    return job
+                await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        job_ids = await asyncio.gather(*[upload(path) for path in paths])
+        jobs = await asyncio.gather(*[wait_job(job_id) for job_id in job_ids])
+        elapsed = time.perf_counter() - started
+
+        completed = [job for job in jobs if job["status"] == "completed"]
+        chunks = sum(job["chunk_count"] for job in completed)
+        return {
+            "documents": len(paths),
+            "failed": len(jobs) - len(completed),
+            "chunks": chunks,
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "docs_per_second": round(len(completed) / elapsed, 2),
+            "chunks_per_second": round(chunks / elapsed, 2),
+            "mb_per_second": round(total_bytes / elapsed / (1024 * 1024), 3),
+        }
+
+    async def ask(self, session: aiohttp.ClientSession, base_url: str, questions: List[Question]) -> Dict:
+        """按固定并发发送/ask请求，统计延迟分位数、出处命中率和Server-Timing各阶段平均耗时"""
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies: List[float] = []
+        stage_totals: Dict[str, List[float]] = {}
+        errors = 0
+        hits = 0
+
+        async def ask_one(question: Question):
+            nonlocal errors, hits
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(f"{base_url}{API}/ask", json={"question": question.question}) as response:
+                    body = await response.json()
+                    elapsed = time.perf_counter() - started
+                    server_timing = response.headers.get("Server-Timing", "")
+            if response.status != 200:
+                errors += 1
+                return
+            latencies.append(elapsed)
+            needle = question.question.rstrip("?？")
+            if any(needle in chunk for chunk in body["source_chunks"]):
+                hits += 1
+            for stage, duration in _SERVER_TIMING_PATTERN.findall(server_timing):
+                stage_totals.setdefault(stage, []).append(float(duration))
+
+        # 预热：建立连接、加载索引到页缓存，不计入结果
+        await asyncio.gather(*[ask_one(question) for question in questions[:self.args.warmup]])
+        latencies.clear()
+        stage_totals.clear()
+        errors = hits = 0
+
+        measured = questions[self.args.warmup:]
+        started = time.perf_counter()
+        await asyncio.gather(*[ask_one(question) for question in measured])
+        elapsed = time.perf_counter() - started
+
+        result = {
+            "questions": len(measured),
+            "concurrency": self.args.concurrency,
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+            "source_hit_rate": round(hits / len(latencies), 3) if latencies else None,
+        }
+        result.update(_percentiles(latencies))
+        result["server_timing_mean_ms"] = {
+            stage: round(sum(values) / len(values), 2) for stage, values in stage_totals.items()
+        }
+        return result
+
+    async def run(self) -> Dict:
+        args = self.args
+        ollama_port = _free_port()
+        app_port = _free_port()
+        base_url = f"http://127.0.0.1:{app_port}"
+        fake = self.start_fake_ollama(ollama_port)
+        app = self.start_app(app_port, ollama_port)
+        try:
+            timeout = aiohttp.ClientTimeout(total=600)
+            connector = aiohttp.TCPConnector(limit=max(args.concurrency, args.upload_concurrency) + 8)
+            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+                await self.wait_ready(session, f"http://127.0.0.1:{ollama_port}/")
+                startup_started = time.perf_counter()
+                await self.wait_ready(session, f"{base_url}/health")
+                startup = time.perf_counter() - startup_started
+
+                ingest = await self.ingest(session, base_url)
+                questions = self.corpus.questions(args.questions + args.warmup, seed=args.seed + 1)
+                ask = await self.ask(session, base_url, questions)
+
+            workers = [_peak_rss_mb(pid) for pid in _children(app.pid)]
+            memory = {
+                "app_peak_rss_mb": _round(_peak_rss_mb(app.pid)),
+                "worker_processes": len(workers),
+                "workers_peak_rss_mb": _round(sum(value for value in workers if value is not None)) if workers else None,
+                "fake_ollama_peak_rss_mb": _round(_peak_rss_mb(fake.pid)),
+            }
+        finally:
+            self.stop()
+
+        return {
+            "git": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                key: value for key, value in vars(args).items() if key not in ("output", "baseline")
+            },
+            "startup_seconds": round(startup, 3),
+            "ingest": ingest,
+            "ask": ask,
+            "memory": memory,
+        }
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+def _lookup(result: Dict, path) -> Optional[float]:
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+
+def compare(result: Dict, baseline: Dict) -> str:
+    """与基线结果逐项对比，标出变好（+）或变差（-）的幅度"""
+    lines = [f"对比基线 {baseline.get('git', {}).get('commit')} ({baseline.get('timestamp')})"]
+    for path, higher_is_better in _COMPARED_METRICS:
+        current, previous = _lookup(result, path), _lookup(baseline, path)
+        name = ".".join(path)
+        if current is None or previous is None or previous == 0:
+            lines.append(f"  {name:<28} {previous!s:>10} -> {current!s:>10}")
+            continue
+        change = (current - previous) / previous
+        better = change > 0 if higher_is_better else change < 0
+        mark = "+" if better else "-" if change != 0 else " "
+        lines.append(f"  {name:<28} {previous:>10} -> {current:>10}  {change:+.1%} {mark}")
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地知识库问答系统的端到端基准测试（无需GPU和Milvus）")
+    parser.add_argument("--docs", type=int, default=50, help="合成文档数")
+    parser.add_argument("--sentences", type=int, default=200, help="每篇文档的句子数")
+    parser.add_argument("--english-ratio", type=float, default=0.3, help="英文句子的比例")
+    parser.add_argument("--questions", type=int, default=200, help="计入结果的/ask请求数")
+    parser.add_argument("--warmup", type=int, default=10, help="预热请求数（不计入结果）")
+    parser.add_argument("--concurrency", type=int, default=8, help="/ask的并发请求数")
+    parser.add_argument("--upload-concurrency", type=int, default=4, help="并发上传数")
+    parser.add_argument("--dim", type=int, default=1024, help="嵌入向量维度")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Ollama替身每次嵌入请求的固定延迟（秒）")
+    parser.add_argument("--rerank-latency", type=float, default=0.02, help="每次重排序请求的固定延迟（秒）")
+    parser.add_argument("--first-token-latency", type=float, default=0.1, help="生成首token延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="生成每个token的延迟（秒）")
+    parser.add_argument(
+        "--rerank-mode",
+        choices=["generate", "cross_encoder"],
+        default="generate",
+        help="重排序方式（cross_encoder时Ollama替身才提供/api/rerank，与标准Ollama的差异一致）"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="语料随机种子")
+    parser.add_argument("--output", default=None, help="结果JSON路径（默认写入benchmarks/results/）")
+    parser.add_argument("--baseline", default=None, help="作为对比基线的结果JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    result = asyncio.run(Benchmark(args).run())
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(DEFAULT_OUTPUT_DIR, f"{stamp}-{result['git']['commit'] or 'unknown'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps({key: result[key] for key in ("ingest", "ask", "memory")}, ensure_ascii=False, indent=2))
+    print(f"结果已保存到 {output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print(compare(result, json.load(f)))
+
+
+if __name__ == "__main__":
+    main()
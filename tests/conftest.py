@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+# 导入app前把各持久化路径指向临时目录，测试不读写仓库中的data/、uploads/
+_TMP_DIR = tempfile.mkdtemp(prefix="local_ai_qa_tests_")
+os.environ.setdefault("DATA_DIR", _TMP_DIR)
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_TMP_DIR, "uploads"))
+os.environ.setdefault("DOCUMENT_REGISTRY_PATH", os.path.join(_TMP_DIR, "documents.sqlite3"))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_TMP_DIR, "embedding_cache.sqlite3"))
+os.environ.setdefault("BM25_INDEX_PATH", os.path.join(_TMP_DIR, "bm25_index.sqlite3"))
+os.environ.setdefault("NUMPY_STORE_DIR", os.path.join(_TMP_DIR, "vectors"))
+os.environ.setdefault("VECTOR_STORE_BACKEND", "numpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+
+import pytest
+
+from app.services import bm25_index as bm25_module
+from app.services.bm25_index import BM25Index
+
+VOCABULARY = [f"w{i}" for i in range(60)]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # 测试语料按空格分词，不依赖jieba词典
+    monkeypatch.setattr(bm25_module, "tokenize", lambda text: text.split())
+    index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    yield index
+    index.close()
+
+
+def _corpus(rng: random.Random, count: int, start: int = 0):
+    chunks = []
+    for i in range(start, start + count):
+        # 词频呈长尾分布，少数词元出现在大量文档块中
+        words = [VOCABULARY[min(int(rng.expovariate(0.08)), len(VOCABULARY) - 1)] for _ in range(rng.randint(3, 40))]
+        chunks.append({"chunk_id": f"c{i}", "doc_id": f"d{i // 5}", "content": " ".join(words)})
+    return chunks
+
+
+def _exhaustive(index: BM25Index, query: str):
+    """不剪枝、对每个文档块计算完整BM25得分"""
+    query_terms = Counter(query.split())
+    avgdl = index._total_length / len(index._chunks)
+    scores = {}
+    for term, qtf in query_terms.items():
+        if term not in index._postings:
+            continue
+        idf = index._idf(term)
+        for chunk_id, tf in index._postings[term].items():
+            score = qtf * index._term_score(tf, index._chunks[chunk_id]["length"], idf, avgdl)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+    return scores
+
+
+def _assert_matches_exhaustive(index: BM25Index, query: str, top_k: int):
+    expected = _exhaustive(index, query)
+    results = index.search(query, top_k=top_k)
+    expected_scores = sorted(expected.values(), reverse=True)[:top_k]
+    assert [result["score"] for result in results] == pytest.approx(expected_scores)
+    for result in results:
+        assert result["score"] == pytest.approx(expected[result["chunk_id"]])
+
+
+@pytest.mark.parametrize("top_k", [1, 5, 20])
+def test_maxscore_matches_exhaustive_scoring(index, top_k):
+    rng = random.Random(top_k)
+    index.add_chunks(_corpus(rng, 400))
+    for _ in range(50):
+        query = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 6)))
+        _assert_matches_exhaustive(index, query, top_k)
+
+
+def test_maxscore_matches_after_updates(index):
+    rng = random.Random(7)
+    index.add_chunks(_corpus(rng, 300))
+    index.remove_chunks([f"c{i}" for i in range(0, 300, 3)])
+    # 重新写入已有chunk_id视为替换
+    index.add_chunks(_corpus(rng, 50, start=100) + _corpus(rng, 50, start=300))
+    for _ in range(50):
+        query = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 6)))
+        _assert_matches_exhaustive(index, query, 10)
+
+
+def test_pre_tokenized_chunks_and_persistence(tmp_path, index):
+    index.add_chunks([
+        {"chunk_id": "a", "doc_id": "d", "content": "苹果 香蕉", "term_freqs": {"苹果": 3, "香蕉": 1}},
+        {"chunk_id": "b", "doc_id": "d", "content": "香蕉", "term_freqs": {"香蕉": 2}},
+    ])
+    assert [result["chunk_id"] for result in index.search("苹果", top_k=5)] == ["a"]
+    index.close()
+
+    reopened = BM25Index(index.path)
+    assert len(reopened) == 2
+    assert [result["chunk_id"] for result in reopened.search("香蕉", top_k=1)] == ["b"]
+    assert reopened.search("不存在", top_k=5) == []
+    reopened.close()
@@ -0,0 +1,129 @@
+import asyncio
+from typing import Dict, List
+
+import numpy as np
+
+from app.services.document_registry import DocumentRegistry
+from app.services.ingestion_service import IngestionService
+from app.utils.text_splitter import TextChunk
+
+
+class FakeProcessor:
+    """按文件路径返回预设的文档块"""
+
+    def __init__(self, files: Dict[str, List[str]]):
+        self.files = files
+
+    async def iter_chunks(self, file_path, original_filename, on_progress=None):
+        for text in self.files[file_path]:
+            yield TextChunk(text, 0, len(text))
+        if on_progress is not None:
+            on_progress(1.0)
+
+
+class FakeEmbeddingService:
+    async def get_embeddings_batch(self, texts, batch_size=None, persist=True):
+        return np.zeros((len(texts), 4), dtype=np.float32)
+
+
+class FakeExtractionPool:
+    async def tokenize(self, texts):
+        return [{} for _ in texts]
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.chunk_ids: List[str] = []
+        self.deleted: List[str] = []
+
+    async def insert_chunks(self, chunks):
+        self.chunk_ids.extend(chunks.chunk_ids)
+
+    async def delete_by_chunk_ids(self, chunk_ids):
+        self.deleted.extend(chunk_ids)
+        self.chunk_ids = [chunk_id for chunk_id in self.chunk_ids if chunk_id not in set(chunk_ids)]
+
+    async def flush_buffer(self, seal=False):
+        pass
+
+
+class FakeBM25Index:
+    def __init__(self):
+        self.removed: List[str] = []
+
+    def add_chunks(self, rows):
+        pass
+
+    def remove_chunks(self, chunk_ids):
+        self.removed.extend(chunk_ids)
+
+
+def _service(tmp_path, files):
+    vector_store = FakeVectorStore()
+    service = IngestionService(FakeProcessor(files), FakeEmbeddingService(), vector_store)
+    service.bm25_index = FakeBM25Index()
+    service.document_registry = DocumentRegistry(str(tmp_path / "documents.sqlite3"))
+    service.extraction_pool = FakeExtractionPool()
+    return service, vector_store
+
+
+def test_replace_reuses_unchanged_chunks_and_removes_only_stale_ones(tmp_path):
+    files = {
+        "v1": ["段落一", "段落二", "段落三", "段落四"],
+        "v2": ["段落一", "段落二（修改）", "段落三", "段落四", "段落五"],
+    }
+    service, vector_store = _service(tmp_path, files)
+
+    async def run():
+        await service.start()
+        try:
+            job = service.submit("v1", "a.txt", content_hash="h1")
+            await job.finished.wait()
+            assert job.status == "completed", job.error
+            old_chunks = service.document_registry.get_chunks(job.doc_id)
+
+            replace = service.submit_replace(job.doc_id, "v2", "a.txt", 0, "h2")
+            await replace.finished.wait()
+            assert replace.status == "completed", replace.error
+            return job, replace, old_chunks
+        finally:
+            await service.stop()
+
+    job, replace, old_chunks = asyncio.run(run())
+
+    assert replace.reused_chunk_count == 3
+    assert replace.removed_chunk_count == 1
+    assert vector_store.deleted == [old_chunks[1]["chunk_id"]]
+    assert service.bm25_index.removed == [old_chunks[1]["chunk_id"]]
+
+    new_chunks = service.document_registry.get_chunks(job.doc_id)
+    assert len(new_chunks) == 5
+    for position in (0, 2, 3):
+        assert new_chunks[position]["chunk_id"] == old_chunks[position]["chunk_id"]
+    assert sorted(vector_store.chunk_ids) == sorted(chunk["chunk_id"] for chunk in new_chunks)
+    assert service.document_registry.hidden_count() == 0
+    service.document_registry.close()
+
+
+def test_replace_handles_duplicate_chunks(tmp_path):
+    # 内容相同的多个块各自复用一个旧块，多出来的旧块被删除
+    files = {"v1": ["重复", "重复", "重复"], "v2": ["重复", "其他"]}
+    service, vector_store = _service(tmp_path, files)
+
+    async def run():
+        await service.start()
+        try:
+            job = service.submit("v1", "a.txt", content_hash="h1")
+            await job.finished.wait()
+            replace = service.submit_replace(job.doc_id, "v2", "a.txt", 0, "h2")
+            await replace.finished.wait()
+            assert replace.status == "completed", replace.error
+            return replace
+        finally:
+            await service.stop()
+
+    replace = asyncio.run(run())
+    assert replace.reused_chunk_count == 1
+    assert replace.removed_chunk_count == 2
+    assert len(vector_store.chunk_ids) == 2
+    service.document_registry.close()
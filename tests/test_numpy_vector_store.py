@@ -0,0 +1,133 @@
+import asyncio
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from app.config.settings import settings
+from app.services.numpy_vector_store import NumpyVectorStore
+from app.services.retrieval_service import RetrievalService
+from app.services.vector_store import ChunkBatch
+
+DIM = 8
+
+
+def _batch(doc_id: str, vectors: np.ndarray, prefix: str = "") -> ChunkBatch:
+    chunk_ids = [f"{prefix}{doc_id}-{i}" for i in range(len(vectors))]
+    return ChunkBatch(
+        [f"id-{chunk_id}" for chunk_id in chunk_ids],
+        [doc_id] * len(vectors),
+        chunk_ids,
+        [f"content {chunk_id}" for chunk_id in chunk_ids],
+        vectors
+    )
+
+
+def _unit(index: int) -> np.ndarray:
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[index % DIM] = 1.0
+    return vector
+
+
+def test_insert_search_delete_and_reopen(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+
+    async def run():
+        await store.insert_chunks(_batch("a", np.stack([_unit(0), _unit(1)])), wait_for_durability=True)
+        await store.insert_chunks(_batch("b", np.stack([_unit(2), _unit(3)])))
+        hits = await store.search_similar(_unit(2), top_k=1)
+        assert [hit["chunk_id"] for hit in hits] == ["b-0"]
+        assert hits[0]["doc_id"] == "b" and hits[0]["content"] == "content b-0"
+        assert hits[0]["score"] == pytest.approx(1.0)
+
+        batch = await store.search_similar_batch(np.stack([_unit(0), _unit(3)]), top_k=2)
+        assert [hit["chunk_id"] for hit in batch[0]][0] == "a-0"
+        assert [hit["chunk_id"] for hit in batch[1]][0] == "b-1"
+
+        await store.delete_by_doc_id("a")
+        await store.delete_by_chunk_ids(["b-1"])
+        hits = await store.search_similar(_unit(0), top_k=10)
+        assert [hit["chunk_id"] for hit in hits] == ["b-0"]
+
+    asyncio.run(run())
+    assert store.count() == 1
+    store.close()
+
+    reopened = NumpyVectorStore(str(tmp_path), dim=DIM)
+    assert reopened.count() == 1
+    hits = asyncio.run(reopened.search_similar(_unit(2), top_k=5))
+    assert [hit["chunk_id"] for hit in hits] == ["b-0"]
+    reopened.close()
+
+
+def test_empty_store_is_kept_by_retrieval_service(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+    assert RetrievalService(store).vector_store is store
+    assert store.count() == 0
+    store.close()
+
+
+def test_reinserting_a_chunk_id_replaces_it(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+
+    async def run():
+        await store.insert_chunks(_batch("a", np.stack([_unit(0)])))
+        await store.insert_chunks(_batch("a", np.stack([_unit(5)])))
+        return await store.search_similar(_unit(5), top_k=5)
+
+    hits = asyncio.run(run())
+    assert [hit["chunk_id"] for hit in hits] == ["a-0"]
+    assert hits[0]["score"] == pytest.approx(1.0)
+    assert store.count() == 1
+    store.close()
+
+
+def test_compaction_rewrites_live_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "NUMPY_STORE_COMPACT_RATIO", 0.5)
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+    vectors = np.stack([_unit(i) + 0.01 * i for i in range(20)])
+
+    async def run():
+        await store.insert_chunks(_batch("a", vectors[:15]))
+        await store.insert_chunks(_batch("b", vectors[15:]))
+        await store.delete_by_doc_id("a")
+        await store.shutdown()
+
+    asyncio.run(run())
+    files = glob.glob(os.path.join(str(tmp_path), "vectors.*"))
+    assert [os.path.basename(path) for path in files] == ["vectors.1.float32"]
+    assert store.count() == 5
+    for i in range(15, 20):
+        hits = asyncio.run(store.search_similar(vectors[i], top_k=1))
+        assert hits[0]["chunk_id"] == f"b-{i - 15}"
+    store.close()
+
+    reopened = NumpyVectorStore(str(tmp_path), dim=DIM)
+    assert reopened.count() == 5
+    hits = asyncio.run(reopened.search_similar(vectors[17], top_k=1))
+    assert hits[0]["chunk_id"] == "b-2"
+    reopened.close()
+
+
+def test_rows_lost_before_reaching_disk_are_dropped_on_reopen(tmp_path):
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+
+    async def run():
+        await store.insert_chunks(_batch("a", np.stack([_unit(0), _unit(1)])), wait_for_durability=True)
+        await store.insert_chunks(_batch("b", np.stack([_unit(2), _unit(3)])))
+
+    asyncio.run(run())
+    # 模拟系统崩溃：元数据已提交，但未落盘的向量（第3行）没有写到磁盘
+    store._vectors[3] = 0
+    store._vectors.flush()
+
+    reopened = NumpyVectorStore(str(tmp_path), dim=DIM)
+    assert reopened.count() == 3
+    hits = asyncio.run(reopened.search_similar(_unit(3), top_k=5))
+    assert "b-1" not in [hit["chunk_id"] for hit in hits]
+    # 已提交并落盘的行不受影响
+    hits = asyncio.run(reopened.search_similar(_unit(2), top_k=1))
+    assert hits[0]["chunk_id"] == "b-0"
+    reopened.close()
+    store._conn.close()
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config.settings import settings
+from app.main import app
+from app.services.container import get_services
+from app.services.ollama_client import OllamaClient, OllamaResponse
+from app.services.ollama_scheduler import BULK, INTERACTIVE, OllamaBusyError, OllamaScheduler, use_lane
+
+
+def _scheduler(total: int = 1, interactive_queue: int = 0, bulk_queue: int = 0) -> OllamaScheduler:
+    return OllamaScheduler(total, {INTERACTIVE: (total, interactive_queue), BULK: (total, bulk_queue)})
+
+
+def test_interactive_waiters_go_before_bulk_waiters():
+    scheduler = _scheduler()
+    order = []
+
+    async def call(name, lane, release):
+        async with scheduler.slot(lane):
+            order.append(name)
+            await release.wait()
+
+    async def run():
+        release = asyncio.Event()
+        holder = asyncio.create_task(call("holder", BULK, release))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(call("bulk", BULK, release))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(call("interactive", INTERACTIVE, release)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+    asyncio.run(run())
+    assert order == ["holder", "interactive", "bulk"]
+
+
+def test_full_queue_raises_busy_and_cancelled_waiter_leaves_queue():
+    scheduler = _scheduler(interactive_queue=1)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot(INTERACTIVE):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(OllamaBusyError) as excinfo:
+            async with scheduler.slot(INTERACTIVE):
+                pass
+        assert excinfo.value.lane == INTERACTIVE
+        assert excinfo.value.retry_after == settings.OLLAMA_BUSY_RETRY_AFTER
+
+        # 排队中的请求取消后让出排队位置
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, queued)
+        assert scheduler._active == 0
+
+    asyncio.run(run())
+
+
+def test_busy_error_maps_to_429():
+    class BusyAIService:
+        async def generate_answer(self, question, nprobe=None, ef=None):
+            raise OllamaBusyError(INTERACTIVE, 7)
+
+    class Services:
+        ai_service = BusyAIService()
+
+    app.dependency_overrides[get_services] = lambda: Services()
+    try:
+        response = TestClient(app).post(f"{settings.API_V1_STR}/ask", json={"question": "问题"})
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+
+
+class _CountingClient(OllamaClient):
+    """上游调用计数、可控制何时返回的客户端"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def _fetch(self, path, json, timeout):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return OllamaResponse(200, b'{"n": %d}' % self.calls)
+
+
+def test_single_flight_coalesces_identical_requests():
+    async def run():
+        client = _CountingClient()
+        tasks = [asyncio.create_task(client.request("/api/embed", {"input": ["a"]})) for _ in range(3)]
+        other = asyncio.create_task(client.request("/api/embed", {"input": ["b"]}))
+        with use_lane(BULK):
+            bulk = asyncio.create_task(client.request("/api/embed", {"input": ["a"]}))
+        await asyncio.sleep(0)
+        client.release.set()
+        results = await asyncio.gather(*tasks)
+        await asyncio.gather(other, bulk)
+        assert client.calls == 3  # 相同请求一次，不同请求体一次，bulk通道一次
+        assert len({id(result) for result in results}) == 1
+        assert client._inflight == {}
+
+        # 上游调用结束后，相同请求重新调用
+        await client.request("/api/embed", {"input": ["a"]})
+        assert client.calls == 4
+
+    asyncio.run(run())
+
+
+def test_single_flight_cancels_upstream_only_when_all_callers_leave():
+    async def run():
+        client = _CountingClient()
+        first = asyncio.create_task(client.request("/api/generate", {"prompt": "p"}))
+        second = asyncio.create_task(client.request("/api/generate", {"prompt": "p"}))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert client.cancelled == 0
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert client.cancelled == 1
+        assert client._inflight == {}
+
+        # 取消后的相同请求重新调用，不会拿到已取消的任务
+        client.release.set()
+        response = await client.request("/api/generate", {"prompt": "p"})
+        assert response.json() == {"n": 2}
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+from typing import List
+
+import pytest
+
+from app.utils.text_splitter import TextChunk, TextSplitter, approximate_token_count
+
+
+def _split(splitter: TextSplitter, *blocks: str) -> List[TextChunk]:
+    stream = splitter.stream()
+    chunks = []
+    for block in blocks:
+        chunks.extend(stream.feed(block))
+    chunks.extend(stream.close())
+    return chunks
+
+
+def _assert_offsets(text: str, chunks: List[TextChunk]):
+    for chunk in chunks:
+        assert text[chunk.start:chunk.end] == chunk.text
+
+
+def test_hard_split_keeps_overlap():
+    text = "a" * 1000
+    chunks = _split(TextSplitter(chunk_size=100, chunk_overlap=20), text)
+    _assert_offsets(text, chunks)
+    assert chunks[0].start == 0
+    assert chunks[-1].end == len(text)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert len(current.text) <= 100
+        assert previous.end - current.start == 20
+
+
+def test_hard_split_keeps_overlap_in_tokens():
+    text = " ".join(f"word{i}" for i in range(500))
+    splitter = TextSplitter(chunk_size=100, chunk_overlap=20, length_function=approximate_token_count)
+    chunks = _split(splitter, text)
+    _assert_offsets(text, chunks)
+    assert chunks[-1].end == len(text)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert approximate_token_count(current.text) <= 100
+        assert current.start < previous.end
+
+
+def test_sentence_overlap_and_offsets():
+    sentences = [f"这是第{i}个句子，内容长度适中。" for i in range(20)]
+    text = "".join(sentences)
+    chunks = _split(TextSplitter(chunk_size=60, chunk_overlap=20), text)
+    _assert_offsets(text, chunks)
+    assert chunks[-1].end == len(text)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert len(current.text) <= 60
+        # 重叠部分是前一块末尾的完整句子
+        overlap = text[current.start:previous.end]
+        assert overlap and overlap.endswith("。") and overlap in sentences
+
+
+def test_offsets_skip_surrounding_whitespace():
+    text = "  第一段内容。\n\n  第二段内容。  "
+    chunks = _split(TextSplitter(chunk_size=12, chunk_overlap=0), text)
+    _assert_offsets(text, chunks)
+    assert [chunk.text for chunk in chunks] == ["第一段内容。", "第二段内容。"]
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 50])
+def test_stream_blocks_match_single_feed(block_size):
+    text = "".join(f"第{i}段。这里有一些文字！还有问句吗？\n\n" for i in range(30))
+    splitter = TextSplitter(chunk_size=50, chunk_overlap=10)
+    blocks = [text[i:i + block_size] for i in range(0, len(text), block_size)]
+    assert _split(splitter, *blocks) == _split(splitter, text)
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TextSplitter(chunk_size=10, chunk_overlap=10)